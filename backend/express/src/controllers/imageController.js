@@ -1,5 +1,6 @@
 const fs = require("fs");
 const path = require("path");
+const axios = require("axios");
 const Image = require("../models/imageModel");
 const Category = require("../models/categoryModel");
 
@@ -15,6 +16,35 @@ const allowedCategories = [
   "autre"
 ];
 
+// Keep the Flask descriptor index in sync with the images collection
+const FLASK_API = "http://localhost:5001/api";
+
+const syncDescriptorIndex = async (imageId, method) => {
+  try {
+    await axios({ method, url: `${FLASK_API}/index/images/${imageId}` });
+  } catch (err) {
+    console.error(`Failed to sync descriptor index for image ${imageId}:`, err.message);
+  }
+};
+
+// Ask the Flask service which stored uploads duplicate a catalog image or an earlier
+// file of the same upload. Resolves to { filename: { matches } | { error } }.
+// If the service is unreachable the uploads are treated as unique; if it answers
+// with an error the check fails.
+const findDuplicates = async (filenames) => {
+  try {
+    const response = await axios.post(`${FLASK_API}/images/duplicates`, { filenames });
+    return Object.fromEntries(response.data.results.map((result) => [result.filename, result]));
+  } catch (err) {
+    if (err.response) {
+      const message = (err.response.data && err.response.data.error) || err.message;
+      throw new Error(`Duplicate check failed (${err.response.status}): ${message}`);
+    }
+    console.error("Failed to check uploads for duplicates:", err.message);
+    return {};
+  }
+};
+
 // Upload Image
 const uploadImage = async (req, res) => {
   try {
@@ -34,7 +64,40 @@ const uploadImage = async (req, res) => {
       return res.status(400).json({ error: "Invalid category" });
     }
 
-    const images = req.files.map((file) => ({
+    // Reject files that are (near-)duplicates of catalog images or of an earlier file
+    // of this upload unless allowDuplicates is set
+    const allowDuplicates = req.body.allowDuplicates === "true";
+    const files = [];
+    const duplicates = [];
+    const failed = [];
+    let checks = {};
+    let checkError = null;
+    if (!allowDuplicates) {
+      try {
+        checks = await findDuplicates(req.files.map((file) => file.filename));
+      } catch (err) {
+        console.error("Failed to check uploads for duplicates:", err.message);
+        checkError = err.message;
+      }
+    }
+    for (const file of req.files) {
+      const check = checks[file.filename] || {};
+      const error = checkError || check.error;
+      if (error) {
+        fs.unlink(file.path, () => {});
+        failed.push({ file: file.originalname, error });
+        continue;
+      }
+      const matches = check.matches || [];
+      if (matches.length > 0) {
+        fs.unlink(file.path, () => {});
+        duplicates.push({ file: file.originalname, duplicateOf: matches[0] });
+      } else {
+        files.push(file);
+      }
+    }
+
+    const images = files.map((file) => ({
       filename: file.filename,
       path: file.path,
       size: file.size,
@@ -44,9 +107,11 @@ const uploadImage = async (req, res) => {
 
     const savedImages = await Image.insertMany(images);
     res.status(200).json({
-      message: "Images uploaded successfully!",
-      files: req.files,
+      message: files.length > 0 ? "Images uploaded successfully!" : "No images were uploaded",
+      files,
       dbRecords: savedImages,
+      duplicates,
+      failed,
     });
   } catch (err) {
     console.error("Error uploading images:", err);
@@ -98,6 +163,7 @@ const deleteImage = async (req, res) => {
 
     // Delete the image document from the database
     await Image.deleteOne({ _id: imageId });
+    await syncDescriptorIndex(imageId, "delete");
 
     res.status(200).json({ message: "Image deleted successfully" });
   } catch (err) {
@@ -123,10 +189,10 @@ const assignCategory = async (req, res) => {
       return res.status(400).json({ error: "Invalid category name." });
     }
 
-    // Update the image's category
+    // Update the image's category; indexedAt tells the Flask index to re-read it
     const updatedImage = await Image.findByIdAndUpdate(
       imageId,
-      { category: category._id },
+      { category: category._id, indexedAt: new Date() },
       { new: true }
     ).populate("category"); // Populate the category field for the response
 
@@ -188,6 +254,9 @@ const deleteMultipleImages = async (req, res) => {
 
     // Delete images from the database
     await Image.deleteMany({ _id: { $in: imageIds } });
+    await Promise.all(
+      imagesToDelete.map((image) => syncDescriptorIndex(image._id, "delete"))
+    );
 
     res.status(200).json({ message: "Images deleted successfully" });
   } catch (err) {
@@ -11,6 +11,10 @@ const imageSchema = new mongoose.Schema({
     required: true,
   },
   descriptors: { type: Object },
+  // Last change the Flask descriptor index has to pick up (descriptors or category)
+  indexedAt: { type: Date },
+  // Set by the Flask service when the image is a near-duplicate of an older image
+  duplicateOf: { type: mongoose.Schema.Types.ObjectId, ref: "Image" },
 });
 
 module.exports = mongoose.model("Image", imageSchema);
@@ -2,7 +2,6 @@ const fs = require("fs");
 const path = require("path");
 const mongoose = require("mongoose");
 const axios = require("axios"); // Use Axios for HTTP requests
-const Image = require("./models/imageModel");
 const Category = require("./models/categoryModel");
 require("dotenv").config();
 
@@ -43,48 +42,48 @@ mongoose
         continue;
       }
 
-      const files = fs.readdirSync(categoryDir);
-
-      for (const file of files) {
-        const filePath = path.join(categoryDir, file);
-        const stats = fs.statSync(filePath);
-
-        // Check if the image already exists in the database
-        const existingImage = await Image.findOne({ filename: file });
-        if (existingImage) {
-          console.log(`Image '${file}' already exists. Skipping.`);
-          continue;
-        }
-
-        // Save the image metadata in MongoDB
-        try {
-          const image = new Image({
-            filename: file,
-            path: filePath,
-            size: stats.size,
-            category: categoryDoc._id,
-          });
-          await image.save();
+      // Let the Flask service compute descriptors for the whole folder in parallel.
+      // It saves the images in bulk and streams back one NDJSON line per image,
+      // skipping images that duplicate ones already in the catalog.
+      try {
+        const response = await axios.post(
+          "http://localhost:5001/api/descriptors/compute-batch",
+          {
+            directory: categoryDir,
+            category: categoryName,
+            skip_existing: true,
+            reject_duplicates: true,
+          },
+          { responseType: "stream" }
+        );
 
-          // Send image to Flask API for descriptor computation
-          const response = await axios.post(
-            "http://localhost:5001/api/descriptors/compute",
-            {
-              filename: filePath,
+        await new Promise((resolve, reject) => {
+          let buffer = "";
+          response.data.on("data", (chunk) => {
+            buffer += chunk.toString();
+            const lines = buffer.split("\n");
+            buffer = lines.pop();
+            for (const line of lines.filter((l) => l.trim())) {
+              const result = JSON.parse(line);
+              if (result.status === "success") {
+                console.log(`Descriptors for '${result.filename}' computed and saved.`);
+              } else if (result.status === "duplicate") {
+                console.log(`Skipped '${result.filename}': duplicate of '${result.duplicate_of}'.`);
+              } else if (result.status === "error") {
+                console.error(`Failed to compute descriptors for '${result.filename}': ${result.message}`);
+              } else {
+                console.log(
+                  `Folder '${folderName}': ${result.processed} processed, ${result.failed} failed, ` +
+                    `${result.duplicates} duplicates, ${result.written} saved.`
+                );
+              }
             }
-          );
-
-          if (response.data && response.data.descriptors) {
-            // Update the image with the computed descriptors
-            image.descriptors = response.data.descriptors;
-            await image.save();
-            console.log(`Descriptors for '${file}' computed and saved.`);
-          } else {
-            console.error(`Failed to compute descriptors for '${file}'.`);
-          }
-        } catch (error) {
-          console.error(`Error processing image '${file}':`, error);
-        }
+          });
+          response.data.on("end", resolve);
+          response.data.on("error", reject);
+        });
+      } catch (error) {
+        console.error(`Error processing folder '${folderName}':`, error);
       }
     }
 
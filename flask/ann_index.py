@@ -0,0 +1,160 @@
+import numpy as np
+
+
+def squared_distances(vectors, centroids):
+    """
+    Squared L2 distance between every vector and every centroid.
+    """
+    return (
+        np.einsum('ij,ij->i', vectors, vectors)[:, None]
+        - 2 * vectors @ centroids.T
+        + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    )
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """
+    Plain Lloyd's k-means in numpy. Empty clusters are re-seeded from random vectors.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmin(squared_distances(vectors, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        order = np.argsort(assignment, kind='stable')
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+
+        updated = centroids.copy()
+        updated[non_empty] = sums / counts[non_empty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            updated[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        if np.allclose(updated, centroids):
+            break
+        centroids = updated
+
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    Splits vectors into m sub-spaces and encodes each with a uint8 code into a
+    per-sub-space codebook; inner products are then approximated by table lookups.
+    """
+
+    def __init__(self, m, ksub=256, seed=0):
+        self.m = m
+        self.ksub = min(ksub, 256)
+        self.seed = seed
+        self.splits = None
+        self.codebooks = []
+
+    def train(self, vectors):
+        self.splits = np.array_split(np.arange(vectors.shape[1]), self.m)
+        self.codebooks = [
+            kmeans(vectors[:, columns], self.ksub, seed=self.seed + j)
+            for j, columns in enumerate(self.splits)
+        ]
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j, columns in enumerate(self.splits):
+            codes[:, j] = np.argmin(squared_distances(vectors[:, columns], self.codebooks[j]), axis=1)
+        return codes
+
+    def inner_product_table(self, query):
+        table = np.zeros((self.m, self.ksub), dtype=np.float32)
+        for j, columns in enumerate(self.splits):
+            codebook = self.codebooks[j]
+            table[j, :len(codebook)] = codebook @ query[columns]
+        return table
+
+    def scores(self, table, codes):
+        return table[np.arange(self.m), codes].sum(axis=1)
+
+
+class IVFIndex:
+    """
+    Inverted file over k-means coarse centroids, with optional product quantization codes
+    of each vector's residual from its centroid. Lists hold image ids; exact re-scoring
+    is left to the caller.
+    """
+
+    def __init__(self, nlist, pq_m=0, seed=0):
+        self.nlist = nlist
+        self.pq = ProductQuantizer(pq_m, seed=seed) if pq_m else None
+        self.seed = seed
+        self.centroids = None
+        self.list_ids = []
+        self.list_codes = []
+        self.assignments = {}
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def train(self, vectors, max_training_points=50000):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > max_training_points:
+            rng = np.random.default_rng(self.seed)
+            vectors = vectors[rng.choice(len(vectors), max_training_points, replace=False)]
+        self.centroids = kmeans(vectors, self.nlist, seed=self.seed)
+        self.nlist = len(self.centroids)
+        if self.pq is not None:
+            assignment = np.argmin(squared_distances(vectors, self.centroids), axis=1)
+            self.pq.train(vectors - self.centroids[assignment])
+        self.list_ids = [[] for _ in range(self.nlist)]
+        self.list_codes = [np.empty((0, self.pq.m if self.pq else 0), dtype=np.uint8) for _ in range(self.nlist)]
+        self.assignments = {}
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for image_id in ids:
+            self.remove(image_id)
+        assignment = np.argmin(squared_distances(vectors, self.centroids), axis=1)
+        codes = self.pq.encode(vectors - self.centroids[assignment]) if self.pq is not None else None
+        for list_no in np.unique(assignment):
+            members = np.flatnonzero(assignment == list_no)
+            for member in members:
+                self.list_ids[list_no].append(ids[member])
+                self.assignments[ids[member]] = list_no
+            if codes is not None:
+                self.list_codes[list_no] = np.vstack([self.list_codes[list_no], codes[members]])
+
+    def remove(self, image_id):
+        list_no = self.assignments.pop(image_id, None)
+        if list_no is None:
+            return False
+        position = self.list_ids[list_no].index(image_id)
+        del self.list_ids[list_no][position]
+        if self.pq is not None:
+            self.list_codes[list_no] = np.delete(self.list_codes[list_no], position, axis=0)
+        return True
+
+    def search(self, query, nprobe, n_candidates):
+        """
+        Return candidate image ids from the nprobe closest lists. With product
+        quantization, only the n_candidates best approximate scores are kept.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        nprobe = max(1, min(nprobe, self.nlist))
+        distances = squared_distances(query[None, :], self.centroids)[0]
+        probed = np.argpartition(distances, nprobe - 1)[:nprobe]
+
+        ids = [image_id for list_no in probed for image_id in self.list_ids[list_no]]
+        if self.pq is None or len(ids) <= n_candidates:
+            return ids
+
+        # q.x ~= q.centroid + q.residual, and the residual term is a table lookup
+        table = self.pq.inner_product_table(query)
+        centroid_scores = self.centroids[probed] @ query
+        approx = np.concatenate([
+            centroid_scores[i] + self.pq.scores(table, self.list_codes[list_no])
+            for i, list_no in enumerate(probed)
+        ])
+        best = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        return [ids[i] for i in best]
@@ -1,19 +1,39 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory
+import json
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_restful import Resource, Api
 from flask_cors import cross_origin
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-import cv2
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # Use 'Agg' backend for non-interactive plotting
-import matplotlib.pyplot as plt
-from skimage.feature import local_binary_pattern
-import numpy as np
+from werkzeug.security import safe_join
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, UpdateOne
+import threading
+import time
+from collections import OrderedDict
+import descriptor_cache
+import metrics
+from descriptor_codec import encode_descriptors
+from descriptor_index import METRICS, DescriptorIndex, top_k
+from feedback_model import LABELS as FEEDBACK_LABELS, FeedbackModel
+from hamming_index import HASH_FEATURE, HammingIndex, hash_to_int
+from ingestion import IndexIngestor
+from jobs import JobQueue, QueueFull
+from result_cache import SearchResultCache
+from serialization import FastJSONProvider, available_formats, dumps_json, encode_payload, pack_descriptors
+from descriptors import DESCRIPTOR_VERSION, compute_descriptors, compute_descriptors_from_bytes, compute_descriptors_task, get_pipeline, task_result
+from index_store import IndexStore
+from metrics import Collected, Counter, Histogram, phase_timer, register
+from visualizations import (
+    VISUALIZATION_KINDS, VisualizationCollector, image_fingerprint, parse_visualization_filename,
+    render_visualization_task, visualization_filename
+)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 api = Api(app)
 
@@ -35,201 +55,355 @@ def allowed_file(filename):
     """
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Visualization functions
-def visualize_dominant_colors(dominant_colors, output_filename):
-    colors = [dominant_colors[i:i+3] for i in range(0, len(dominant_colors), 3)]
-    colors = [color[::-1] for color in colors]  # Convert BGR to RGB
-    colors = [np.array(color) / 255.0 for color in colors]  # Normalize
-
-    # Update figure size for a better aspect ratio
-    plt.figure(figsize=(10, 6))  # Larger size with better height
-    for i, color in enumerate(colors):
-        plt.subplot(1, len(colors), i + 1)
-        plt.imshow([[color]])
-        plt.axis('off')
-        plt.title(f"Color {i+1}", fontsize=14)  # Increase font size for better visibility
-
-    plt.tight_layout()
-    plt.savefig(output_filename, dpi=300)  # Higher resolution
-    plt.close()
-
-
-def visualize_color_histogram(image, output_filename):
-    color = ('b', 'g', 'r')
-    plt.figure(figsize=(8, 6))
-    for i, col in enumerate(color):
-        histogram = cv2.calcHist([image], [i], None, [256], [0, 256])
-        plt.plot(histogram, color=col)
-    plt.title("Color Histogram")
-    plt.xlabel("Bins")
-    plt.ylabel("Frequency")
-    plt.grid(True)
-    plt.savefig(output_filename)
-    plt.close()
-
-def visualize_gabor_features(gabor_features, output_filename):
-    plt.figure(figsize=(8, 6))
-    plt.bar(range(len(gabor_features)), gabor_features, color='blue')
-    plt.title("Gabor Features")
-    plt.xlabel("Kernel Index")
-    plt.ylabel("Mean Response")
-    plt.grid(True)
-    plt.savefig(output_filename)
-    plt.close()
-
-def visualize_hu_moments(hu_moments, output_filename):
-    plt.figure(figsize=(8, 6))
-    plt.bar(range(1, len(hu_moments) + 1), -np.log10(np.abs(hu_moments)), color='orange')
-    plt.title("Hu Moments (Log-Scaled)")
-    plt.xlabel("Moment Index")
-    plt.ylabel("Log Value")
-    plt.grid(True)
-    plt.savefig(output_filename)
-    plt.close()
-
-def visualize_lbp_histogram(hist_lbp, output_filename):
-    plt.figure(figsize=(8, 6))
-    plt.bar(range(len(hist_lbp)), hist_lbp, color='purple')
-    plt.title("LBP Histogram")
-    plt.xlabel("Patterns")
-    plt.ylabel("Frequency")
-    plt.grid(True)
-    plt.savefig(output_filename)
-    plt.close()
-
-def visualize_hog(hog_features, output_filename):
-    plt.figure(figsize=(8, 6))
-    plt.plot(range(len(hog_features)), hog_features, color='green')
-    plt.title("HOG Features")
-    plt.xlabel("Feature Index")
-    plt.ylabel("Value")
-    plt.grid(True)
-    plt.savefig(output_filename)
-    plt.close()
-
-def visualize_edge_histogram(edge_hist, output_filename):
-    plt.figure(figsize=(8, 6))
-    plt.bar(range(len(edge_hist)), edge_hist, color='blue')
-    plt.title("Edge Direction Histogram")
-    plt.xlabel("Angle Bins")
-    plt.ylabel("Frequency")
-    plt.grid(True)
-    plt.savefig(output_filename)
-    plt.close()
-
-# Descriptor computation
-def compute_descriptors(image_path):
-    image = cv2.imread(image_path)
-    if image is None:
-        return None, "Invalid image format or corrupted image."
-    if image.shape[0] < 10 or image.shape[1] < 10:
-        return None, "Image is too small to process."
-
-    # Color Histogram
-    num_bins = 8
-    color_hist = cv2.calcHist([image], [0, 1, 2], None, [num_bins, num_bins, num_bins], [0, 256, 0, 256, 0, 256])
-    color_hist = cv2.normalize(color_hist, None).flatten()
-
-    # Dominant Colors
-    pixels = np.float32(image.reshape(-1, 3))
-    n_colors = 3
-    _, _, centers = cv2.kmeans(pixels, n_colors, None, (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0), 10, cv2.KMEANS_RANDOM_CENTERS)
-    dominant_colors = centers.flatten().tolist()
-
-    # Gabor Features
-    gabor_kernels = [cv2.getGaborKernel((21, 21), 8.0, theta, 10.0, 0.5, 0, ktype=cv2.CV_32F) for theta in np.arange(0, np.pi, np.pi / 4)]
-    gabor_features = [cv2.filter2D(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), cv2.CV_8UC3, kernel).mean() for kernel in gabor_kernels]
-
-    # Hu Moments
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    moments = cv2.moments(gray)
-    hu_moments = cv2.HuMoments(moments).flatten()
-
-    # Local Binary Patterns (LBP)
-    lbp = local_binary_pattern(gray, P=8, R=1, method='uniform')
-    hist_lbp, _ = np.histogram(lbp.ravel(), bins=np.arange(0, 27), range=(0, 26))
-    hist_lbp = cv2.normalize(hist_lbp, None).flatten()
-
-    # Histogram of Oriented Gradients (HOG)
-    hog_descriptor = cv2.HOGDescriptor()
-    hog = hog_descriptor.compute(gray).flatten()
-    max_hog_length = 1000  # Keep only the first 1000 elements
-    hog = hog[::10]  # Downsample by taking every 10th value
-    if len(hog) > max_hog_length:
-        hog = hog[:max_hog_length]  # Truncate to 1000 elements
-
-    # Edge Direction Histogram
-    edges = cv2.Canny(gray, 100, 200)
-    angles = cv2.phase(edges.astype(float), edges.astype(float), angleInDegrees=True)
-    angle_hist, _ = np.histogram(angles, bins=18, range=(0, 180))
-    angle_hist = angle_hist / np.sum(angle_hist)
-
-    # Visualizations
-    visualization_folder = app.config['VISUALIZATION_FOLDER']
-    visualizations = {
-        "color_histogram": os.path.join(visualization_folder, "color_histogram.png"),
-        "dominant_colors": os.path.join(visualization_folder, "dominant_colors.png"),
-        "gabor_features": os.path.join(visualization_folder, "gabor_features.png"),
-        "hu_moments": os.path.join(visualization_folder, "hu_moments.png"),
-        "lbp_histogram": os.path.join(visualization_folder, "lbp_histogram.png"),
-        "hog_features": os.path.join(visualization_folder, "hog_features.png"),
-        "edge_histogram": os.path.join(visualization_folder, "edge_histogram.png"),
-    }
-
-    # Generate visualizations
-    visualize_color_histogram(image, visualizations["color_histogram"])
-    visualize_dominant_colors(dominant_colors, visualizations["dominant_colors"])
-    visualize_gabor_features(gabor_features, visualizations["gabor_features"])
-    visualize_hu_moments(hu_moments, visualizations["hu_moments"])
-    visualize_lbp_histogram(hist_lbp, visualizations["lbp_histogram"])
-    visualize_hog(hog, visualizations["hog_features"])
-
-    plt.figure(figsize=(8, 6))
-    plt.bar(range(len(angle_hist)), angle_hist, color='blue')
-    plt.title("Edge Direction Histogram")
-    plt.xlabel("Angle Bins")
-    plt.ylabel("Frequency")
-    plt.grid(True)
-    plt.savefig(visualizations["edge_histogram"])
-    plt.close()
-
-    # Return descriptors and visualization paths
-    descriptors = {
-        "color_histogram": color_hist.tolist(),
-        "dominant_colors": dominant_colors,
-        "gabor_features": gabor_features,
-        "hu_moments": hu_moments.tolist(),
-        "lbp": hist_lbp.tolist(),
-        "hog": hog.tolist(),
-        "edge_histogram": angle_hist.tolist(),
-        "visualizations": {key: path.replace("\\", "/") for key, path in visualizations.items()},
-    }
-
-    return descriptors, None
-
-def compute_feature_probabilities(feedback_entries, feature_key):
-    import numpy as np
-    from datetime import datetime
-
-    feature_values = []
-    weights = []
-
-    for feedback in feedback_entries:
-        if 'query_descriptors' in feedback and feature_key in feedback['query_descriptors']:
-            feature_values.append(np.array(feedback['query_descriptors'][feature_key], dtype=float))
-            # Amplify recent feedback weight
-            recency_weight = 10 / (1 + (datetime.utcnow() - feedback['timestamp']).total_seconds())
-            weights.append(recency_weight)
-
-    if not feature_values:
-        # Return default probabilities if no feedback exists
-        return np.ones(1)  # Uniform default vector
-
-    # Compute weighted average of feature values
-    return np.average(feature_values, axis=0, weights=weights)
+def upload_path(filename):
+    """
+    Path of a file in the shared uploads folder, or None if the name would leave it.
+    Names are used as stored by Express (e.g. '1700000000000-my photo.png'), not sanitised.
+    """
+    return safe_join(app.config['UPLOAD_FOLDER'], filename)
+
+# In-memory descriptor index used by the search endpoints
+INDEXED_FEATURES = ['color_histogram', 'dominant_colors', 'gabor_features', 'hu_moments', 'lbp', 'hog', 'edge_histogram']
+SIMPLE_SEARCH_FEATURES = ['color_histogram', 'dominant_colors']
+FEEDBACK_SEARCH_FEATURES = ['color_histogram', 'hog', 'gabor_features']
+descriptor_index = DescriptorIndex(INDEXED_FEATURES)
+
+# Near-duplicate detection: images whose 64-bit perceptual hashes differ in at most
+# this many bits are treated as copies of each other
+app.config['DUPLICATE_DISTANCE'] = int(os.environ.get('DUPLICATE_DISTANCE', 6))
+
+# Search backend: 'exact' scores every image, 'ivf' and 'ivfpq' only score the
+# images in the nprobe closest inverted lists (higher nprobe = better recall, slower)
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'exact')
+app.config['ANN_NLIST'] = int(os.environ['ANN_NLIST']) if 'ANN_NLIST' in os.environ else None
+app.config['ANN_NPROBE'] = int(os.environ.get('ANN_NPROBE', 8))
+app.config['ANN_PQ_M'] = int(os.environ.get('ANN_PQ_M', 16))
+
+# MongoDB: one client per process, shared by every request through its connection pool
+app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+app.config['MONGO_DB'] = os.environ.get('MONGO_DB', 'imagesDB')
+app.config['MONGO_MAX_POOL_SIZE'] = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+app.config['MONGO_MIN_POOL_SIZE'] = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+app.config['MONGO_BATCH_SIZE'] = int(os.environ.get('MONGO_BATCH_SIZE', 1000))
+# How descriptors written by this service are stored: 'json' lists, or 'float32' /
+# 'float16' binary blobs (see descriptor_codec.py and migrate_descriptors.py)
+app.config['DESCRIPTOR_STORAGE_FORMAT'] = os.environ.get('DESCRIPTOR_STORAGE_FORMAT', 'json')
+mongo_client = None
+mongo_client_lock = threading.Lock()
+
+def get_mongo_client():
+    global mongo_client
+    with mongo_client_lock:
+        if mongo_client is None:
+            mongo_client = MongoClient(
+                app.config['MONGO_URI'],
+                maxPoolSize=app.config['MONGO_MAX_POOL_SIZE'],
+                minPoolSize=app.config['MONGO_MIN_POOL_SIZE'],
+            )
+    return mongo_client
+
+def get_database():
+    return get_mongo_client()[app.config['MONGO_DB']]
+
+def descriptor_projection(features):
+    """
+    Projection that only fetches the filename, category and the given descriptor families.
+    """
+    projection = {'filename': 1, 'category': 1}
+    projection.update({f'descriptors.{feature}': 1 for feature in features})
+    return projection
+
+def get_images_collection():
+    return get_database()['images']
+
+def get_descriptor_index():
+    """
+    Return the descriptor index, loading it from MongoDB on first use. From then on
+    the ingestor keeps it up to date.
+    """
+    if not descriptor_index.loaded:
+        with descriptor_index.lock:
+            if not descriptor_index.loaded:
+                load_descriptor_index(from_snapshot=True)
+        get_index_ingestor()
+    return descriptor_index
+
+# Index snapshots: the first process to load the index from MongoDB saves its matrices
+# under INDEX_STORE (empty to disable); later processes memory-map them, share them
+# through the page cache and only fetch the images that changed since. Those changes
+# are private to each process, so once a catch-up adds, updates or removes more than
+# INDEX_SNAPSHOT_DELTA images, the caught-up index is saved as the new snapshot.
+app.config['INDEX_STORE'] = os.environ.get('INDEX_STORE', 'index_store')
+app.config['INDEX_SNAPSHOT_DELTA'] = int(os.environ.get('INDEX_SNAPSHOT_DELTA', 1000))
+index_store = None
+index_store_lock = threading.Lock()
+
+def get_index_store():
+    global index_store
+    if not app.config['INDEX_STORE']:
+        return None
+    with index_store_lock:
+        if index_store is None:
+            index_store = IndexStore(app.config['INDEX_STORE'], f"{DESCRIPTOR_VERSION}-{app.config['MONGO_DB']}")
+    return index_store
+
+def load_descriptor_index(from_snapshot=False):
+    """
+    Rebuild the descriptor index and, if enabled, its approximate search structures.
+    With from_snapshot, a saved snapshot is used when there is one and caught up with
+    MongoDB (and saved again if that changed many images); otherwise the index is read
+    from MongoDB and a new snapshot is saved.
+    """
+    store = get_index_store()
+    collection = get_images_collection()
+    if from_snapshot and store is not None and store.load(descriptor_index) is not None:
+        delta = sum(descriptor_index.catch_up(collection, batch_size=app.config['MONGO_BATCH_SIZE']))
+        if delta > app.config['INDEX_SNAPSHOT_DELTA']:
+            try:
+                store.save(descriptor_index)
+                # Map the new snapshot, so that this process shares its rows as well
+                store.load(descriptor_index)
+            except OSError as e:
+                print(f"[ERROR] Could not save index snapshot: {e}")
+    else:
+        descriptor_index.load(collection, batch_size=app.config['MONGO_BATCH_SIZE'])
+        if store is not None:
+            try:
+                store.save(descriptor_index)
+            except OSError as e:
+                print(f"[ERROR] Could not save index snapshot: {e}")
+    backend = app.config['SEARCH_BACKEND']
+    if backend in ('ivf', 'ivfpq'):
+        pq_m = app.config['ANN_PQ_M'] if backend == 'ivfpq' else 0
+        for features in (SIMPLE_SEARCH_FEATURES, FEEDBACK_SEARCH_FEATURES):
+            descriptor_index.build_ann(features, nlist=app.config['ANN_NLIST'], pq_m=pq_m)
+
+# Relevance-feedback model, updated incrementally as feedback arrives
+app.config['FEEDBACK_WINDOW'] = int(os.environ.get('FEEDBACK_WINDOW', 50))
+app.config['FEEDBACK_HALF_LIFE'] = float(os.environ.get('FEEDBACK_HALF_LIFE', 300))
+feedback_model = FeedbackModel(
+    FEEDBACK_SEARCH_FEATURES, window=app.config['FEEDBACK_WINDOW'], half_life=app.config['FEEDBACK_HALF_LIFE']
+)
+
+def get_feedback_model():
+    """
+    Return the feedback model after folding in feedback saved since it was last used
+    (by this or another worker process).
+    """
+    feedback_model.sync(get_database()['feedback'])
+    return feedback_model
+
+def get_nprobe(data):
+    """
+    Number of inverted lists to probe for a search request, or None for exact search.
+    """
+    if app.config['SEARCH_BACKEND'] == 'exact' and 'nprobe' not in data:
+        return None
+    return int(data.get('nprobe', app.config['ANN_NPROBE']))
+
+# Worker processes for batch descriptor computation, created on first use
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['BATCH_WRITE_SIZE'] = int(os.environ.get('BATCH_WRITE_SIZE', 100))
+batch_executor = None
+batch_executor_lock = threading.Lock()
+
+def get_batch_executor():
+    global batch_executor
+    with batch_executor_lock:
+        if batch_executor is None:
+            batch_executor = ProcessPoolExecutor(max_workers=app.config['BATCH_WORKERS'])
+    return batch_executor
+
+# Jobs: descriptor extraction and visualization rendering run on a bounded process pool,
+# so CPU-heavy work never runs on (or blocks) the threads serving searches. In the
+# 'production' serving mode the synchronous endpoints also offload to it and wait.
+app.config['SERVING_MODE'] = os.environ.get('SERVING_MODE', 'development')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['JOB_QUEUE_LIMIT'] = int(os.environ.get('JOB_QUEUE_LIMIT', 32))
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 600))
+app.config['JOB_WAIT_TIMEOUT'] = float(os.environ.get('JOB_WAIT_TIMEOUT', 30))
+job_queue = JobQueue(
+    lambda: ProcessPoolExecutor(max_workers=app.config['JOB_WORKERS']),
+    max_pending=app.config['JOB_QUEUE_LIMIT'],
+    ttl=app.config['JOB_TTL'],
+)
+
+def offload_heavy_work():
+    return app.config['SERVING_MODE'] == 'production'
+
+def job_accepted(job):
+    """
+    202 Accepted response pointing at the job's status URL.
+    """
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job.id}"
+    return response
 
+def queue_full(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
 
+# Lazily rendered visualizations: visualization file name -> source image and descriptors.
+# Names carry the image file's fingerprint, so each image version gets its own files.
+# Every image has one entry per visualization kind, all sharing one source dict.
+MAX_VISUALIZATION_IMAGES = 256
+MAX_VISUALIZATION_SOURCES = MAX_VISUALIZATION_IMAGES * len(VISUALIZATION_KINDS)
+visualization_sources = OrderedDict()
+visualization_lock = threading.Lock()
+
+# Rendered files unused for VISUALIZATION_TTL seconds, or beyond VISUALIZATION_MAX_BYTES,
+# are removed by a background thread every VISUALIZATION_GC_INTERVAL seconds
+app.config['VISUALIZATION_TTL'] = int(os.environ.get('VISUALIZATION_TTL', 3600))
+app.config['VISUALIZATION_MAX_BYTES'] = int(os.environ.get('VISUALIZATION_MAX_BYTES', 200 * 1024 * 1024))
+app.config['VISUALIZATION_GC_INTERVAL'] = int(os.environ.get('VISUALIZATION_GC_INTERVAL', 300))
+visualization_collector = None
+visualization_collector_lock = threading.Lock()
+VISUALIZATION_REQUESTS = register(Counter(
+    'visualization_requests_total', 'Visualization file requests by outcome.', ['result']
+))
+
+def get_visualization_collector():
+    global visualization_collector
+    with visualization_collector_lock:
+        if visualization_collector is None:
+            visualization_collector = VisualizationCollector(
+                app.config['VISUALIZATION_FOLDER'],
+                ttl=app.config['VISUALIZATION_TTL'],
+                max_bytes=app.config['VISUALIZATION_MAX_BYTES'],
+                interval=app.config['VISUALIZATION_GC_INTERVAL'],
+            )
+            visualization_collector.start()
+    return visualization_collector
+
+def register_visualizations(image_path, descriptors=None):
+    """
+    Remember where an image's visualizations come from and return their URL paths.
+    Nothing is rendered until /visualizations/<filename> is requested.
+    """
+    get_visualization_collector()
+    fingerprint = image_fingerprint(image_path)
+    visualizations = {}
+    source = {'image_path': image_path, 'descriptors': descriptors}
+    with visualization_lock:
+        for kind in VISUALIZATION_KINDS:
+            name = visualization_filename(image_path, kind, fingerprint)
+            current = visualization_sources.get(name)
+            if current is None or current['image_path'] != image_path or descriptors is not None:
+                visualization_sources[name] = source
+            visualization_sources.move_to_end(name)
+            visualizations[kind] = f"{VISUALIZATION_FOLDER}/{name}"
+        while len(visualization_sources) > MAX_VISUALIZATION_SOURCES:
+            visualization_sources.popitem(last=False)
+    return visualizations
+
+def visualization_task_args(filename):
+    """
+    Arguments of render_visualization_task for a visualization file name, or None if
+    the name, its source image or that version of the image is unknown.
+    """
+    image_name, fingerprint, kind = parse_visualization_filename(filename)
+    if kind is None:
+        return None
+
+    output_path = safe_join(app.config['VISUALIZATION_FOLDER'], filename)
+    if output_path is None:
+        return None
+    with visualization_lock:
+        source = visualization_sources.get(filename)
+    if source is None:
+        image_path = upload_path(image_name)
+        if image_path is None:
+            return None
+        source = {'image_path': image_path, 'descriptors': None}
+    if not os.path.exists(source['image_path']) or image_fingerprint(source['image_path']) != fingerprint:
+        return None
+    return kind, source['image_path'], source['descriptors'], output_path
+
+def remember_visualization_descriptors(result):
+    image_path, descriptors = result
+    if descriptors is not None:
+        # Keep them for the other plots of the same image
+        register_visualizations(image_path, descriptors)
+
+def render_missing_visualization(filename):
+    """
+    Render a requested visualization on first access. Returns False if the name is unknown.
+    """
+    args = visualization_task_args(filename)
+    if args is None:
+        return False
+    remember_visualization_descriptors(render_visualization_task(*args))
+    return True
 
+def submit_visualization_job(filename):
+    """
+    Queue the rendering of a visualization file, or return None if the name is unknown.
+    """
+    args = visualization_task_args(filename)
+    if args is None:
+        return None
+
+    def on_done(result):
+        remember_visualization_descriptors(result)
+        return {'visualization': f"{VISUALIZATION_FOLDER}/{filename}"}
+    return job_queue.submit('visualization', render_visualization_task, *args, on_done=on_done)
+
+def descriptor_payload(filepath, descriptors, mode):
+    """
+    Body of a compute response: the descriptors and, in full mode, the visualization URLs.
+    """
+    response = {'status': 'success', 'descriptors': descriptors}
+    if mode == 'full':
+        response['visualizations'] = register_visualizations(filepath, descriptors)
+    return response
+
+# Descriptor responses: "format" (or an Accept: application/msgpack header) picks one of
+# RESPONSE_FORMATS (msgpack only when the package is installed), and "precision" (default RESPONSE_FLOAT_PRECISION, unset = full
+# float32 precision) rounds the values to that many decimals
+app.config['RESPONSE_FLOAT_PRECISION'] = (
+    int(os.environ['RESPONSE_FLOAT_PRECISION']) if os.environ.get('RESPONSE_FLOAT_PRECISION') else None
+)
+
+def response_options(data):
+    """
+    (format, precision) requested for a descriptor response, or (None, error message).
+    """
+    formats = available_formats()
+    response_format = data.get('format')
+    if response_format is None:
+        best = request.accept_mimetypes.best_match(['application/json', 'application/msgpack', 'application/x-msgpack'])
+        response_format = 'msgpack' if best and 'msgpack' in best and 'msgpack' in formats else 'json'
+    if response_format not in formats:
+        return None, f"Format must be one of: {', '.join(formats)}"
+    precision = data.get('precision', app.config['RESPONSE_FLOAT_PRECISION'])
+    if precision is not None:
+        try:
+            precision = int(precision)
+        except (TypeError, ValueError):
+            return None, 'Precision must be an integer'
+    return (response_format, precision), None
+
+def descriptor_response(payload, options, status=200):
+    """
+    Serialize a descriptor payload in the requested format; numpy arrays are encoded
+    directly instead of through Python lists.
+    """
+    response_format, precision = options
+    if 'descriptors' in payload:
+        payload = dict(payload, descriptors=pack_descriptors(payload['descriptors'], response_format, precision))
+    body, mimetype = encode_payload(payload, response_format)
+    return Response(body, status=status, mimetype=mimetype)
+
+def submit_descriptor_job(filepath, mode):
+    def on_done(result):
+        path, descriptors, error = task_result(result)
+        if error:
+            raise ValueError(error)
+        return descriptor_payload(path, descriptors, mode)
+    return job_queue.submit('descriptors', compute_descriptors_task, filepath, on_done=on_done)
 
 # Flask-RESTful Resource
 class Descriptor(Resource):
@@ -248,6 +422,14 @@ class Descriptor(Resource):
     def post(self):
         """
         POST endpoint to compute descriptors based on a filename.
+        With "mode": "descriptors" only the descriptor vectors are returned; otherwise the
+        response also lists visualization URLs, rendered lazily when first requested.
+        With "timings": true the descriptors are computed in this process without the
+        descriptor cache, and the per-stage milliseconds are included.
+        With "async": true the work is queued and a 202 with the job id is returned
+        (poll /api/jobs/<id>); in production serving mode it is offloaded and awaited.
+        "format" ("json", "base64" or "msgpack") and "precision" control how the
+        descriptor values are encoded.
         """
         # Check if filename is provided in JSON payload
         data = request.get_json()
@@ -255,39 +437,422 @@ class Descriptor(Resource):
             return jsonify({'error': 'Filename is required'}), 400
 
         filename = data['filename']
+        mode = data.get('mode', 'full')
+        if mode not in ('full', 'descriptors'):
+            return jsonify({'error': "Mode must be 'full' or 'descriptors'"}), 400
+        options, error = response_options(data)
+        if error:
+            return jsonify({'error': error}), 400
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
         # Check if the file exists in the shared uploads directory
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found in shared uploads folder'}), 404
 
+        # Per-stage timings are only measured in this process
+        if data.get('async') or (offload_heavy_work() and not data.get('timings')):
+            try:
+                job = submit_descriptor_job(filepath, mode)
+            except QueueFull as e:
+                return queue_full(e)
+            if data.get('async') or not job.done.wait(app.config['JOB_WAIT_TIMEOUT']):
+                return job_accepted(job)
+            if job.error is not None:
+                return jsonify({'status': 'error', 'message': job.error}), 400
+            return descriptor_response(job.result, options)
+
         # Compute descriptors
-        descriptors, error = compute_descriptors(filepath)
+        timings = {} if data.get('timings') else None
+        # A cache hit would only time the lookup
+        descriptors, error = compute_descriptors(filepath, cache=False if timings is not None else None, timings=timings)
         if error:
             return jsonify({'status': 'error', 'message': error}), 400
 
-        # Return descriptors and visualizations
-        return jsonify({
-            'status': 'success',
-            'descriptors': descriptors,
-            'visualizations': descriptors['visualizations']
-        }), 200
+        # Return descriptors and, in full mode, visualizations
+        response = descriptor_payload(filepath, descriptors, mode)
+        if timings is not None:
+            response['timings'] = timings
+        return descriptor_response(response, options)
 api.add_resource(Descriptor, '/api/descriptors/compute')
 
+class BatchDescriptor(Resource):
+    @cross_origin()
+    def post(self):
+        """
+        POST endpoint to compute descriptors for many images at once.
+        Accepts "filenames" (a list) or "directory", relative to the uploads folder.
+        Descriptors are computed in a process pool, written to MongoDB in bulk and
+        one NDJSON line is streamed back per image, followed by a summary line.
+        Optional: "category" (name) inserts images that are not in the catalog yet
+        (matched by path), "skip_existing" skips images that already have descriptors,
+        "include_descriptors" adds the vectors to each line, "save": false skips MongoDB,
+        "reject_duplicates" skips images that are perceptual duplicates of a catalog image
+        or of an earlier image in the batch (their lines have status "duplicate").
+        """
+        data = request.get_json()
+        if not data or ('filenames' not in data and 'directory' not in data):
+            return jsonify({'error': 'A list of filenames or a directory is required'}), 400
+
+        upload_folder = app.config['UPLOAD_FOLDER']
+        if 'directory' in data:
+            directory = os.path.join(upload_folder, data['directory'])
+            if not os.path.isdir(directory):
+                return jsonify({'error': 'Directory not found'}), 404
+            paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if allowed_file(name)]
+        else:
+            if not isinstance(data['filenames'], list):
+                return jsonify({'error': 'filenames must be a list'}), 400
+            paths = [os.path.join(upload_folder, name) for name in data['filenames']]
+
+        save = data.get('save', True)
+        include_descriptors = data.get('include_descriptors', False)
+        reject_duplicates = data.get('reject_duplicates', False)
+        database = get_database() if save else None
+
+        category_id = None
+        if save and data.get('category'):
+            category = database['categories'].find_one({'name': data['category']})
+            if category is None:
+                return jsonify({'error': 'Invalid category'}), 400
+            category_id = category['_id']
+
+        if save and data.get('skip_existing'):
+            # Seeded images are stored by path (see write_descriptor_batch), others by file name
+            if category_id is not None:
+                key, values = 'path', paths
+            else:
+                key, values = 'filename', [os.path.basename(path) for path in paths]
+            existing = {
+                image[key] for image in database['images'].find(
+                    {key: {'$in': values}, 'descriptors': {'$exists': True}}, {key: 1}
+                )
+            }
+            paths = [path for path, value in zip(paths, values) if value not in existing]
+
+        def generate():
+            pending = []
+            summary = {'status': 'done', 'processed': 0, 'failed': 0, 'written': 0, 'duplicates': 0}
+            # Hashes of the images accepted so far, which are not in the index until written
+            batch_hashes = HammingIndex() if reject_duplicates else None
+            if reject_duplicates:
+                get_descriptor_index()
+            futures = [get_batch_executor().submit(compute_descriptors_task, path) for path in paths]
+            for future in as_completed(futures):
+                path, descriptors, error = task_result(future.result())
+                line = {'filename': os.path.basename(path)}
+                duplicate = None
+                if not error and reject_duplicates:
+                    duplicate = find_duplicate(descriptors, line['filename'], batch_hashes)
+                if error:
+                    summary['failed'] += 1
+                    line.update({'status': 'error', 'message': error})
+                elif duplicate is not None:
+                    summary['duplicates'] += 1
+                    line.update({'status': 'duplicate', 'duplicate_of': duplicate['filename'], 'distance': duplicate['distance']})
+                else:
+                    summary['processed'] += 1
+                    line['status'] = 'success'
+                    if include_descriptors:
+                        line['descriptors'] = descriptors
+                    if save:
+                        pending.append((path, descriptors, None))
+                        if len(pending) >= app.config['BATCH_WRITE_SIZE']:
+                            summary['written'] += write_descriptor_batch(database, pending, category_id)
+                            pending = []
+                yield dumps_json(line) + b'\n'
+
+            if pending:
+                summary['written'] += write_descriptor_batch(database, pending, category_id)
+            yield dumps_json(summary) + b'\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+api.add_resource(BatchDescriptor, '/api/descriptors/compute-batch')
+
+def find_duplicate(descriptors, filename, pending=None):
+    """
+    Nearest indexed image (other than the one stored under filename) whose perceptual
+    hash is within DUPLICATE_DISTANCE bits, as {'image_id', 'filename', 'distance'}, or
+    None. A HammingIndex of not yet indexed images keyed by filename can be passed as
+    pending; when the image is no duplicate it is added to it.
+    """
+    if descriptors.get(HASH_FEATURE) is None:
+        return None
+    radius = app.config['DUPLICATE_DISTANCE']
+    matches = [match for match in descriptor_index.duplicates(descriptors, radius) if match['filename'] != filename]
+    if pending is not None:
+        value = hash_to_int(descriptors[HASH_FEATURE])
+        matches += [
+            {'image_id': None, 'filename': other, 'distance': distance}
+            for distance, other in pending.query(value, radius) if other != filename
+        ]
+        if not matches:
+            pending.add(filename, value)
+    return min(matches, key=lambda match: match['distance'], default=None)
+
+def write_descriptor_batch(database, computed, category_id=None):
+    """
+    Save a batch of (image path, descriptors, image id) with a single bulk_write, then
+    add the images to the descriptor index. Images with an id (documents being ingested)
+    are updated by _id. The others come from the batch endpoint: with a category they
+    are upserted by path, which is how seedImages.js adds a folder to the catalog, and
+    without one the documents stored under that upload's file name are updated.
+    Images that are perceptual duplicates of older catalog images get a duplicateOf
+    reference to the oldest of them.
+    """
+    images_collection = database['images']
+    storage_format = app.config['DESCRIPTOR_STORAGE_FORMAT']
+    # indexedAt lets polling ingestors in other processes pick up the new descriptors;
+    # descriptorVersion tells the ingestor's backfill which documents are current
+    now = datetime.utcnow()
+    by_id, by_path, by_filename = {}, {}, {}
+    for path, descriptors, image_id in computed:
+        if image_id is not None:
+            by_id[image_id] = descriptors
+        elif category_id is not None:
+            by_path[path] = descriptors
+        else:
+            by_filename[os.path.basename(path)] = descriptors
+    if by_filename:
+        for image in images_collection.find({'filename': {'$in': list(by_filename)}}, {'filename': 1}):
+            by_id[image['_id']] = by_filename[image['filename']]
+
+    operations = [
+        UpdateOne({'_id': image_id}, {'$set': {
+            'descriptors': encode_descriptors(descriptors, storage_format), 'descriptorVersion': DESCRIPTOR_VERSION, 'indexedAt': now,
+        }})
+        for image_id, descriptors in by_id.items()
+    ]
+    for path, descriptors in by_path.items():
+        operations.append(UpdateOne({'path': path}, {
+            '$set': {'descriptors': encode_descriptors(descriptors, storage_format), 'descriptorVersion': DESCRIPTOR_VERSION, 'indexedAt': now},
+            '$setOnInsert': {
+                'filename': os.path.basename(path),
+                'size': os.path.getsize(path),
+                'uploadDate': now,
+                'category': category_id,
+            },
+        }, upsert=True))
+    if not operations:
+        return 0
+    result = images_collection.bulk_write(operations, ordered=False)
+
+    projection = {'filename': 1, 'category': 1, 'path': 1}
+    written = [(image, by_id[image['_id']]) for image in images_collection.find({'_id': {'$in': list(by_id)}}, projection)]
+    if by_path:
+        written += [(image, by_path[image['path']]) for image in images_collection.find({'path': {'$in': list(by_path)}}, projection)]
+
+    index = get_descriptor_index()
+    radius = app.config['DUPLICATE_DISTANCE']
+    grouped = []
+    # ObjectIds start with their creation time, so the smallest id is the oldest image.
+    # Indexing in id order lets a copy see an older image written in the same batch,
+    # whatever order find returned them in.
+    written.sort(key=lambda entry: entry[0]['_id'])
+    for image, descriptors in written:
+        older = [match['image_id'] for match in index.duplicates(descriptors, radius) if match['image_id'] < str(image['_id'])]
+        if older:
+            grouped.append(UpdateOne({'_id': image['_id']}, {'$set': {'duplicateOf': ObjectId(min(older))}}))
+        index.add(image['_id'], image['filename'], descriptors, image.get('category'))
+    if grouped:
+        images_collection.bulk_write(grouped, ordered=False)
+    return result.matched_count + result.upserted_count
+
+# Incremental indexing: images inserted, updated or deleted in MongoDB (e.g. by the
+# Express upload and delete routes) are applied to the index in place by a background
+# thread, with descriptors computed on the batch pool. INGESTION is one of INGESTION_MODES.
+# Each worker process runs one; a lease in the 'leases' collection lets only one of
+# them compute descriptors, and the others index them once written. Its backfill also
+# recomputes images stored by an older pipeline (e.g. without a perceptual hash), so
+# duplicate detection only covers the whole catalog once that has caught up.
+app.config['INGESTION'] = os.environ.get('INGESTION', 'auto')
+app.config['INGESTION_INTERVAL'] = float(os.environ.get('INGESTION_INTERVAL', 5))
+# Full scans for deleted images (polling only; change streams report deletions)
+app.config['INGESTION_RECONCILE_INTERVAL'] = float(os.environ.get('INGESTION_RECONCILE_INTERVAL', 300))
+index_ingestor = None
+index_ingestor_lock = threading.Lock()
+
+def get_index_ingestor():
+    global index_ingestor
+    with index_ingestor_lock:
+        if index_ingestor is None:
+            index_ingestor = IndexIngestor(
+                get_images_collection,
+                descriptor_index,
+                ingest_images,
+                mode=app.config['INGESTION'],
+                interval=app.config['INGESTION_INTERVAL'],
+                batch_size=app.config['BATCH_WRITE_SIZE'],
+                reconcile_interval=app.config['INGESTION_RECONCILE_INTERVAL'],
+                get_leases=lambda: get_database()['leases'],
+                version=DESCRIPTOR_VERSION,
+            )
+            index_ingestor.start()
+    return index_ingestor
+
+def ingest_images(documents):
+    """
+    Compute, save and index descriptors for image documents that have none.
+    Returns the ids of the images that could not be processed.
+    """
+    # Documents sharing a file name share the uploaded file, which is computed once
+    paths, failed = {}, []
+    for document in documents:
+        path = upload_path(document['filename'])
+        if path is None:
+            failed.append(str(document['_id']))
+        else:
+            paths.setdefault(path, []).append(document)
+    futures = [get_batch_executor().submit(compute_descriptors_task, path) for path in paths]
+    computed = []
+    for future in as_completed(futures):
+        path, descriptors, error = task_result(future.result())
+        if error:
+            print(f"[ERROR] Could not index {os.path.basename(path)}: {error}")
+            failed.extend(str(document['_id']) for document in paths[path])
+        else:
+            computed.extend((path, descriptors, document['_id']) for document in paths[path])
+    if computed:
+        write_descriptor_batch(get_database(), computed)
+    return failed
+
+@app.route('/api/descriptors/pipeline-stats', methods=['GET'])
+@cross_origin()
+def pipeline_stats():
+    """
+    Per-stage timing breakdown of the descriptor pipeline in this process, including the
+    stages of descriptors computed for it in the batch and job worker processes. Each
+    serving process reports its own work.
+    """
+    return jsonify({'status': 'success', 'stages': get_pipeline().stats()}), 200
+
 @app.route('/visualizations/<filename>')
 def serve_visualization(filename):
     """
-    Serve the visualization images.
+    Serve the visualization images, rendering them on first request.
     """
-    response = send_from_directory(app.config['VISUALIZATION_FOLDER'], filename)
+    get_visualization_collector()
+    # The raw name is the visualization_sources key; safe_join only rejects traversal
+    path = safe_join(app.config['VISUALIZATION_FOLDER'], filename)
+    if path is None:
+        return jsonify({'error': 'Visualization not found'}), 404
+    try:
+        os.utime(path)  # Keep recently served files away from the collector
+        rendered = True
+    except OSError:
+        rendered = False
+    VISUALIZATION_REQUESTS.inc('cached' if rendered else 'rendered')
+    if not rendered:
+        try:
+            if offload_heavy_work():
+                job = submit_visualization_job(filename)
+                if job is None:
+                    return jsonify({'error': 'Visualization not found'}), 404
+                if not job.done.wait(app.config['JOB_WAIT_TIMEOUT']):
+                    return job_accepted(job)
+                if job.error is not None:
+                    raise RuntimeError(job.error)
+            elif not render_missing_visualization(filename):
+                return jsonify({'error': 'Visualization not found'}), 404
+        except QueueFull as e:
+            return queue_full(e)
+        except Exception as e:
+            print(f"[ERROR] Error generating visualization {filename}: {str(e)}")
+            return jsonify({'error': f'Error generating visualization: {str(e)}'}), 500
+
+    # Names change with the image version, so browsers can keep them
+    response = send_from_directory(app.config['VISUALIZATION_FOLDER'], filename, max_age=86400)
     response.headers.add('Access-Control-Allow-Origin', '*')  # Ensure CORS for this route too
     return response
 
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@cross_origin()
+def submit_job():
+    """
+    POST queues a job and returns 202 with its id: {"type": "descriptors", "filename": ...,
+    "mode": "full" | "descriptors"} or {"type": "visualization", "filename": <visualization
+    file name>}. Returns 503 with Retry-After when the queue is full.
+    GET returns the queue depth.
+    """
+    if request.method == 'GET':
+        return jsonify({'status': 'success', 'queue': job_queue.stats()}), 200
+
+    data = request.get_json()
+    if not data or 'filename' not in data:
+        return jsonify({'error': 'Job type and filename are required'}), 400
+    filename = data['filename']
+    try:
+        if data.get('type') == 'descriptors':
+            mode = data.get('mode', 'full')
+            if mode not in ('full', 'descriptors'):
+                return jsonify({'error': "Mode must be 'full' or 'descriptors'"}), 400
+            filepath = upload_path(filename)
+            if filepath is None or not os.path.exists(filepath):
+                return jsonify({'error': 'File not found in shared uploads folder'}), 404
+            job = submit_descriptor_job(filepath, mode)
+        elif data.get('type') == 'visualization':
+            job = submit_visualization_job(filename)
+            if job is None:
+                return jsonify({'error': 'Visualization not found'}), 404
+        else:
+            return jsonify({'error': "Job type must be 'descriptors' or 'visualization'"}), 400
+    except QueueFull as e:
+        return queue_full(e)
+    return job_accepted(job)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def job_status(job_id):
+    """
+    Status of a job, with its result once done. "?wait=<seconds>" long-polls until it finishes.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['JOB_WAIT_TIMEOUT'])
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    if wait > 0:
+        job.done.wait(wait)
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@cross_origin()
+def job_events(job_id):
+    """
+    Server-sent events for a job: a "status" event on every change and a final "done" or
+    "failed" event carrying the result.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+
+    def generate():
+        status = None
+        idle = 0.0
+        while not job.done.is_set():
+            if job.status != status:
+                status = job.status
+                idle = 0.0
+                yield f"event: status\ndata: {json.dumps({'job_id': job.id, 'status': status})}\n\n"
+            job.done.wait(0.5)
+            idle += 0.5
+            if idle >= 15:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+        yield f"event: {job.status}\ndata: {dumps_json(job.to_dict()).decode()}\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/visualizations', methods=['POST'])
 @cross_origin()
 def get_visualizations():
     """
-    Clear all existing visualizations and generate new ones for a given image filename.
+    Return the visualization paths for a given image filename. Plots are rendered when
+    first requested and reused afterwards.
     """
     data = request.get_json()
     if not data or 'filename' not in data:
@@ -300,96 +865,195 @@ def get_visualizations():
     if not os.path.exists(image_path):
         return jsonify({'error': 'File not found in shared uploads folder'}), 404
 
-    visualization_folder = app.config['VISUALIZATION_FOLDER']
+    return jsonify({
+        'status': 'success',
+        'visualizations': register_visualizations(image_path)
+    }), 200
 
-    # Delete all existing visualizations
-    for file in os.listdir(visualization_folder):
-        file_path = os.path.join(visualization_folder, file)
+# Paginated search: with "page_size", the top SEARCH_RESULT_DEPTH results (or
+# "max_results") are ranked once and later pages are served from this cache by cursor
+app.config['SEARCH_RESULT_DEPTH'] = int(os.environ.get('SEARCH_RESULT_DEPTH', 100))
+app.config['SEARCH_CURSOR_TTL'] = int(os.environ.get('SEARCH_CURSOR_TTL', 300))
+app.config['SEARCH_CURSOR_MAX_ENTRIES'] = int(os.environ.get('SEARCH_CURSOR_MAX_ENTRIES', 1000))
+search_results_cache = SearchResultCache(
+    ttl=app.config['SEARCH_CURSOR_TTL'], max_entries=app.config['SEARCH_CURSOR_MAX_ENTRIES']
+)
+
+# Search requests are timed in phases: parse (request body), fetch (index load, category
+# lookups, feedback sync from MongoDB), score, and serialize (JSON response)
+SEARCH_PHASE_SECONDS = register(Histogram(
+    'search_phase_seconds', 'Time spent in each phase of a search request.', ['endpoint', 'phase']
+))
+
+def search_option_error(data):
+    """
+    Error message if the max_results, page_size or nprobe of a search request is not a
+    positive integer, or its category_probe not a non-negative one, else None.
+    result_limit, search_payload, get_nprobe and search_rows expect requests that
+    passed this check.
+    """
+    for key, minimum in (('max_results', 1), ('page_size', 1), ('nprobe', 1), ('category_probe', 0)):
+        if key not in data or key == 'category_probe' and not data[key]:
+            continue
         try:
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error deleting file {file_path}: {e}")
-
-    # Define paths for the new visualizations
-    visualizations = {
-        "color_histogram": os.path.join(visualization_folder, f"{filename}_color_histogram.png"),
-        "dominant_colors": os.path.join(visualization_folder, f"{filename}_dominant_colors.png"),
-        "gabor_features": os.path.join(visualization_folder, f"{filename}_gabor_features.png"),
-        "hu_moments": os.path.join(visualization_folder, f"{filename}_hu_moments.png"),
-        "lbp_histogram": os.path.join(visualization_folder, f"{filename}_lbp_histogram.png"),
-        "hog_features": os.path.join(visualization_folder, f"{filename}_hog_features.png"),
-        "edge_histogram": os.path.join(visualization_folder, f"{filename}_edge_histogram.png"),
-    }
+            value = int(data[key])
+        except (TypeError, ValueError):
+            value = -1
+        if value < minimum:
+            return f"{key} must be a {'positive' if minimum else 'non-negative'} integer"
+    return None
+
+def result_limit(data, default=5):
+    """
+    Number of results to rank for a search request.
+    """
+    if 'page_size' in data:
+        return int(data.get('max_results', app.config['SEARCH_RESULT_DEPTH']))
+    return int(data.get('max_results', default))
 
-    try:
-        # Load the image and generate visualizations
-        image = cv2.imread(image_path)
-        if image is None:
-            return jsonify({'error': 'Invalid image format or corrupted image'}), 400
-
-        print("[DEBUG] Generating visualizations...")
-
-        # Generate visualizations
-        visualize_color_histogram(image, visualizations["color_histogram"])
-        print("[DEBUG] Color Histogram generated.")
-
-        pixels = np.float32(image.reshape(-1, 3))
-        n_colors = 3
-        _, _, centers = cv2.kmeans(
-            pixels, n_colors, None,
-            (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0),
-            10, cv2.KMEANS_RANDOM_CENTERS
-        )
-        visualize_dominant_colors(centers.flatten(), visualizations["dominant_colors"])
-        print("[DEBUG] Dominant Colors generated.")
-
-        gabor_kernels = [
-            cv2.getGaborKernel((21, 21), 8.0, theta, 10.0, 0.5, 0, ktype=cv2.CV_32F)
-            for theta in np.arange(0, np.pi, np.pi / 4)
-        ]
-        gabor_features = [cv2.filter2D(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), cv2.CV_8UC3, kernel).mean()
-                          for kernel in gabor_kernels]
-        visualize_gabor_features(gabor_features, visualizations["gabor_features"])
-        print("[DEBUG] Gabor Features generated.")
-
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        moments = cv2.moments(gray)
-        hu_moments = cv2.HuMoments(moments).flatten()
-        visualize_hu_moments(hu_moments, visualizations["hu_moments"])
-        print("[DEBUG] Hu Moments generated.")
-
-        lbp = local_binary_pattern(gray, P=8, R=1, method='uniform')
-        hist_lbp, _ = np.histogram(lbp.ravel(), bins=np.arange(0, 27), range=(0, 26))
-        hist_lbp = cv2.normalize(hist_lbp, None).flatten()
-        visualize_lbp_histogram(hist_lbp, visualizations["lbp_histogram"])
-        print("[DEBUG] LBP Histogram generated.")
-
-        hog_descriptor = cv2.HOGDescriptor()
-        hog = hog_descriptor.compute(gray).flatten()
-        max_hog_length = 1000  # Keep only the first 1000 elements
-        hog = hog[::10]  # Downsample by taking every 10th value
-        if len(hog) > max_hog_length:
-            hog = hog[:max_hog_length]  # Truncate to 1000 elements
-        visualize_hog(hog, visualizations["hog_features"])
-        print("[DEBUG] HOG Features generated.")
-
-        edges = cv2.Canny(gray, 100, 200)
-        edge_hist, _ = np.histogram(edges.ravel(), bins=18, range=(0, 360))
-        edge_hist = edge_hist / edge_hist.sum() if edge_hist.sum() > 0 else edge_hist
-        visualize_edge_histogram(edge_hist, visualizations["edge_histogram"])
-        print("[DEBUG] Edge Histogram generated.")
+def search_payload(data, results):
+    """
+    Response body with all results, or with "page_size" the first page and a cursor for the next one.
+    """
+    if 'page_size' not in data:
+        return {'status': 'success', 'results': results}
+    page, next_cursor = search_results_cache.paginate(results, int(data['page_size']))
+    return {'status': 'success', 'results': page, 'next_cursor': next_cursor}
 
-    except Exception as e:
-        print(f"[ERROR] Error generating visualizations: {str(e)}")
-        return jsonify({'error': f'Error generating visualizations: {str(e)}'}), 500
+def cursor_response(cursor):
+    """
+    Serve a later page of a paginated search without scoring anything.
+    """
+    page = search_results_cache.page(cursor)
+    if page is None:
+        return jsonify({'error': 'Cursor is invalid or has expired'}), 410
+    results, next_cursor = page
+    return jsonify({'status': 'success', 'results': results, 'next_cursor': next_cursor})
 
-    # Return new visualization paths
-    print("[DEBUG] All visualizations generated successfully.")
-    return jsonify({
-        'status': 'success',
-        'visualizations': {key: value.replace("\\", "/") for key, value in visualizations.items()}
-    }), 200
+# Category filters: category names are resolved to ids once and remembered
+category_ids = {}
+category_ids_lock = threading.Lock()
+
+def resolve_categories(value):
+    """
+    Turn a "categories" request value (a list, a JSON list or comma-separated ids or
+    names) into category ids, or None when there is no filter.
+    """
+    if value is None or value == '' or value == []:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value) if value.lstrip().startswith('[') else value.split(',')
+    resolved = []
+    for category in (str(item).strip() for item in value):
+        if ObjectId.is_valid(category):
+            resolved.append(category)
+            continue
+        with category_ids_lock:
+            if category not in category_ids:
+                document = get_database()['categories'].find_one({'name': category}, {'_id': 1})
+                if document is None:
+                    continue
+                category_ids[category] = str(document['_id'])
+            resolved.append(category_ids[category])
+    return resolved
+
+def search_rows(data, query_descriptors, features):
+    """
+    Rows a search should score: those of the "categories" partitions, narrowed with
+    "category_probe": N to the N categories whose centroids are closest to the query.
+    Returns None to search everything.
+    """
+    categories = resolve_categories(data.get('categories'))
+    probe = int(data.get('category_probe') or 0)
+    if categories is None and probe <= 0:
+        return None
+    index = get_descriptor_index()
+    with index.lock:
+        if probe > 0:
+            categories = index.rank_categories(query_descriptors, features, probe, categories)
+        return index.partition_rows(categories)
+
+# Search helpers shared by the JSON search endpoints and search-by-image. With rows
+# (a category selection) the approximate index is skipped and those rows are scored exactly.
+def run_simple_search(query_descriptors, max_results, nprobe=None, rows=None):
+    """
+    Color histogram + dominant colors cosine search.
+    """
+    # Score every indexed image with one matrix-vector product per feature
+    return get_descriptor_index().search(
+        query_descriptors, max_results, features=SIMPLE_SEARCH_FEATURES, nprobe=nprobe, rows=rows
+    )
+
+def parse_weighted_search(data, query_descriptors):
+    """
+    Validate the weights, metrics and result options of a weighted search request, returning
+    (weights, metrics, error). Without weights, every feature in the query counts equally;
+    metrics can also be a single name applied to all features.
+    """
+    weights = data.get('weights') or {feature: 1.0 for feature in INDEXED_FEATURES if feature in query_descriptors}
+    feature_metrics = data.get('metrics') or {}
+    if not isinstance(weights, dict):
+        return None, None, {'error': 'Weights must be an object of feature weights'}
+    if isinstance(feature_metrics, str):
+        feature_metrics = {feature: feature_metrics for feature in weights}
+    if not isinstance(feature_metrics, dict):
+        return None, None, {'error': 'Metrics must be a metric name or an object of feature metrics'}
+    error = search_option_error(data)
+    if error:
+        return None, None, {'error': error}
+
+    unknown = [feature for feature in list(weights) + list(feature_metrics) if feature not in INDEXED_FEATURES]
+    if unknown:
+        return None, None, {'error': f"Unknown features: {', '.join(sorted(set(unknown)))}"}
+    invalid = [metric for metric in feature_metrics.values() if metric not in METRICS]
+    if invalid:
+        return None, None, {'error': f"Unknown metrics: {', '.join(sorted(set(map(str, invalid))))}", 'metrics': list(METRICS)}
+    try:
+        weights = {feature: float(weight) for feature, weight in weights.items()}
+    except (TypeError, ValueError):
+        return None, None, {'error': 'Weights must be numbers'}
+    if any(weight < 0 for weight in weights.values()):
+        return None, None, {'error': 'Weights must not be negative'}
+    return weights, feature_metrics, None
+
+def run_weighted_search(query_descriptors, weights, feature_metrics, max_results, nprobe=None, rows=None):
+    index = get_descriptor_index()
+    with index.lock:
+        # Narrow to approximate candidates when an index exists for exactly these features
+        if rows is None and nprobe is not None:
+            features = [feature for feature in INDEXED_FEATURES if weights.get(feature, 0) > 0]
+            rows = index.candidate_rows(query_descriptors, features, nprobe, max(100, 10 * max_results))
+        return index.weighted_search(query_descriptors, weights, feature_metrics, max_results, rows)
+
+def run_feedback_search(query_descriptors, max_results, nprobe=None, rows=None):
+    """
+    Relevance-feedback search over FEEDBACK_SEARCH_FEATURES. Callers sync the feedback
+    model first with get_feedback_model().
+    """
+    features = FEEDBACK_SEARCH_FEATURES
+    index = get_descriptor_index()
+    model = feedback_model
+
+    # Bayesian scoring: query and feedback centroids fold into one weight vector per
+    # feature, so every image is scored with one matrix-vector product per feature
+    weights = model.feature_weights(query_descriptors, features)
+    with index.lock:
+        # With an approximate index, only rescore its candidates instead of every image
+        if rows is None and nprobe is not None:
+            rows = index.candidate_rows(query_descriptors, features, nprobe, max(100, 10 * max_results))
+        scores = index.linear_scores(weights, rows)
+
+        # Apply feedback boosts to the images that received feedback (a dict lookup per boosted image)
+        boosts = model.boosts()
+        boost_positions = index.rows_for(boosts)
+        if rows is not None:
+            positions = {row: i for i, row in enumerate(rows.tolist())}
+            boost_positions = {image_id: positions[row] for image_id, row in boost_positions.items() if row in positions}
+        for image_id, position in boost_positions.items():
+            scores[position] *= boosts[image_id]
+
+        best = top_k(scores, max_results)
+        return index.results(best if rows is None else rows[best], scores[best])
 
 @app.route('/api/descriptors/simple-search', methods=['POST', 'OPTIONS'])
 @cross_origin()
@@ -399,75 +1063,288 @@ def simple_search():
             return '', 200
 
         # Parse input data
+        timer = phase_timer(SEARCH_PHASE_SECONDS, 'simple')
         data = request.get_json()
         if not data:
-            print("[DEBUG] No data received.")
             return jsonify({'error': 'No data received'}), 400
+        if data.get('cursor'):
+            return cursor_response(data['cursor'])
 
         if 'query_descriptors' not in data:
-            print("[DEBUG] Missing 'query_descriptors'.")
             return jsonify({'error': 'Query descriptors are required'}), 400
+        error = search_option_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        timer.mark('parse')
 
         query_descriptors = data['query_descriptors']
-        max_results = data.get('max_results', 5)
-
-        # Connect to MongoDB
-        from pymongo import MongoClient
-        client = MongoClient('mongodb://localhost:27017/')
-        db = client['imagesDB']
-        images_collection = db['images']
-
-        # Compute similarity scores
-        def compute_similarity(image_descriptors, query_descriptors):
-            import numpy as np
-            def normalize(vector):
-                vector = np.array(vector, dtype=float)
-                return vector / (np.linalg.norm(vector) + 1e-8)
-
-            def cosine_similarity(vec1, vec2):
-                return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2) + 1e-8)
-
-            score = 0
-            if 'color_histogram' in image_descriptors and 'color_histogram' in query_descriptors:
-                img_hist = normalize(image_descriptors['color_histogram'])
-                query_hist = normalize(query_descriptors['color_histogram'])
-                score += cosine_similarity(img_hist, query_hist)
-            if 'dominant_colors' in image_descriptors and 'dominant_colors' in query_descriptors:
-                img_colors = normalize(image_descriptors['dominant_colors'])
-                query_colors = normalize(query_descriptors['dominant_colors'])
-                score += cosine_similarity(img_colors, query_colors)
-            return score
-
-        results = []
-        for image in images_collection.find():
-            if 'descriptors' not in image:
-                print(f"[DEBUG] Image {image['filename']} missing descriptors.")
-                continue
-
-            similarity_score = compute_similarity(image['descriptors'], query_descriptors)
-            results.append({
-                'image_id': str(image['_id']),
-                'filename': image['filename'],
-                'similarity_score': similarity_score
-            })
-
-        # Sort results by similarity score
-        results.sort(key=lambda x: x['similarity_score'], reverse=True)
-
-        print(f"[DEBUG] Results: {results[:max_results]}")
-
-        return jsonify({
-            'status': 'success',
-            'results': results[:max_results]
-        })
+        get_descriptor_index()
+        rows = search_rows(data, query_descriptors, SIMPLE_SEARCH_FEATURES)
+        timer.mark('fetch')
+        results = run_simple_search(query_descriptors, result_limit(data), get_nprobe(data), rows)
+        timer.mark('score')
+        response = jsonify(search_payload(data, results))
+        timer.mark('serialize')
+        return response
 
     except Exception as e:
         print(f"[ERROR] Exception occurred: {e}")
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+@app.route('/api/descriptors/weighted-search', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def weighted_search():
+    """
+    Search over any of the indexed descriptor families with per-feature weights and
+    metrics, e.g. {"weights": {"lbp": 2, "color_histogram": 1},
+    "metrics": {"color_histogram": "intersection"}}.
+    """
+    try:
+        if request.method == 'OPTIONS':
+            return '', 200
+
+        timer = phase_timer(SEARCH_PHASE_SECONDS, 'weighted')
+        data = request.get_json()
+        if data and data.get('cursor'):
+            return cursor_response(data['cursor'])
+        if not data or 'query_descriptors' not in data:
+            return jsonify({'error': 'Query descriptors are required'}), 400
+
+        query_descriptors = data['query_descriptors']
+        weights, feature_metrics, error = parse_weighted_search(data, query_descriptors)
+        if error:
+            return jsonify(error), 400
+        timer.mark('parse')
+        get_descriptor_index()
+        rows = search_rows(data, query_descriptors, [feature for feature in weights if weights[feature] > 0])
+        timer.mark('fetch')
+        results = run_weighted_search(query_descriptors, weights, feature_metrics, result_limit(data), get_nprobe(data), rows)
+        timer.mark('score')
+        response = jsonify(search_payload(data, results))
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
+        print(f"[ERROR] Exception occurred: {e}")
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+@app.route('/api/search/by-image', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def search_by_image():
+    """
+    Search with an uploaded image in one request: the multipart "image" file is decoded
+    in memory and only the descriptors the chosen search needs are computed.
+    Form fields: "search" (simple, weighted or feedback; default simple), "max_results",
+    "nprobe", for weighted search "weights" and "metrics" as JSON, and
+    "include_descriptors" to also return the query descriptors (e.g. for feedback).
+    "page_size", "cursor", "categories" and "category_probe" work like in the JSON
+    search endpoints.
+    """
+    try:
+        if request.method == 'OPTIONS':
+            return '', 200
+
+        timer = phase_timer(SEARCH_PHASE_SECONDS, 'by-image')
+        if request.form.get('cursor'):
+            return cursor_response(request.form['cursor'])
+
+        upload = request.files.get('image')
+        if upload is None:
+            return jsonify({'error': 'An image file is required'}), 400
+        if upload.filename and not allowed_file(upload.filename):
+            return jsonify({'error': 'Unsupported file type'}), 400
+
+        form = request.form
+        search = form.get('search', 'simple')
+        error = search_option_error(form)
+        if error:
+            return jsonify({'error': error}), 400
+        max_results = result_limit(form)
+        if search == 'simple':
+            features = SIMPLE_SEARCH_FEATURES
+        elif search == 'feedback':
+            features = FEEDBACK_SEARCH_FEATURES
+        elif search == 'weighted':
+            try:
+                options = {key: json.loads(form[key]) for key in ('weights', 'metrics') if form.get(key)}
+            except ValueError:
+                return jsonify({'error': 'Weights and metrics must be JSON'}), 400
+            weights, feature_metrics, error = parse_weighted_search(options, INDEXED_FEATURES)
+            if error:
+                return jsonify(error), 400
+            features = [feature for feature in INDEXED_FEATURES if weights.get(feature, 0) > 0]
+        else:
+            return jsonify({'error': "Search must be 'simple', 'weighted' or 'feedback'"}), 400
+
+        data = upload.read()
+        timer.mark('parse')
+        query_descriptors, error = compute_descriptors_from_bytes(data, features)
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        timer.mark('descriptors')
+
+        nprobe = get_nprobe(form)
+        get_descriptor_index()
+        if search == 'feedback':
+            get_feedback_model()
+        rows = search_rows(form, query_descriptors, features)
+        timer.mark('fetch')
+        if search == 'simple':
+            results = run_simple_search(query_descriptors, max_results, nprobe, rows)
+        elif search == 'feedback':
+            results = run_feedback_search(query_descriptors, max_results, nprobe, rows)
+        else:
+            results = run_weighted_search(query_descriptors, weights, feature_metrics, max_results, nprobe, rows)
+        timer.mark('score')
+
+        payload = search_payload(form, results)
+        if form.get('include_descriptors', '').lower() in ('1', 'true', 'yes'):
+            payload['query_descriptors'] = query_descriptors
+        response = jsonify(payload)
+        timer.mark('serialize')
+        return response
+
+    except Exception as e:
+        print(f"[ERROR] Exception occurred: {e}")
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+@app.route('/api/index/images/<image_id>', methods=['POST', 'DELETE'])
+@cross_origin()
+def sync_indexed_image(image_id):
+    """
+    Keep the descriptor index in sync after an image is added, updated or deleted.
+    """
+    try:
+        index = get_descriptor_index()
+        if request.method == 'DELETE':
+            removed = index.remove(image_id)
+            return jsonify({'status': 'success', 'indexed': False, 'removed': removed}), 200
+
+        try:
+            object_id = ObjectId(image_id)
+        except InvalidId:
+            return jsonify({'error': 'Invalid image id'}), 400
+
+        image = get_images_collection().find_one({'_id': object_id}, descriptor_projection(INDEXED_FEATURES + [HASH_FEATURE]))
+        if image is None or 'descriptors' not in image:
+            removed = index.remove(image_id)
+            return jsonify({'status': 'success', 'indexed': False, 'removed': removed}), 200
+
+        index.add(image['_id'], image['filename'], image['descriptors'], image.get('category'))
+        return jsonify({'status': 'success', 'indexed': True, 'size': len(index)}), 200
+
+    except Exception as e:
+        print(f"[ERROR] Exception occurred: {e}")
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+@app.route('/api/index/reload', methods=['POST'])
+@cross_origin()
+def reload_index():
+    """
+    Rebuild the descriptor index from MongoDB.
+    """
+    try:
+        load_descriptor_index()
+        return jsonify({'status': 'success', 'size': len(descriptor_index)}), 200
+    except Exception as e:
+        print(f"[ERROR] Exception occurred: {e}")
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+
+def upload_duplicates(index, filenames, distance):
+    """
+    Duplicate check of several stored uploads, in order: matches in the catalog and
+    among the earlier unique files of the same list (those have no image_id yet).
+    """
+    pending = HammingIndex()
+    results = []
+    for filename in filenames:
+        path = upload_path(filename) if isinstance(filename, str) else None
+        if path is None or not os.path.isfile(path):
+            results.append({'filename': filename, 'error': 'File not found in shared uploads folder'})
+            continue
+        with open(path, 'rb') as handle:
+            descriptors, error = compute_descriptors_from_bytes(handle.read(), [HASH_FEATURE])
+        if error:
+            results.append({'filename': filename, 'error': error})
+            continue
+        value = hash_to_int(descriptors[HASH_FEATURE])
+        matches = [match for match in index.duplicates(descriptors, distance) if match['filename'] != filename]
+        matches += [
+            {'image_id': None, 'filename': other, 'distance': other_distance}
+            for other_distance, other in pending.query(value, distance) if other != filename
+        ]
+        if not matches:
+            pending.add(filename, value)
+        matches.sort(key=lambda match: match['distance'])
+        results.append({'filename': filename, 'duplicate': bool(matches), 'matches': matches})
+    return results
+
+@app.route('/api/images/duplicates', methods=['GET', 'POST'])
+@cross_origin()
+def image_duplicates():
+    """
+    GET: report of the near-duplicate groups in the catalog, each a list of
+    {image_id, filename}, largest first. Built from the perceptual hash index, so each
+    image is only compared with the few images sharing one of its hash substrings.
+    POST: check one image before it is added, given as a multipart "image" file or a
+    JSON "filename" in the uploads folder; returns the catalog images it duplicates.
+    With a JSON "filenames" list (one upload of several files), each file is checked
+    against the catalog and against the earlier files of the list that are not
+    duplicates themselves, with one {filename, duplicate, matches} or {filename, error}
+    result per file. Both take an optional "distance" (differing bits, default
+    DUPLICATE_DISTANCE).
+    """
+    try:
+        data = request.args if request.method == 'GET' else (request.get_json(silent=True) or request.form)
+        try:
+            distance = int(data.get('distance', app.config['DUPLICATE_DISTANCE']))
+        except ValueError:
+            return jsonify({'error': 'distance must be an integer'}), 400
+        if not 0 <= distance <= 32:
+            return jsonify({'error': 'distance must be between 0 and 32'}), 400
+        index = get_descriptor_index()
+
+        if request.method == 'GET':
+            groups = index.duplicate_groups(distance)
+            return jsonify({
+                'status': 'success',
+                'distance': distance,
+                'hashed_images': len(index.hashes),
+                # Images not hashed yet, until the ingestor has recomputed them
+                'unhashed_images': len(index) - len(index.hashes),
+                'duplicates': sum(len(group) - 1 for group in groups),
+                'groups': groups,
+            }), 200
+
+        if isinstance(data.get('filenames'), list):
+            return jsonify({'status': 'success', 'results': upload_duplicates(index, data['filenames'], distance)}), 200
+
+        filename = None
+        upload = request.files.get('image')
+        if upload is not None:
+            image_bytes = upload.read()
+        elif data.get('filename'):
+            filename = data['filename']
+            path = upload_path(filename)
+            if path is None or not os.path.isfile(path):
+                return jsonify({'error': 'File not found in shared uploads folder'}), 404
+            with open(path, 'rb') as handle:
+                image_bytes = handle.read()
+        else:
+            return jsonify({'error': 'An image file or filename is required'}), 400
+
+        descriptors, error = compute_descriptors_from_bytes(image_bytes, [HASH_FEATURE])
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        matches = [match for match in index.duplicates(descriptors, distance) if match['filename'] != filename]
+        return jsonify({'status': 'success', 'duplicate': bool(matches), 'matches': matches}), 200
+
+    except Exception as e:
+        print(f"[ERROR] Exception occurred: {e}")
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
-from datetime import datetime
-from pymongo import MongoClient
 
 @app.route('/api/descriptors/feedback', methods=['POST', 'OPTIONS'])
 @cross_origin(origin='http://localhost:4200', headers=['Content-Type', 'Authorization'])
@@ -488,11 +1365,10 @@ def handle_feedback():
         image_id = data['image_id']
         feedback = data['feedback']
         query_descriptors = data['query_descriptors']
+        if feedback not in FEEDBACK_LABELS:
+            return jsonify({'error': f"feedback must be one of: {', '.join(FEEDBACK_LABELS)}"}), 400
 
-        from pymongo import MongoClient
-        client = MongoClient('mongodb://localhost:27017/')
-        db = client['imagesDB']
-        feedback_collection = db['feedback']
+        feedback_collection = get_database()['feedback']
 
         feedback_data = {
             'query_descriptors': query_descriptors,
@@ -501,6 +1377,7 @@ def handle_feedback():
             'timestamp': datetime.utcnow()
         }
         feedback_collection.insert_one(feedback_data)
+        get_feedback_model()
 
         return jsonify({'status': 'success', 'message': 'Feedback saved successfully!'}), 200
     except Exception as e:
@@ -513,99 +1390,147 @@ def handle_feedback():
 @cross_origin()
 def feedback_search():
     try:
+        timer = phase_timer(SEARCH_PHASE_SECONDS, 'feedback')
         data = request.get_json()
+        if data and data.get('cursor'):
+            return cursor_response(data['cursor'])
         if not data or 'query_descriptors' not in data:
             return jsonify({'error': 'Query descriptors are required'}), 400
+        error = search_option_error(data)
+        if error:
+            return jsonify({'error': error}), 400
+        timer.mark('parse')
+
+        get_descriptor_index()
+        get_feedback_model()
+        rows = search_rows(data, data['query_descriptors'], FEEDBACK_SEARCH_FEATURES)
+        timer.mark('fetch')
+        results = run_feedback_search(data['query_descriptors'], result_limit(data), get_nprobe(data), rows)
+        timer.mark('score')
+        response = jsonify(search_payload(data, results))
+        timer.mark('serialize')
+        return response
 
-        # Extract query descriptors for multiple features
-        features = ['color_histogram', 'hog', 'gabor_features']  # Add more features as needed
-        query_descriptors = {feature: np.array(data['query_descriptors'][feature], dtype=float) for feature in features}
-
-        max_results = data.get('max_results', 5)
-
-        client = MongoClient('mongodb://localhost:27017/')
-        db = client['imagesDB']
-        images_collection = db['images']
-        feedback_collection = db['feedback']
-
-        # Fetch the latest feedback data (limit to 50 most recent)
-        feedback_data = list(feedback_collection.find().sort("timestamp", -1).limit(50))
-        relevant_feedback = [fb for fb in feedback_data if fb['feedback'] == 'relevant']
-        non_relevant_feedback = [fb for fb in feedback_data if fb['feedback'] == 'non-relevant']
-
-        # Compute prior probabilities
-        total_feedback = len(relevant_feedback) + len(non_relevant_feedback)
-        prior_relevant = len(relevant_feedback) / total_feedback if total_feedback > 0 else 0.5
-        prior_non_relevant = len(non_relevant_feedback) / total_feedback if total_feedback > 0 else 0.5
-
-        # Compute feature probabilities
-        prob_relevant = {}
-        prob_non_relevant = {}
-        for feature in features:
-            prob_relevant[feature] = compute_feature_probabilities(relevant_feedback, feature)
-            prob_non_relevant[feature] = compute_feature_probabilities(non_relevant_feedback, feature)
-
-        # Normalize probabilities for all features
-        for feature in features:
-            prob_relevant[feature] = prob_relevant[feature] / (np.linalg.norm(prob_relevant[feature]) + 1e-8)
-            prob_non_relevant[feature] = prob_non_relevant[feature] / (np.linalg.norm(prob_non_relevant[feature]) + 1e-8)
-
-        # Bayesian scoring
-        results = []
-        for image in images_collection.find():
-            if 'descriptors' not in image:
-                continue
-
-            relevance_score = 0  # Initialize relevance score
-            feedback_boost = 1.0  # Default boost factor
-
-            # Apply feedback prioritization
-            if str(image['_id']) in [fb['image_id'] for fb in relevant_feedback]:
-                feedback_boost = min(1.5, 1.0 + 0.1 * len(relevant_feedback))
-            elif str(image['_id']) in [fb['image_id'] for fb in non_relevant_feedback]:
-                feedback_boost = max(0.5, 1.0 - 0.1 * len(non_relevant_feedback))
-
-            # Loop through features for scoring
-            for feature in features:
-                if feature not in image['descriptors']:
-                    continue
-
-                descriptors = np.array(image['descriptors'][feature], dtype=float)
-
-                # Calculate likelihoods
-                likelihood_relevant = np.dot(descriptors, prob_relevant[feature])
-                likelihood_non_relevant = np.dot(descriptors, prob_non_relevant[feature])
-
-                # Calculate posterior probabilities
-                posterior_relevant = likelihood_relevant * prior_relevant
-                posterior_non_relevant = likelihood_non_relevant * prior_non_relevant
+    except Exception as e:
+        print(f"[ERROR] Exception occurred: {e}")
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
-                # Update relevance score
-                relevance_score += (
-                    0.6 * np.dot(descriptors, query_descriptors[feature]) +  # Query contribution
-                    1.4 * (posterior_relevant - posterior_non_relevant)      # Feedback adjustment
-                )
 
-            # Apply feedback boost to the final relevance score
-            relevance_score *= feedback_boost
+# Metrics in the Prometheus text format. With METRICS=0 nothing is recorded and /metrics is 404.
+REQUEST_SECONDS = register(Histogram(
+    'http_request_seconds', 'Request latency by route, method and status.', ['route', 'method', 'status']
+))
+
+def cache_lookups():
+    cache = descriptor_cache.default_cache
+    if cache is None:
+        return {}
+    stats = cache.stats()
+    return {(result,): stats[result] for result in ('memory', 'disk', 'miss')}
+
+def job_queue_depth():
+    stats = job_queue.stats()
+    return {(state,): stats[state] for state in ('queued', 'running', 'finished')}
+
+register(Collected(
+    'descriptor_cache_lookups_total', 'Descriptor cache lookups by tier that answered them.',
+    'counter', ['result'], cache_lookups
+))
+register(Collected(
+    'search_cursor_lookups_total', 'Paginated search cursor lookups.',
+    'counter', ['result'], lambda: {(result,): count for result, count in search_results_cache.hits.items()}
+))
+register(Collected(
+    'search_cursor_entries', 'Ranked result lists held for pagination.',
+    'gauge', [], lambda: {(): len(search_results_cache)}
+))
+register(Collected('job_queue_jobs', 'Jobs in the job queue by state.', 'gauge', ['state'], job_queue_depth))
+register(Collected(
+    'descriptor_index_images', 'Images in the in-memory descriptor index.',
+    'gauge', [], lambda: {(): len(descriptor_index)}
+))
+
+if metrics.enabled:
+    @app.before_request
+    def start_request_timer():
+        request.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = getattr(request, 'metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+        return response
 
-            # Store the result for the image with its relevance score
-            results.append({
-                'image_id': str(image['_id']),
-                'filename': image['filename'],
-                'similarity_score': relevance_score
-            })
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-        # Sort results by relevance score
-        results.sort(key=lambda x: x['similarity_score'], reverse=True)
 
-        return jsonify({'status': 'success', 'results': results[:max_results]})
+# App factory: the module only defines the app; the expensive setup runs here once per
+# process, before the first request instead of during it
+app_ready = False
+app_ready_lock = threading.Lock()
 
-    except Exception as e:
-        print(f"[ERROR] Exception occurred: {e}")
-        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+def ensure_indexes():
+    """
+    Create the MongoDB indexes behind the queries the service runs repeatedly.
+    create_index does nothing for an index that already exists.
+    """
+    images_collection = get_images_collection()
+    # Every worker's ingestor polls on these each INGESTION_INTERVAL (see IndexIngestor.poll)
+    images_collection.create_index('uploadDate')
+    images_collection.create_index('indexedAt')
+    # Backfill of documents without current descriptors (see IndexIngestor.backfill)
+    images_collection.create_index('descriptorVersion')
+    # Feedback-weighted searches read the feedback stored since the last one (see FeedbackModel.sync)
+    get_database()['feedback'].create_index('timestamp')
+
+def create_app():
+    """
+    Connect to MongoDB, build the descriptor pipeline and load the descriptor index,
+    then return the app. WSGI servers can call it directly, e.g.
+    `waitress-serve --call app:create_app`.
+    """
+    global app_ready
+    with app_ready_lock:
+        if app_ready:
+            return app
+        get_mongo_client()
+        try:
+            ensure_indexes()
+        except Exception as e:
+            print(f"[ERROR] Could not create MongoDB indexes: {e}")
+        get_pipeline()
+        try:
+            get_descriptor_index()
+            print(f"Descriptor index loaded with {len(descriptor_index)} images.")
+        except Exception as e:
+            print(f"[ERROR] Could not load descriptor index: {e}")
+        app_ready = True
+    return app
 
 
 # Main App Runner
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    if app.config['SERVING_MODE'] != 'production':
+        # The reloader parent only watches files; load the index and start the
+        # ingestor in the child process that serves requests
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            create_app()
+        app.run(debug=True, port=5001)
+    else:
+        create_app()
+        # Multi-threaded server without the debugger; heavy work is offloaded to job_queue
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+        host = os.environ.get('HOST', '0.0.0.0')
+        if serve is not None:
+            serve(app, host=host, port=5001, threads=int(os.environ.get('SERVER_THREADS', 16)))
+        else:
+            app.run(host=host, port=5001, threaded=True, debug=False)
@@ -0,0 +1,68 @@
+"""
+Recall@k and latency of the IVF / IVF-PQ search backends against exact search.
+
+Usage: python benchmarks/bench_ann.py [--images 20000] [--queries 200] [--k 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common import ListCollection, synthetic_descriptors  # noqa: E402
+from descriptor_index import DescriptorIndex  # noqa: E402
+
+
+def timed_search(index, queries, k, nprobe=None, n_candidates=None):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query, k, nprobe=nprobe, n_candidates=n_candidates)
+        latencies.append(time.perf_counter() - start)
+        results.append([hit['image_id'] for hit in hits])
+    return results, np.array(latencies) * 1000
+
+
+def recall_at_k(approx, exact):
+    return np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--clusters', type=int, default=50)
+    parser.add_argument('--pq-m', type=int, default=16)
+    parser.add_argument('--candidates', type=int, default=None,
+                        help='IVF-PQ candidates re-scored exactly (default: max(100, 10k))')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    descriptors, _ = synthetic_descriptors(args.images + args.queries, args.clusters, rng)
+    documents = [
+        {'_id': f'{i:024x}', 'filename': f'image_{i}.jpg', 'descriptors': d}
+        for i, d in enumerate(descriptors[:args.images])
+    ]
+    queries = descriptors[args.images:]
+    features = ['color_histogram', 'dominant_colors']
+
+    index = DescriptorIndex(features)
+    index.load(ListCollection(documents))
+    exact, latencies = timed_search(index, queries, args.k)
+    print(f"exact              recall@{args.k}=1.000  p50={np.percentile(latencies, 50):.2f}ms  p99={np.percentile(latencies, 99):.2f}ms")
+
+    for name, pq_m in (('ivf', 0), ('ivfpq', args.pq_m)):
+        start = time.perf_counter()
+        ann = index.build_ann(features, pq_m=pq_m)
+        print(f"{name}: built {ann.nlist} lists in {time.perf_counter() - start:.1f}s")
+        for nprobe in (1, 2, 4, 8, 16, 32):
+            approx, latencies = timed_search(index, queries, args.k, nprobe, args.candidates)
+            print(
+                f"{name:6} nprobe={nprobe:<3} recall@{args.k}={recall_at_k(approx, exact):.3f}"
+                f"  p50={np.percentile(latencies, 50):.2f}ms  p99={np.percentile(latencies, 99):.2f}ms"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Cold start of the descriptor index: decoding every document (as DescriptorIndex.load
+does from MongoDB) against memory-mapping a saved IndexStore snapshot, and the resident
+memory of several worker processes sharing that snapshot.
+
+Each worker is a fresh process that loads the index and runs a few searches; RSS counts
+shared pages in every process, PSS splits them between the processes that map them.
+
+Usage: python benchmarks/bench_cold_start.py [--images 50000] [--workers 4]
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+
+from common import DESCRIPTOR_SIZES, ListCollection, synthetic_descriptors  # noqa: E402
+from descriptor_index import DescriptorIndex  # noqa: E402
+from index_store import IndexStore  # noqa: E402
+
+FEATURES = ['color_histogram', 'dominant_colors', 'hog']
+VERSION = 'bench'
+
+
+def memory_usage():
+    """
+    (RSS, PSS) of this process in bytes, from /proc/self/smaps_rollup where available.
+    """
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as handle:
+            for line in handle:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    usage[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return usage.get('Rss'), usage.get('Pss')
+
+
+def worker(folder, queries, ready, done):
+    start = time.perf_counter()
+    index = DescriptorIndex(FEATURES)
+    IndexStore(folder, VERSION).load(index)
+    load_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    index.search(queries[0], 10, features=FEATURES)
+    first_search_ms = (time.perf_counter() - start) * 1000
+    for query in queries[1:]:
+        index.search(query, 10, features=FEATURES)
+    # Measure while every worker still maps the snapshot
+    ready.wait()
+    rss, pss = memory_usage()
+    done.put((load_ms, first_search_ms, rss, pss))
+    ready.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    descriptors, labels = synthetic_descriptors(args.images + args.queries, 20, rng, features=tuple(FEATURES))
+    documents = [
+        {'_id': f'{i:024x}', 'filename': f'image_{i}.jpg', 'category': f'category_{labels[i]}',
+         'descriptors': {feature: value.tolist() for feature, value in d.items()}}
+        for i, d in enumerate(descriptors[:args.images])
+    ]
+    queries = [{feature: value.tolist() for feature, value in d.items()} for d in descriptors[args.images:]]
+    del descriptors
+    matrix_bytes = args.images * sum(DESCRIPTOR_SIZES[feature] for feature in FEATURES) * 4
+    print(f"{args.images} images, {matrix_bytes / 2**20:.0f}MB of float32 matrices")
+
+    index = DescriptorIndex(FEATURES)
+    start = time.perf_counter()
+    index.load(ListCollection(documents))
+    print(f"decode from documents: {(time.perf_counter() - start) * 1000:8.1f}ms")
+    del documents
+
+    with tempfile.TemporaryDirectory() as folder:
+        store = IndexStore(folder, VERSION)
+        start = time.perf_counter()
+        store.save(index)
+        print(f"save snapshot:         {(time.perf_counter() - start) * 1000:8.1f}ms")
+        del index
+
+        context = multiprocessing.get_context('spawn')
+        ready = context.Barrier(args.workers + 1)
+        done = context.Queue()
+        processes = [context.Process(target=worker, args=(folder, queries, ready, done)) for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        ready.wait()
+        results = [done.get() for _ in processes]
+        ready.wait()
+        for process in processes:
+            process.join()
+
+    load_ms, first_ms, rss, pss = (np.array(values, dtype=float) for values in zip(*results))
+    print(f"load snapshot:         {load_ms.mean():8.1f}ms per worker (first search {first_ms.mean():.1f}ms)")
+    if not np.isnan(rss).any():
+        print(
+            f"{args.workers} workers: RSS {rss.mean() / 2**20:.0f}MB each, "
+            f"PSS {pss.mean() / 2**20:.0f}MB each, {pss.sum() / 2**20:.0f}MB in total"
+        )
+
+
+if __name__ == '__main__':
+    main()
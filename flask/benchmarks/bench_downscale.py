@@ -0,0 +1,106 @@
+"""
+Extraction time and ranking shift of downscaled / subsampled descriptor extraction
+against full-fidelity extraction.
+
+Each setting is (max_side, kmeans_sample, kmeans_attempts). Rankings are compared by
+overlap@k and mean rank displacement of the full-fidelity top-k, searched with the
+same DescriptorIndex the API uses.
+
+Usage: python benchmarks/bench_downscale.py [--images 60] [--size 1600x1200] [--images-dir DIR]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from common import ListCollection, synthetic_image  # noqa: E402
+from descriptor_index import DescriptorIndex  # noqa: E402
+from descriptors import DESCRIPTOR_CONFIG, DescriptorPipeline, FEATURES, load_image  # noqa: E402
+
+SETTINGS = [
+    (0, 0, 10),
+    (1024, 20000, 3),
+    (512, 10000, 3),
+    (256, 5000, 1),
+]
+
+
+def load_corpus(args, rng):
+    if args.images_dir:
+        names = sorted(
+            name for name in os.listdir(args.images_dir)
+            if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))
+        )[:args.images]
+        return [load_image(os.path.join(args.images_dir, name)) for name in names]
+    height, width = (int(v) for v in args.size.lower().split('x'))
+    return [synthetic_image(rng, height, width) for _ in range(args.images)]
+
+
+def extract_all(pipeline, images):
+    descriptors, elapsed = [], []
+    for image in images:
+        start = time.perf_counter()
+        descriptors.append(pipeline.compute(image))
+        elapsed.append((time.perf_counter() - start) * 1000)
+    return descriptors, np.array(elapsed)
+
+
+def rankings(descriptors, features, k):
+    documents = [
+        {'_id': f'{i:024x}', 'filename': f'image_{i}.jpg', 'descriptors': d}
+        for i, d in enumerate(descriptors)
+    ]
+    index = DescriptorIndex(features)
+    index.load(ListCollection(documents))
+    return [
+        [hit['image_id'] for hit in index.search(query, len(descriptors), features=features)]
+        for query in descriptors
+    ]
+
+
+def ranking_shift(reference, candidate, k):
+    overlaps, displacements = [], []
+    for ref, cand in zip(reference, candidate):
+        position = {image_id: rank for rank, image_id in enumerate(cand)}
+        overlaps.append(len(set(ref[:k]) & set(cand[:k])) / k)
+        displacements.append(np.mean([abs(position[image_id] - rank) for rank, image_id in enumerate(ref[:k])]))
+    return float(np.mean(overlaps)), float(np.mean(displacements))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=60)
+    parser.add_argument('--size', default='1600x1200', help='Synthetic image size, HEIGHTxWIDTH')
+    parser.add_argument('--images-dir', default=None, help='Use real images from this folder instead')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    images = load_corpus(args, np.random.default_rng(args.seed))
+    k = min(args.k, len(images) - 1)
+    feature_sets = {
+        'simple': ['color_histogram', 'dominant_colors'],
+        'all': list(FEATURES),
+    }
+
+    reference = None
+    for max_side, kmeans_sample, kmeans_attempts in SETTINGS:
+        config = dict(DESCRIPTOR_CONFIG, max_side=max_side, kmeans_sample=kmeans_sample, kmeans_attempts=kmeans_attempts)
+        descriptors, elapsed = extract_all(DescriptorPipeline(config), images)
+        ranked = {name: rankings(descriptors, features, k) for name, features in feature_sets.items()}
+        if reference is None:
+            reference = ranked
+
+        line = (
+            f"max_side={max_side or 'full':>4}  sample={kmeans_sample or 'all':>5}  attempts={kmeans_attempts:>2}  "
+            f"extract mean={elapsed.mean():7.1f}ms p95={np.percentile(elapsed, 95):7.1f}ms"
+        )
+        for name in feature_sets:
+            overlap, displacement = ranking_shift(reference[name], ranked[name], k)
+            line += f"  {name}: overlap@{k}={overlap:.3f} displacement={displacement:.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Per-image render time of the visualization backends: the original pyplot functions,
+reused matplotlib figure templates and the OpenCV raster renderer. Each image renders
+all seven plots; --threads renders several images concurrently.
+
+Usage: python benchmarks/bench_render.py [--images 20] [--threads 1]
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common import latency_summary, synthetic_image  # noqa: E402
+from descriptors import DescriptorPipeline  # noqa: E402
+from visualizations import VISUALIZATION_BACKENDS, VISUALIZATION_KINDS, render_visualization  # noqa: E402
+
+
+def render_all(backend, image, descriptors, folder, name):
+    start = time.perf_counter()
+    for kind in VISUALIZATION_KINDS:
+        render_visualization(kind, image, descriptors, os.path.join(folder, f"{name}_{kind}.png"), backend=backend)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--size', default='480x640', help='Synthetic image size, HEIGHTxWIDTH')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--backends', nargs='+', default=list(VISUALIZATION_BACKENDS), choices=VISUALIZATION_BACKENDS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads > 1 and 'pyplot' in args.backends:
+        # pyplot keeps global figure state and is not safe to call from several threads
+        args.backends.remove('pyplot')
+        print("pyplot skipped: not thread-safe")
+
+    rng = np.random.default_rng(args.seed)
+    height, width = (int(v) for v in args.size.lower().split('x'))
+    pipeline = DescriptorPipeline()
+    images = [synthetic_image(rng, height, width) for _ in range(args.images)]
+    corpus = [(image, pipeline.compute(image)) for image in images]
+
+    with tempfile.TemporaryDirectory() as folder:
+        for backend in args.backends:
+            # Warm up: the first render builds templates and fonts
+            render_all(backend, *corpus[0], folder, 'warmup')
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                latencies = list(executor.map(
+                    lambda item: render_all(backend, item[1][0], item[1][1], folder, f"{backend}_{item[0]}"),
+                    enumerate(corpus)
+                ))
+            elapsed = time.perf_counter() - start
+            sizes = [os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder) if name.startswith(f"{backend}_")]
+            summary = latency_summary(latencies)
+            print(
+                f"{backend:<10} per image: mean={summary['mean_ms']:7.1f}ms p95={summary['p95_ms']:7.1f}ms  "
+                f"throughput={len(corpus) / elapsed:6.1f} images/s  mean file={np.mean(sizes) / 1024:6.1f}KB"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+p50/p95/p99 latency of the search endpoints, end to end through the Flask app.
+
+Runs offline against mongomock by default, or against a local mongod with --mongo-uri
+(data goes to a separate database, imagesDB_bench unless --db is given).
+--per-request-client reproduces the old behaviour of opening a MongoClient per request
+(needs --mongo-uri, since mongomock clients do not share data).
+
+Usage: python benchmarks/bench_search_latency.py [--images 2000] [--requests 200]
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from common import DESCRIPTOR_SIZES, latency_summary, synthetic_descriptors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--feedback', type=int, default=50)
+    parser.add_argument('--mongo-uri', default=None)
+    parser.add_argument('--db', default='imagesDB_bench')
+    parser.add_argument('--per-request-client', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.per_request_client and not args.mongo_uri:
+        parser.error('--per-request-client needs --mongo-uri')
+
+    import app as service
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        service.app.config['MONGO_URI'] = args.mongo_uri
+        if args.per_request_client:
+            service.get_mongo_client = lambda: MongoClient(args.mongo_uri)
+    else:
+        import mongomock
+        service.mongo_client = mongomock.MongoClient()
+    service.app.config['MONGO_DB'] = args.db
+    service.app.config['INGESTION'] = 'off'  # The corpus is static
+    service.app.config['INDEX_STORE'] = ''
+
+    rng = np.random.default_rng(args.seed)
+    descriptors, labels = synthetic_descriptors(args.images + args.requests, 20, rng, features=tuple(DESCRIPTOR_SIZES))
+    descriptors = [{feature: value.tolist() for feature, value in d.items()} for d in descriptors]
+    queries = descriptors[args.images:]
+
+    db = service.get_database()
+    db['images'].drop()
+    db['feedback'].drop()
+    result = db['images'].insert_many([
+        {'filename': f'image_{i}.jpg', 'path': f'image_{i}.jpg', 'size': 0, 'category': int(labels[i]), 'descriptors': d}
+        for i, d in enumerate(descriptors[:args.images])
+    ])
+    db['feedback'].insert_many([
+        {
+            'query_descriptors': queries[i % len(queries)],
+            'image_id': str(result.inserted_ids[i]),
+            'feedback': 'relevant' if i % 2 else 'non-relevant',
+            'timestamp': datetime.utcnow(),
+        }
+        for i in range(args.feedback)
+    ])
+
+    start = time.perf_counter()
+    service.load_descriptor_index()
+    print(f"index load: {(time.perf_counter() - start) * 1000:.1f}ms for {args.images} images")
+
+    client = service.app.test_client()
+    for endpoint in ('/api/descriptors/simple-search', '/api/descriptors/feedback-search'):
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            response = client.post(endpoint, json={'query_descriptors': query, 'max_results': 10})
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        summary = latency_summary(latencies)
+        print(f"{endpoint:36} p50={summary['p50_ms']:.2f}ms  p95={summary['p95_ms']:.2f}ms  p99={summary['p99_ms']:.2f}ms")
+
+    if args.mongo_uri:
+        db.client.drop_database(args.db)
+
+
+if __name__ == '__main__':
+    main()
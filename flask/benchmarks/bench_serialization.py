@@ -0,0 +1,77 @@
+"""
+Payload size and encode time of a /api/descriptors/compute response in each format:
+the previous stdlib json of Python lists against dumps_json of float32 arrays, rounded
+values, base64-packed float32 and msgpack (when installed).
+
+Usage: python benchmarks/bench_serialization.py [--images 20] [--repeat 200]
+"""
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+
+from common import latency_summary, synthetic_image  # noqa: E402
+from descriptors import DescriptorPipeline  # noqa: E402
+from serialization import available_formats, encode_payload, orjson, pack_descriptors  # noqa: E402
+
+
+def stdlib_json(payload):
+    # What jsonify did before: the descriptors as lists through the json module
+    return json.dumps(payload).encode(), 'application/json'
+
+
+def packed(response_format, precision=None):
+    def encode(payload):
+        body = dict(payload, descriptors=pack_descriptors(payload['descriptors'], response_format, precision))
+        return encode_payload(body, response_format)
+    return encode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--size', default='400x400', help='Synthetic image size, HEIGHTxWIDTH')
+    parser.add_argument('--repeat', type=int, default=200, help='Encodes timed per image')
+    parser.add_argument('--precision', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    height, width = (int(v) for v in args.size.lower().split('x'))
+    pipeline = DescriptorPipeline()
+    payloads = [
+        {
+            'status': 'success',
+            'descriptors': pipeline.compute(synthetic_image(rng, height, width)),
+            'visualizations': {'color_histogram': 'visualizations/image.jpg.0123456789_color_histogram.png'},
+        }
+        for _ in range(args.images)
+    ]
+
+    encoders = {'json (stdlib, lists)': stdlib_json}
+    for response_format in available_formats():
+        encoders[response_format] = packed(response_format)
+    encoders[f'json (precision={args.precision})'] = packed('json', args.precision)
+    print(f"JSON encoder: {'orjson' if orjson is not None else 'stdlib json'}; formats: {', '.join(available_formats())}")
+
+    for name, encode in encoders.items():
+        latencies, sizes, compressed = [], [], []
+        for payload in payloads:
+            body, _ = encode(payload)
+            sizes.append(len(body))
+            compressed.append(len(gzip.compress(body)))
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                encode(payload)
+            latencies.append((time.perf_counter() - start) * 1000 / args.repeat)
+        summary = latency_summary(latencies)
+        print(
+            f"{name:<24} size={np.mean(sizes) / 1024:6.1f}KB gzip={np.mean(compressed) / 1024:6.1f}KB  "
+            f"encode mean={summary['mean_ms'] * 1000:7.1f}us p95={summary['p95_ms'] * 1000:7.1f}us"
+        )
+
+
+if __name__ == '__main__':
+    main()
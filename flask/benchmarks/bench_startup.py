@@ -0,0 +1,75 @@
+"""
+Startup-time budget of the Flask service, measured with `python -X importtime -c
+"import app"` in a fresh interpreter. Prints the total import time and the slowest
+imports, and exits with status 1 when the best of --runs exceeds --budget-ms or when a
+module that should only load on first use (pyplot, scikit-image) is imported.
+
+Usage: python benchmarks/bench_startup.py [--budget-ms 600] [--runs 3] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from common import FLASK_DIR  # noqa: E402
+
+# Modules that must not be imported by `import app`
+LAZY_MODULES = ('matplotlib', 'matplotlib.pyplot', 'skimage')
+
+
+def import_times(module='app'):
+    """
+    Run one import under -X importtime and return [(cumulative us, self us, depth, name)].
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=FLASK_DIR, capture_output=True, text=True, env=dict(os.environ, INGESTION='off'),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=600)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [sum(row[0] for row in rows if row[2] == 0) / 1000 for rows in runs]
+    best = min(range(len(runs)), key=lambda i: totals[i])
+    rows = runs[best]
+
+    print(f"import {args.module}: best {totals[best]:.0f}ms, runs: {', '.join(f'{total:.0f}ms' for total in totals)}")
+    print("slowest imports (cumulative):")
+    # Direct dependencies of the measured module and other top-level imports
+    direct = [row for row in rows if row[2] <= 1 and row[3] != args.module]
+    for cumulative_us, self_us, _, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+
+    failures = []
+    imported = {row[3] for row in rows}
+    eager = [module for module in LAZY_MODULES if module in imported]
+    if eager:
+        failures.append(f"imported at startup but meant to load lazily: {', '.join(eager)}")
+    if totals[best] > args.budget_ms:
+        failures.append(f"import time {totals[best]:.0f}ms is over the {args.budget_ms:.0f}ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: within the {args.budget_ms:.0f}ms budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
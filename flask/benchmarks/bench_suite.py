@@ -0,0 +1,275 @@
+"""
+Reproducible benchmark suite: descriptor extraction per stage, index build time and
+memory, and search latency percentiles at several corpus sizes, written to JSON so
+runs can be compared across commits.
+
+Everything runs offline: images are synthetic (or read from a local folder such as
+RSSCN7 with --images-dir), the corpus descriptors are synthetic (or resampled from the
+extracted ones), the index is loaded from an in-memory collection and the endpoints run
+through the Flask test client with mongomock behind them.
+
+Usage:
+    python benchmarks/bench_suite.py [--scales 1000 10000 100000] [--output results.json]
+    python benchmarks/bench_suite.py --compare baseline.json results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from common import DESCRIPTOR_SIZES, FLASK_DIR, ListCollection, latency_summary, synthetic_descriptors, synthetic_image  # noqa: E402
+from feedback_model import FeedbackModel  # noqa: E402
+from descriptors import DESCRIPTOR_VERSION, FEATURES, compute_descriptors_from_bytes, extract_descriptors, load_image  # noqa: E402
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=FLASK_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resident_memory_bytes():
+    """
+    Current resident set size of this process, where /proc is available.
+    """
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def load_images(args, rng):
+    """
+    Images to time extraction on and their category labels (the parent folder name,
+    as in RSSCN7, or None for synthetic images).
+    """
+    if args.images_dir:
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(args.images_dir)
+            for name in names if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tif'))
+        )
+        # Spread the sample over every category folder
+        step = max(1, len(paths) // args.extract_images)
+        paths = paths[::step][:args.extract_images]
+        return [load_image(path)[0] for path in paths], [os.path.basename(os.path.dirname(path)) for path in paths]
+    height, width = (int(v) for v in args.size.lower().split('x'))
+    return [synthetic_image(rng, height, width) for _ in range(args.extract_images)], None
+
+
+def bench_extraction(images):
+    """
+    Decode + extract every image from encoded JPEG bytes, bypassing the cache.
+    """
+    extract_descriptors(images[0])  # Warm up
+    stages, totals, extracted = {}, [], []
+    for image in images:
+        data = cv2.imencode('.jpg', image)[1].tobytes()
+        timings = {}
+        start = time.perf_counter()
+        descriptors, _ = compute_descriptors_from_bytes(data, cache=False, timings=timings)
+        totals.append((time.perf_counter() - start) * 1000)
+        extracted.append(descriptors)
+        for stage, elapsed in timings.items():
+            stages.setdefault(stage, []).append(elapsed)
+    return {
+        'images': len(images),
+        'total': latency_summary(totals),
+        'stages': {stage: latency_summary(values) for stage, values in stages.items()},
+    }, extracted
+
+
+def resampled_descriptors(extracted, image_labels, count, rng):
+    """
+    Grow a small set of extracted descriptors to count images by resampling with jitter.
+    """
+    picks = rng.integers(0, len(extracted), size=count)
+    corpus = []
+    for pick in picks:
+        source = extracted[pick]
+        corpus.append({
+            feature: np.abs(np.asarray(source[feature], dtype=np.float32) * rng.normal(1, 0.05, len(source[feature])).astype(np.float32))
+            for feature in FEATURES if feature in source
+        })
+    return corpus, [image_labels[pick] for pick in picks]
+
+
+def bench_scale(service, descriptors, labels, queries, args):
+    count = len(descriptors)
+    documents = [
+        {'_id': f'{i:024x}', 'filename': f'image_{i}.jpg', 'category': f'category_{labels[i]}', 'descriptors': d}
+        for i, d in enumerate(descriptors)
+    ]
+
+    index = service.descriptor_index
+    memory_before = resident_memory_bytes()
+    start = time.perf_counter()
+    index.load(ListCollection(documents))
+    build_ms = (time.perf_counter() - start) * 1000
+    memory_after = resident_memory_bytes()
+    matrix_bytes = sum(matrix.rows.nbytes + matrix.norms.nbytes for matrix in index.matrices.values())
+
+    result = {
+        'images': count,
+        'index_build_ms': build_ms,
+        'index_matrix_bytes': matrix_bytes,
+        'index_rss_delta_bytes': None if memory_before is None else memory_after - memory_before,
+    }
+
+    features = service.SIMPLE_SEARCH_FEATURES
+    start = time.perf_counter()
+    index.build_ann(features, pq_m=args.pq_m)
+    result['ann_build_ms'] = (time.perf_counter() - start) * 1000
+    # The service builds the feedback index the same way; feedback and weighted search
+    # (which lists the same features in indexing order) must both find it
+    index.build_ann(service.FEEDBACK_SEARCH_FEATURES, pq_m=args.pq_m)
+    for ordering in (service.FEEDBACK_SEARCH_FEATURES, sorted(service.FEEDBACK_SEARCH_FEATURES)):
+        assert index.candidate_rows(queries[0], ordering, args.nprobe, args.k) is not None, ordering
+
+    latencies = {'index.search': [], 'index.search(ivfpq)': []}
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, args.k, features=features)
+        latencies['index.search'].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        index.search(query, args.k, features=features, nprobe=args.nprobe)
+        latencies['index.search(ivfpq)'].append((time.perf_counter() - start) * 1000)
+
+    client = service.app.test_client()
+    json_queries = [{feature: value.tolist() for feature, value in query.items()} for query in queries]
+    requests = {
+        '/api/descriptors/simple-search': {},
+        '/api/descriptors/weighted-search': {'metrics': {'color_histogram': 'intersection', 'lbp': 'chi_square'}},
+        '/api/descriptors/feedback-search': {},
+    }
+    for endpoint, options in requests.items():
+        latencies[endpoint] = []
+        for query in json_queries:
+            start = time.perf_counter()
+            response = client.post(endpoint, json=dict(options, query_descriptors=query, max_results=args.k))
+            latencies[endpoint].append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+    result['latency'] = {name: latency_summary(values) for name, values in latencies.items()}
+    return result
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}{key}."))
+        return items
+    return {prefix[:-1]: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare(baseline_path, current_path):
+    """
+    Print every numeric metric of two result files with its relative change.
+    """
+    with open(baseline_path) as handle:
+        baseline = flatten(json.load(handle)['results'])
+    with open(current_path) as handle:
+        current = flatten(json.load(handle)['results'])
+    for key in sorted(set(baseline) & set(current)):
+        before, after = baseline[key], current[key]
+        change = (after - before) / before * 100 if before else float('nan')
+        print(f"{key:<80} {before:>14.3f} {after:>14.3f} {change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--images-dir', default=None, help='Local image folder (e.g. RSSCN7) instead of synthetic images')
+    parser.add_argument('--extract-images', type=int, default=20, help='Images timed through extraction')
+    parser.add_argument('--size', default='400x400', help='Synthetic image size, HEIGHTxWIDTH')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--feedback', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--pq-m', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    import mongomock
+    import app as service
+    service.mongo_client = mongomock.MongoClient()
+    service.app.config['MONGO_DB'] = 'imagesDB_bench'
+    service.app.config['SEARCH_BACKEND'] = 'exact'
+    service.app.config['INGESTION'] = 'off'  # The corpus is static
+    service.app.config['INDEX_STORE'] = ''
+
+    rng = np.random.default_rng(args.seed)
+    print(f"extraction: {args.extract_images} images", file=sys.stderr)
+    images, image_labels = load_images(args, rng)
+    extraction, extracted = bench_extraction(images)
+    del images
+
+    results = {'extraction': extraction, 'scales': {}}
+    for scale in args.scales:
+        print(f"scale {scale}: generating corpus", file=sys.stderr)
+        if args.images_dir:
+            descriptors, labels = resampled_descriptors(extracted, image_labels, scale + args.queries, rng)
+        else:
+            descriptors, labels = synthetic_descriptors(scale + args.queries, 20, rng, features=tuple(DESCRIPTOR_SIZES))
+        queries = descriptors[scale:]
+
+        database = service.get_database()
+        database['feedback'].drop()
+        database['feedback'].insert_many([
+            {
+                'query_descriptors': {feature: value.tolist() for feature, value in queries[i % len(queries)].items()},
+                'image_id': f'{i:024x}',
+                'feedback': 'relevant' if i % 2 else 'non-relevant',
+                'timestamp': datetime.utcnow(),
+            }
+            for i in range(min(args.feedback, scale))
+        ])
+        service.feedback_model = FeedbackModel(service.FEEDBACK_SEARCH_FEATURES)
+
+        print(f"scale {scale}: indexing and searching", file=sys.stderr)
+        results['scales'][str(scale)] = bench_scale(service, descriptors[:scale], labels, queries, args)
+        del descriptors, queries
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'descriptor_version': DESCRIPTOR_VERSION,
+        'config': {key: value for key, value in vars(args).items() if key != 'compare'},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+        print(f"results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
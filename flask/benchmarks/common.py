@@ -0,0 +1,105 @@
+"""
+Shared helpers for the benchmark scripts: synthetic descriptors and small stand-ins.
+"""
+import os
+import sys
+
+import numpy as np
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if FLASK_DIR not in sys.path:
+    sys.path.insert(0, FLASK_DIR)
+
+# Lengths of each descriptor family as produced by compute_descriptors
+DESCRIPTOR_SIZES = {
+    'color_histogram': 512,
+    'dominant_colors': 9,
+    'gabor_features': 4,
+    'hu_moments': 7,
+    'lbp': 26,
+    'hog': 1000,
+    'edge_histogram': 18,
+}
+
+
+class ListCursor(list):
+    def batch_size(self, size):
+        return self
+
+
+class ListCollection:
+    """
+    Minimal stand-in for a pymongo collection, enough for DescriptorIndex.load.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, *args, **kwargs):
+        return ListCursor(self.documents)
+
+
+def synthetic_descriptors(count, clusters, rng, features=('color_histogram', 'dominant_colors'), chunk_size=10000):
+    """
+    Clustered, non-negative float32 descriptors. Images within a cluster (a scene category)
+    vary along a few shared directions, plus a little noise. Generated in chunks so that
+    large corpora do not need (count, 8, size) temporaries.
+    """
+    labels = rng.integers(0, clusters, size=count)
+    columns = {}
+    for feature in features:
+        size = DESCRIPTOR_SIZES[feature]
+        column = columns[feature] = np.empty((count, size), dtype=np.float32)
+        if feature == 'dominant_colors':
+            centers = rng.uniform(0, 255, size=(clusters, size))
+            for start in range(0, count, chunk_size):
+                chunk = labels[start:start + chunk_size]
+                column[start:start + len(chunk)] = np.clip(centers[chunk] + rng.normal(0, 20, size=(len(chunk), size)), 0, 255)
+            continue
+        centers = rng.gamma(0.3, size=(clusters, size))
+        directions = rng.normal(0, 0.3, size=(clusters, 8, size))
+        for start in range(0, count, chunk_size):
+            chunk = labels[start:start + chunk_size]
+            weights = rng.normal(size=(len(chunk), 8))
+            column[start:start + len(chunk)] = np.abs(
+                centers[chunk]
+                + np.einsum('ij,ijk->ik', weights, directions[chunk])
+                + rng.normal(0, 0.02, size=(len(chunk), size))
+            )
+    return [{feature: columns[feature][i] for feature in features} for i in range(count)], labels
+
+
+def synthetic_image(rng, height, width, blobs=12):
+    """
+    BGR uint8 test image: a smooth color gradient with a few filled shapes and some
+    noise, so every descriptor family has something to respond to.
+    """
+    import cv2
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, size=3)
+    slope = rng.uniform(-1, 1, size=(3, 2)) * 255
+    image = np.stack([
+        base[c] + slope[c, 0] * y / height + slope[c, 1] * x / width for c in range(3)
+    ], axis=-1)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    for _ in range(blobs):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(min(height, width) // 20 + 1, min(height, width) // 4 + 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        if rng.random() < 0.5:
+            cv2.circle(image, center, radius, color, -1)
+        else:
+            cv2.rectangle(image, center, (center[0] + radius, center[1] + radius), color, -1)
+    noise = rng.normal(0, 6, size=image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def latency_summary(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms)
+    return {
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'mean_ms': float(latencies_ms.mean()),
+    }
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class DescriptorCache:
+    """
+    Two-tier descriptor cache keyed by image content hash plus descriptor-config version:
+    an in-memory LRU in front of size-bounded .npz files on disk. Several processes may
+    share the directory, so disk_bytes is only this process's estimate; the directory is
+    measured again whenever the estimate exceeds the budget or this process has written
+    another sixteenth of it.
+    """
+
+    def __init__(self, directory, version, max_memory_entries=512, max_disk_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.version = version
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0, 'miss': 0}
+        os.makedirs(directory, exist_ok=True)
+        self.disk_bytes = sum(size for _, size, _ in self._disk_entries())
+        self.measure_bytes = max(1, max_disk_bytes // 16)
+        self.unmeasured_bytes = 0
+
+    def key(self, data):
+        """
+        Cache key for raw image bytes under the current descriptor configuration.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}-{self.version}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.npz'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key):
+        """
+        Return cached descriptors (as lists) or None.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return dict(self.memory[key])
+
+        path = self._path(key)
+        try:
+            with np.load(path) as archive:
+                descriptors = {name: archive[name].tolist() for name in archive.files}
+            os.utime(path)  # Keep recently used files away from eviction
+        except (OSError, ValueError):
+            with self.lock:
+                self.hits['miss'] += 1
+            return None
+
+        with self.lock:
+            self.hits['disk'] += 1
+            self._remember(key, descriptors)
+        return dict(descriptors)
+
+    def put(self, key, descriptors):
+        with self.lock:
+            self._remember(key, dict(descriptors))
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as handle:
+            np.savez(handle, **{name: np.asarray(value) for name, value in descriptors.items()})
+        size = os.path.getsize(temporary)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(temporary, path)
+
+        with self.lock:
+            self.disk_bytes += size - replaced
+            self.unmeasured_bytes += size
+            if self.disk_bytes > self.max_disk_bytes or self.unmeasured_bytes >= self.measure_bytes:
+                self._evict()
+
+    def _remember(self, key, descriptors):
+        self.memory[key] = descriptors
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # Measure the directory, which includes the files of other processes, and if it is
+        # over budget drop least recently used files until it is back under 90% of it
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        self.unmeasured_bytes = 0
+        target = 0.9 * self.max_disk_bytes if total > self.max_disk_bytes else total
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self.disk_bytes = total
+
+    def stats(self):
+        with self.lock:
+            return dict(self.hits, memory_entries=len(self.memory), disk_bytes=self.disk_bytes)
+
+
+default_cache = None
+default_cache_lock = threading.Lock()
+
+
+def get_default_cache(version):
+    """
+    Process-wide cache configured from the environment, or None when
+    DESCRIPTOR_CACHE=0. Pool workers build their own memory tier but share the disk tier.
+    """
+    global default_cache
+    if os.environ.get('DESCRIPTOR_CACHE', '1') == '0':
+        return None
+    with default_cache_lock:
+        if default_cache is None:
+            default_cache = DescriptorCache(
+                os.environ.get('DESCRIPTOR_CACHE_DIR', 'descriptor_cache'),
+                version,
+                max_memory_entries=int(os.environ.get('DESCRIPTOR_CACHE_MEMORY_ENTRIES', 512)),
+                max_disk_bytes=int(os.environ.get('DESCRIPTOR_CACHE_MAX_BYTES', 512 * 1024 * 1024)),
+            )
+    return default_cache
@@ -0,0 +1,51 @@
+import numpy as np
+
+# Storage formats for descriptors in MongoDB: 'json' keeps plain float lists, the others
+# pack each family into a typed binary blob with dtype and shape metadata.
+STORAGE_FORMATS = ('json', 'float32', 'float16')
+
+# Hu moments go down to ~1e-20, far below float16's range, so they always stay float32
+FLOAT32_ONLY = {'hu_moments'}
+
+
+def is_packed(value):
+    return isinstance(value, dict) and 'data' in value and 'dtype' in value
+
+
+def pack_descriptor(values, dtype='float32'):
+    """
+    Pack one descriptor family into {'dtype', 'shape', 'data'} with raw little-endian bytes.
+    """
+    from bson.binary import Binary
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': array.dtype.str, 'shape': list(array.shape), 'data': Binary(array.tobytes())}
+
+
+def decode_descriptor(value):
+    """
+    Return a descriptor as a numpy array, whichever format it is stored in. Packed
+    blobs are wrapped with np.frombuffer, without copying the bytes.
+    """
+    if is_packed(value):
+        return np.frombuffer(value['data'], dtype=np.dtype(value['dtype'])).reshape(value['shape'])
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_descriptors(descriptors, storage_format='json'):
+    """
+    Convert every descriptor family to the given storage format. Other entries
+    (e.g. visualization paths) are left untouched.
+    """
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown descriptor storage format '{storage_format}'")
+
+    encoded = {}
+    for name, value in descriptors.items():
+        if isinstance(value, dict) and not is_packed(value):
+            encoded[name] = value
+        elif storage_format == 'json':
+            encoded[name] = decode_descriptor(value).astype(float).tolist()
+        else:
+            dtype = 'float32' if name in FLOAT32_ONLY else storage_format
+            encoded[name] = pack_descriptor(decode_descriptor(value), dtype)
+    return encoded
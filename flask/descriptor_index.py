@@ -0,0 +1,599 @@
+import threading
+from datetime import datetime
+import numpy as np
+from ann_index import IVFIndex
+from descriptor_codec import decode_descriptor
+from hamming_index import HASH_FEATURE, HammingIndex, hash_to_int
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize each row of a 2-D array, returning the normalized rows and their norms.
+    """
+    norms = np.linalg.norm(matrix, axis=1).astype(np.float32)
+    return matrix / (norms[:, None] + 1e-8), norms
+
+
+def fit_length(vector, length):
+    """
+    Truncate or zero-pad a 1-D vector to the given length.
+    """
+    if len(vector) >= length:
+        return vector[:length]
+    return np.concatenate([vector, np.zeros(length - len(vector), dtype=vector.dtype)])
+
+
+# Per-feature distance metrics for weighted search, each turned into a similarity
+METRICS = ('cosine', 'l2', 'chi_square', 'intersection')
+# Metrics that need an element-wise pass over the rows instead of a matrix-vector product
+ELEMENTWISE_METRICS = {'chi_square', 'intersection'}
+
+
+def l1_normalize(matrix):
+    """
+    Clip negative values and scale rows (or a single vector) to sum to 1, as histograms.
+    """
+    matrix = np.maximum(matrix, 0)
+    return matrix / (matrix.sum(axis=-1, keepdims=True) + 1e-8)
+
+
+def category_key(category):
+    """
+    Partition key of an image category (an ObjectId or name), or None if it has none.
+    """
+    return None if category is None else str(category)
+
+
+def top_k(scores, k):
+    """
+    Return the indices of the k highest scores, best first, without sorting the whole array.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class FeatureMatrix:
+    """
+    Growable float32 matrix of L2-normalized descriptor rows for a single feature.
+    Rows without this feature are stored as zeros so they score 0 like the original loop.
+    """
+
+    def __init__(self, dim, capacity=1024):
+        self.dim = dim
+        self.rows = np.zeros((capacity, dim), dtype=np.float32)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+
+    def reserve(self, capacity):
+        if capacity <= len(self.rows):
+            return
+        capacity = max(capacity, 2 * len(self.rows))
+        rows = np.zeros((capacity, self.dim), dtype=np.float32)
+        rows[:len(self.rows)] = self.rows
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:len(self.norms)] = self.norms
+        self.rows, self.norms = rows, norms
+
+    def widen(self, dim):
+        # Some descriptors (e.g. HOG) depend on the image size, so the widest vector wins
+        if dim <= self.dim:
+            return
+        rows = np.zeros((len(self.rows), dim), dtype=np.float32)
+        rows[:, :self.dim] = self.rows
+        self.rows, self.dim = rows, dim
+
+    def set(self, row, vector):
+        if vector is None:
+            self.rows[row] = 0
+            self.norms[row] = 0
+            return
+        self.widen(len(vector))
+        vector = fit_length(vector, self.dim)
+        norm = np.linalg.norm(vector)
+        self.rows[row] = vector / (norm + 1e-8)
+        self.norms[row] = norm
+
+    def move(self, src, dst):
+        self.rows[dst] = self.rows[src]
+        self.norms[dst] = self.norms[src]
+        self.rows[src] = 0
+        self.norms[src] = 0
+
+
+class DescriptorIndex:
+    """
+    Process-resident descriptor index: one pre-normalized float32 matrix per feature,
+    with rows aligned to the image ids, filenames and categories. Rows are grouped into
+    per-category partitions on demand, so filtered searches only score those rows.
+    Perceptual hashes, when images have them, are kept in a HammingIndex for
+    duplicate lookups. synced_at is when the documents were last read from MongoDB, so
+    that a snapshot can later re-read the ones written (indexedAt) since.
+    """
+
+    def __init__(self, features):
+        self.features = list(features)
+        self.matrices = {}
+        self.image_ids = []
+        self.filenames = []
+        self.categories = []
+        self.positions = {}
+        self.partitions = None
+        self.centroids = {}
+        self.ann = {}
+        self.hashes = HammingIndex()
+        self.loaded = False
+        self.synced_at = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __contains__(self, image_id):
+        return str(image_id) in self.positions
+
+    def projection(self):
+        """
+        Fields of an image document the index needs: the indexed descriptor families
+        and the perceptual hash.
+        """
+        projection = {'filename': 1, 'category': 1}
+        projection.update({f'descriptors.{feature}': 1 for feature in self.features + [HASH_FEATURE]})
+        return projection
+
+    def load(self, images_collection, batch_size=1000):
+        """
+        Rebuild the index from every image document that has descriptors, fetching
+        only the indexed descriptor fields.
+        """
+        synced_at = datetime.utcnow()
+        documents = images_collection.find({'descriptors': {'$exists': True}}, self.projection()).batch_size(batch_size)
+
+        image_ids, filenames, categories, vectors = [], [], [], {feature: [] for feature in self.features}
+        hashes = HammingIndex()
+        for image in documents:
+            image_ids.append(str(image['_id']))
+            filenames.append(image['filename'])
+            categories.append(category_key(image.get('category')))
+            if image['descriptors'].get(HASH_FEATURE) is not None:
+                hashes.add(image_ids[-1], hash_to_int(image['descriptors'][HASH_FEATURE]))
+            for feature in self.features:
+                value = image['descriptors'].get(feature)
+                vectors[feature].append(None if value is None else decode_descriptor(value).astype(np.float32).ravel())
+
+        matrices = {}
+        for feature, values in vectors.items():
+            dim = max((len(v) for v in values if v is not None), default=0)
+            if dim == 0:
+                continue
+            rows = np.zeros((len(values), dim), dtype=np.float32)
+            for row, value in enumerate(values):
+                if value is not None:
+                    rows[row, :len(value)] = value[:dim]
+            matrix = FeatureMatrix(dim, capacity=len(rows))
+            matrix.rows, matrix.norms = normalize_rows(rows)
+            matrices[feature] = matrix
+
+        with self.lock:
+            self.matrices = matrices
+            self.image_ids = image_ids
+            self.filenames = filenames
+            self.categories = categories
+            self.positions = {image_id: row for row, image_id in enumerate(image_ids)}
+            self.invalidate_partitions()
+            self.ann = {}
+            self.hashes = hashes
+            self.loaded = True
+            self.synced_at = synced_at
+
+    def catch_up(self, images_collection, batch_size=1000):
+        """
+        Bring an index restored from a snapshot up to date: add the images that have
+        descriptors but are not indexed, re-read those whose descriptors or category were
+        written (indexedAt) after synced_at and drop those that are gone. Only ids are
+        read for the other indexed images. Returns (added, updated, removed).
+        """
+        synced_at = datetime.utcnow()
+        with self.lock:
+            indexed = set(self.image_ids)
+            since = self.synced_at
+        stored = {str(image['_id']): image['_id'] for image in images_collection.find({'descriptors': {'$exists': True}}, {'_id': 1})}
+
+        removed = 0
+        for image_id in indexed - set(stored):
+            removed += self.remove(image_id)
+
+        missing = [stored[image_id] for image_id in stored if image_id not in indexed]
+        projection = self.projection()
+        for start in range(0, len(missing), batch_size):
+            for image in images_collection.find({'_id': {'$in': missing[start:start + batch_size]}}, projection):
+                self.add(image['_id'], image['filename'], image['descriptors'], image.get('category'))
+
+        updated = 0
+        if since is not None:
+            changed = {'indexedAt': {'$gte': since}, 'descriptors': {'$exists': True}}
+            for image in images_collection.find(changed, projection).batch_size(batch_size):
+                if str(image['_id']) in indexed:
+                    self.add(image['_id'], image['filename'], image['descriptors'], image.get('category'))
+                    updated += 1
+        with self.lock:
+            self.synced_at = synced_at
+        return len(missing), updated, removed
+
+    def add(self, image_id, filename, descriptors, category=None):
+        """
+        Insert or replace a single image's descriptors.
+        """
+        image_id = str(image_id)
+        with self.lock:
+            row = self.positions.get(image_id)
+            if row is None:
+                row = len(self.image_ids)
+                self.image_ids.append(image_id)
+                self.filenames.append(filename)
+                self.categories.append(category_key(category))
+                self.positions[image_id] = row
+            else:
+                self.filenames[row] = filename
+                self.categories[row] = category_key(category)
+            self.invalidate_partitions()
+
+            for feature in self.features:
+                value = descriptors.get(feature)
+                vector = None if value is None else decode_descriptor(value).astype(np.float32).ravel()
+                matrix = self.matrices.get(feature)
+                if matrix is None:
+                    if vector is None:
+                        continue
+                    matrix = self.matrices[feature] = FeatureMatrix(len(vector))
+                matrix.reserve(len(self.image_ids))
+                matrix.set(row, vector)
+
+            for features, (ann, dims) in self.ann.items():
+                ann.add([image_id], self.stacked_rows(features, dims, [row]))
+
+            if descriptors.get(HASH_FEATURE) is None:
+                self.hashes.remove(image_id)
+            else:
+                self.hashes.add(image_id, hash_to_int(descriptors[HASH_FEATURE]))
+
+    def remove(self, image_id):
+        """
+        Drop an image from the index by moving the last row into its slot.
+        """
+        image_id = str(image_id)
+        with self.lock:
+            row = self.positions.pop(image_id, None)
+            if row is None:
+                return False
+            for ann, _ in self.ann.values():
+                ann.remove(image_id)
+            self.hashes.remove(image_id)
+            last = len(self.image_ids) - 1
+            if row != last:
+                self.image_ids[row] = self.image_ids[last]
+                self.filenames[row] = self.filenames[last]
+                self.categories[row] = self.categories[last]
+                self.positions[self.image_ids[row]] = row
+            for matrix in self.matrices.values():
+                matrix.move(last, row)
+            self.image_ids.pop()
+            self.filenames.pop()
+            self.categories.pop()
+            self.invalidate_partitions()
+            return True
+
+    def invalidate_partitions(self):
+        self.partitions = None
+        self.centroids = {}
+
+    def partition_rows(self, categories=None):
+        """
+        Row positions of each category, grouped once and cached until the index changes.
+        With a list of categories, return the sorted rows of just those partitions.
+        """
+        with self.lock:
+            if self.partitions is None:
+                groups = {}
+                for row, category in enumerate(self.categories):
+                    groups.setdefault(category, []).append(row)
+                self.partitions = {category: np.array(rows, dtype=np.int64) for category, rows in groups.items()}
+            if categories is None:
+                return self.partitions
+            blocks = [self.partitions[category] for category in set(categories) if category in self.partitions]
+            if not blocks:
+                return np.empty(0, dtype=np.int64)
+            return np.sort(np.concatenate(blocks))
+
+    def category_centroids(self, feature):
+        """
+        Normalized mean row of every category for one feature, as (categories, matrix).
+        """
+        with self.lock:
+            if feature not in self.centroids:
+                partitions = self.partition_rows()
+                rows = self.matrices[feature].rows
+                centroids = np.stack([rows[members].mean(axis=0) for members in partitions.values()])
+                self.centroids[feature] = (list(partitions), normalize_rows(centroids)[0])
+            return self.centroids[feature]
+
+    def rank_categories(self, query_descriptors, features, count, categories=None):
+        """
+        The count categories (optionally among the given ones) whose centroids are most
+        similar to the query, summing cosine similarities over the features.
+        """
+        with self.lock:
+            names = list(self.partition_rows())
+            if not names:
+                return []
+            scores = np.zeros(len(names), dtype=np.float32)
+            for feature in features:
+                if feature not in self.matrices or feature not in query_descriptors:
+                    continue
+                scores += self.category_centroids(feature)[1] @ self.query_vector(feature, query_descriptors[feature])
+            if categories is not None:
+                allowed = set(categories)
+                scores[[name not in allowed for name in names]] = -np.inf
+                count = min(count, sum(name in allowed for name in names))
+            return [names[i] for i in top_k(scores, count)]
+
+    def query_vector(self, feature, value):
+        """
+        Project a query descriptor into the normalized space of a feature matrix.
+        """
+        matrix = self.matrices[feature]
+        vector = fit_length(decode_descriptor(value).astype(np.float32).ravel(), matrix.dim)
+        return vector / (np.linalg.norm(vector) + 1e-8)
+
+    def stacked_rows(self, features, dims, rows=None):
+        """
+        Concatenate the normalized rows of several features, so that one inner product
+        equals the sum of their cosine similarities.
+        """
+        if rows is None:
+            rows = slice(0, len(self.image_ids))
+            count = len(self.image_ids)
+        else:
+            count = len(rows)
+        blocks = []
+        for feature, dim in zip(features, dims):
+            matrix = self.matrices.get(feature)
+            if matrix is None:
+                blocks.append(np.zeros((count, dim), dtype=np.float32))
+                continue
+            block = matrix.rows[rows][:, :dim]
+            if block.shape[1] < dim:
+                block = np.pad(block, ((0, 0), (0, dim - block.shape[1])))
+            blocks.append(block)
+        return np.hstack(blocks)
+
+    def stacked_query(self, query_descriptors, features, dims):
+        blocks = []
+        for feature, dim in zip(features, dims):
+            if feature in self.matrices and feature in query_descriptors:
+                vector = fit_length(self.query_vector(feature, query_descriptors[feature]), dim)
+            else:
+                vector = np.zeros(dim, dtype=np.float32)
+            blocks.append(vector)
+        return np.concatenate(blocks)
+
+    def ann_key(self, features):
+        """
+        Key of the approximate index for a set of features: the features in indexing
+        order, so callers listing the same features in another order share one index.
+        """
+        order = {feature: i for i, feature in enumerate(self.features)}
+        return tuple(sorted(set(features), key=lambda feature: (order.get(feature, len(order)), feature)))
+
+    def build_ann(self, features, nlist=None, pq_m=0):
+        """
+        Train an IVF (optionally IVF-PQ) index over the stacked rows of the given features.
+        """
+        features = self.ann_key(features)
+        with self.lock:
+            self.ann.pop(features, None)
+            if not any(feature in self.matrices for feature in features):
+                return None
+            dims = [self.matrices[feature].dim if feature in self.matrices else 1 for feature in features]
+            vectors = self.stacked_rows(features, dims)
+            if nlist is None:
+                nlist = max(1, int(4 * np.sqrt(len(vectors))))
+            if len(vectors) < nlist:
+                return None
+            ann = IVFIndex(nlist, pq_m=pq_m)
+            ann.train(vectors)
+            ann.add(list(self.image_ids), vectors)
+            self.ann[features] = (ann, dims)
+            return ann
+
+    def candidate_rows(self, query_descriptors, features, nprobe, n_candidates):
+        """
+        Rows returned by the approximate index for these features, or None if there is none.
+        """
+        features = self.ann_key(features)
+        entry = self.ann.get(features)
+        if entry is None:
+            return None
+        ann, dims = entry
+        query = self.stacked_query(query_descriptors, features, dims)
+        ids = ann.search(query, nprobe, n_candidates)
+        return np.array([self.positions[image_id] for image_id in ids if image_id in self.positions], dtype=np.int64)
+
+    def cosine_scores(self, query_descriptors, features=None, rows=None):
+        """
+        Sum of per-feature cosine similarities for every indexed image (or only the given
+        rows), one matrix-vector product per feature.
+        """
+        features = self.features if features is None else features
+        with self.lock:
+            if rows is None:
+                rows = slice(0, len(self.image_ids))
+                count = len(self.image_ids)
+            else:
+                count = len(rows)
+            scores = np.zeros(count, dtype=np.float32)
+            for feature in features:
+                if feature not in self.matrices or feature not in query_descriptors:
+                    continue
+                query = self.query_vector(feature, query_descriptors[feature])
+                scores += self.matrices[feature].rows[rows] @ query
+            return scores
+
+    def linear_scores(self, weights, rows=None):
+        """
+        Sum over features of the raw (unnormalized) descriptors dotted with a weight
+        vector, i.e. one matrix-vector product per feature.
+        """
+        with self.lock:
+            if rows is None:
+                rows = slice(0, len(self.image_ids))
+                count = len(self.image_ids)
+            else:
+                count = len(rows)
+            scores = np.zeros(count, dtype=np.float32)
+            for feature, weight in weights.items():
+                matrix = self.matrices.get(feature)
+                if matrix is None:
+                    continue
+                weight = fit_length(np.asarray(weight, dtype=np.float32), matrix.dim)
+                scores += matrix.norms[rows] * (matrix.rows[rows] @ weight)
+            return scores
+
+    def metric_scores(self, feature, metric, query, rows=None, chunk_size=8192):
+        """
+        Similarity of a normalized query vector to every row (or the given rows) of one
+        feature matrix. Cosine and L2 come from one matrix-vector product on the unit
+        rows; L2 becomes 1 - distance / 2. Chi-square and histogram intersection compare
+        L1-normalized histograms and are computed in chunks to bound memory. Every
+        metric except cosine lies in [0, 1].
+        """
+        matrix = self.matrices[feature]
+        if rows is None:
+            rows = slice(0, len(self.image_ids))
+        if metric not in ELEMENTWISE_METRICS:
+            cosine = matrix.rows[rows] @ query
+            if metric == 'cosine':
+                return cosine
+            return 1 - np.sqrt(np.maximum(2 - 2 * cosine, 0)) / 2
+
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self.image_ids)))
+        histogram = l1_normalize(query)
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), chunk_size):
+            block = l1_normalize(matrix.rows[rows[start:start + chunk_size]])
+            if metric == 'intersection':
+                scores[start:start + chunk_size] = np.minimum(block, histogram).sum(axis=1)
+            else:
+                chi_square = ((block - histogram) ** 2 / (block + histogram + 1e-8)).sum(axis=1)
+                scores[start:start + chunk_size] = 1 - chi_square / 2
+        return scores
+
+    def weighted_search(self, query_descriptors, weights, metrics=None, max_results=5, rows=None):
+        """
+        Rank images by a weighted sum of per-feature similarities, each with its own
+        metric (cosine by default). Matrix-vector metrics score every row first; the
+        element-wise ones then run heaviest weight first, and before each of them rows
+        that can no longer reach the top k (their score plus the remaining weights,
+        since those similarities are at most 1) are dropped.
+        """
+        metrics = metrics or {}
+        with self.lock:
+            candidates = rows
+            count = len(self.image_ids) if rows is None else len(rows)
+            scores = np.zeros(count, dtype=np.float32)
+            elementwise = []
+            for feature, weight in weights.items():
+                if weight <= 0 or feature not in self.matrices or feature not in query_descriptors:
+                    continue
+                metric = metrics.get(feature, 'cosine')
+                query = self.query_vector(feature, query_descriptors[feature])
+                if metric in ELEMENTWISE_METRICS:
+                    elementwise.append((weight, feature, metric, query))
+                else:
+                    scores += weight * self.metric_scores(feature, metric, query, candidates)
+
+            elementwise.sort(key=lambda entry: -entry[0])
+            remaining = sum(entry[0] for entry in elementwise)
+            for weight, feature, metric, query in elementwise:
+                k = min(max_results, len(scores))
+                if 0 < k < len(scores):
+                    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+                    keep = scores + remaining >= threshold
+                    candidates = np.flatnonzero(keep) if candidates is None else candidates[keep]
+                    scores = scores[keep]
+                scores += weight * self.metric_scores(feature, metric, query, candidates)
+                remaining -= weight
+
+            best = top_k(scores, max_results)
+            return self.results(best if candidates is None else candidates[best], scores[best])
+
+    def duplicates(self, descriptors, radius, exclude=None):
+        """
+        Indexed images whose perceptual hash is within radius bits of the one in
+        descriptors, as [{'image_id', 'filename', 'distance'}] nearest first. Images
+        without a hash have no duplicates.
+        """
+        if descriptors.get(HASH_FEATURE) is None:
+            return []
+        matches = self.hashes.query(hash_to_int(descriptors[HASH_FEATURE]), radius)
+        with self.lock:
+            return [
+                {'image_id': image_id, 'filename': self.filenames[self.positions[image_id]], 'distance': distance}
+                for distance, image_id in matches
+                if image_id in self.positions and image_id != exclude
+            ]
+
+    def duplicate_groups(self, radius):
+        """
+        Groups of indexed images whose hashes are within radius bits of each other
+        (transitively), each as a list of {'image_id', 'filename'}.
+        """
+        groups = self.hashes.groups(radius)
+        with self.lock:
+            groups = [[image_id for image_id in group if image_id in self.positions] for group in groups]
+            return [
+                [{'image_id': image_id, 'filename': self.filenames[self.positions[image_id]]} for image_id in group]
+                for group in groups if len(group) > 1
+            ]
+
+    def rows_for(self, image_ids):
+        """
+        Map image ids to row positions, skipping ids that are not indexed.
+        """
+        with self.lock:
+            return {image_id: self.positions[image_id] for image_id in image_ids if image_id in self.positions}
+
+    def results(self, rows, scores):
+        """
+        Build the API result dicts for the given rows and their scores.
+        """
+        with self.lock:
+            return [
+                {
+                    'image_id': self.image_ids[row],
+                    'filename': self.filenames[row],
+                    'similarity_score': float(score)
+                }
+                for row, score in zip(rows, scores)
+            ]
+
+    def search(self, query_descriptors, max_results=5, features=None, nprobe=None, n_candidates=None, rows=None):
+        """
+        Score indexed images (or only the given rows) against the query and return the
+        top results. When an approximate index exists for these features and nprobe is
+        given, only its candidates are scored exactly.
+        """
+        features = self.features if features is None else features
+        with self.lock:
+            if rows is None and nprobe is not None:
+                n_candidates = n_candidates or max(100, 10 * max_results)
+                rows = self.candidate_rows(query_descriptors, features, nprobe, n_candidates)
+            scores = self.cosine_scores(query_descriptors, features, rows)
+            best = top_k(scores, max_results)
+            best_rows = best if rows is None else rows[best]
+            return self.results(best_rows, scores[best])
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import threading
+import time
+import os
+import cv2
+import numpy as np
+import metrics
+from descriptor_cache import get_default_cache
+
+# Every parameter that changes descriptor values. Cached descriptors are keyed by a
+# hash of this dict, so editing it invalidates the cache automatically.
+DESCRIPTOR_CONFIG = {
+    'color_bins': 8,
+    'n_colors': 3,
+    'kmeans_max_iter': 10,
+    'kmeans_epsilon': 1.0,
+    'kmeans_attempts': int(os.environ.get('DESCRIPTOR_KMEANS_ATTEMPTS', 10)),
+    # Run k-means on at most this many randomly sampled pixels (0 = every pixel)
+    'kmeans_sample': int(os.environ.get('DESCRIPTOR_KMEANS_SAMPLE', 0)),
+    # Downscale so the longest side is at most this many pixels before extraction (0 = off)
+    'max_side': int(os.environ.get('DESCRIPTOR_MAX_SIDE', 0)),
+    'gabor_ksize': 21,
+    'gabor_sigma': 8.0,
+    'gabor_lambda': 10.0,
+    'gabor_gamma': 0.5,
+    'gabor_orientations': 4,
+    'lbp_points': 8,
+    'lbp_radius': 1,
+    'hog_step': 10,
+    'max_hog_length': 1000,
+    'canny_thresholds': [100, 200],
+    'edge_bins': 18,
+    # pHash: DCT of a phash_resize x phash_resize thumbnail, low phash_size x phash_size block
+    'phash_resize': 32,
+    'phash_size': 8,
+}
+DESCRIPTOR_VERSION = hashlib.sha1(json.dumps(DESCRIPTOR_CONFIG, sort_keys=True).encode()).hexdigest()[:12]
+
+
+FEATURES = ('color_histogram', 'dominant_colors', 'gabor_features', 'hu_moments', 'lbp', 'hog', 'edge_histogram', 'perceptual_hash')
+GRAYSCALE_FEATURES = {'gabor_features', 'hu_moments', 'lbp', 'hog', 'edge_histogram', 'perceptual_hash'}
+
+
+class DescriptorPipeline:
+    """
+    Reusable descriptor extractor. Gabor kernels and the HOG descriptor are built once,
+    each image is converted to grayscale once, and per-stage timings are accumulated.
+    """
+
+    def __init__(self, config=DESCRIPTOR_CONFIG):
+        self.config = config
+        ksize = config['gabor_ksize']
+        self.gabor_kernels = [
+            cv2.getGaborKernel((ksize, ksize), config['gabor_sigma'], theta, config['gabor_lambda'], config['gabor_gamma'], 0, ktype=cv2.CV_32F)
+            for theta in np.arange(0, np.pi, np.pi / config['gabor_orientations'])
+        ]
+        self.kmeans_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, config['kmeans_max_iter'], config['kmeans_epsilon'])
+
+        # Only the first max_hog_length * hog_step HOG values are kept, so only the
+        # detection windows that produce them are computed
+        self.hog_descriptor = cv2.HOGDescriptor()
+        self.hog_values = (config['max_hog_length'] - 1) * config['hog_step'] + 1
+        self.hog_windows = -(-self.hog_values // self.hog_descriptor.getDescriptorSize())
+
+        # scikit-image is only loaded once a pipeline is built, not when this module is imported
+        from skimage.feature import local_binary_pattern
+        self.local_binary_pattern = local_binary_pattern
+
+        self.stage_totals = {}
+        self.lock = threading.Lock()
+
+    def hog_locations(self, gray):
+        width, height = self.hog_descriptor.winSize
+        stride = self.hog_descriptor.blockStride
+        locations = []
+        for y in range(0, gray.shape[0] - height + 1, stride[1]):
+            for x in range(0, gray.shape[1] - width + 1, stride[0]):
+                locations.append((x, y))
+                if len(locations) == self.hog_windows:
+                    return locations
+        return locations
+
+    def compute(self, image, features=None, timings=None):
+        """
+        Compute the requested descriptor families (all by default) for a decoded BGR
+        image. If a dict is passed as timings, it receives the milliseconds of each stage.
+        """
+        features = FEATURES if features is None else [feature for feature in FEATURES if feature in features]
+        config = self.config
+        stages = {}
+        descriptors = {}
+
+        def stage(name, start):
+            stages[name] = (time.perf_counter() - start) * 1000
+
+        max_side = config['max_side']
+        if max_side and max(image.shape[:2]) > max_side:
+            start = time.perf_counter()
+            scale = max_side / max(image.shape[:2])
+            size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            stage('resize', start)
+
+        gray = None
+        if GRAYSCALE_FEATURES.intersection(features):
+            start = time.perf_counter()
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            stage('grayscale', start)
+
+        for feature in features:
+            start = time.perf_counter()
+            if feature == 'color_histogram':
+                num_bins = config['color_bins']
+                color_hist = cv2.calcHist([image], [0, 1, 2], None, [num_bins, num_bins, num_bins], [0, 256, 0, 256, 0, 256])
+                descriptors[feature] = cv2.normalize(color_hist, None).flatten().tolist()
+
+            elif feature == 'dominant_colors':
+                pixels = image.reshape(-1, 3)
+                sample = config['kmeans_sample']
+                if sample and len(pixels) > sample:
+                    # Fixed seed so the same image always gives the same colors
+                    pixels = pixels[np.random.default_rng(0).choice(len(pixels), sample, replace=False)]
+                pixels = np.float32(pixels)
+                _, _, centers = cv2.kmeans(pixels, config['n_colors'], None, self.kmeans_criteria, config['kmeans_attempts'], cv2.KMEANS_RANDOM_CENTERS)
+                descriptors[feature] = centers.flatten().tolist()
+
+            elif feature == 'gabor_features':
+                descriptors[feature] = [float(cv2.filter2D(gray, cv2.CV_8UC3, kernel).mean()) for kernel in self.gabor_kernels]
+
+            elif feature == 'hu_moments':
+                descriptors[feature] = cv2.HuMoments(cv2.moments(gray)).flatten().tolist()
+
+            elif feature == 'lbp':
+                lbp = self.local_binary_pattern(gray, P=config['lbp_points'], R=config['lbp_radius'], method='uniform')
+                hist_lbp, _ = np.histogram(lbp.ravel(), bins=np.arange(0, 27), range=(0, 26))
+                descriptors[feature] = cv2.normalize(hist_lbp, None).flatten().tolist()
+
+            elif feature == 'hog':
+                # Images smaller than one detection window have no HOG values
+                locations = self.hog_locations(gray)
+                hog = np.array(self.hog_descriptor.compute(gray, self.hog_descriptor.blockStride, (0, 0), locations)).flatten() if locations else np.empty(0)
+                hog = hog[:self.hog_values:config['hog_step']]  # Every 10th value, at most 1000 of them
+                descriptors[feature] = hog.tolist()
+
+            elif feature == 'edge_histogram':
+                edges = cv2.Canny(gray, *config['canny_thresholds'])
+                angles = cv2.phase(edges.astype(float), edges.astype(float), angleInDegrees=True)
+                angle_hist, _ = np.histogram(angles, bins=config['edge_bins'], range=(0, 180))
+                descriptors[feature] = (angle_hist / np.sum(angle_hist)).tolist()
+
+            elif feature == 'perceptual_hash':
+                # One bit per low-frequency DCT coefficient: above or below their median
+                # (without the DC term, which only carries the mean brightness)
+                size = config['phash_resize']
+                thumbnail = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+                block = cv2.dct(thumbnail)[:config['phash_size'], :config['phash_size']].ravel()
+                descriptors[feature] = (block > np.median(block[1:])).astype(np.uint8).tolist()
+
+            stage(feature, start)
+
+        self.record(stages)
+        if timings is not None:
+            timings.update(stages)
+        return descriptors
+
+    def record(self, stages):
+        """
+        Add per-stage milliseconds to the totals and metrics, whichever process measured them.
+        """
+        with self.lock:
+            for name, elapsed in stages.items():
+                count, total = self.stage_totals.get(name, (0, 0.0))
+                self.stage_totals[name] = (count + 1, total + elapsed)
+        if metrics.enabled:
+            for name, elapsed in stages.items():
+                metrics.DESCRIPTOR_STAGE_SECONDS.observe(elapsed / 1000, name)
+
+    def stats(self):
+        """
+        Number of runs and mean milliseconds of each stage since startup.
+        """
+        with self.lock:
+            return {
+                name: {'count': count, 'mean_ms': total / count}
+                for name, (count, total) in self.stage_totals.items()
+            }
+
+
+default_pipeline = None
+default_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """
+    Process-wide pipeline, built on first use.
+    """
+    global default_pipeline
+    with default_pipeline_lock:
+        if default_pipeline is None:
+            default_pipeline = DescriptorPipeline()
+    return default_pipeline
+
+
+def extract_descriptors(image, features=None, timings=None):
+    """
+    Compute descriptor families for a decoded BGR image with the shared pipeline.
+    """
+    return get_pipeline().compute(image, features, timings)
+
+
+def check_image(image):
+    """
+    Validate a decoded image, returning (image, error).
+    """
+    if image is None:
+        return None, "Invalid image format or corrupted image."
+    if image.shape[0] < 10 or image.shape[1] < 10:
+        return None, "Image is too small to process."
+    return image, None
+
+
+def load_image(image_path):
+    """
+    Read an image from disk, returning (image, error).
+    """
+    return check_image(cv2.imread(image_path))
+
+
+def decode_image(data):
+    """
+    Decode image bytes held in memory, returning (image, error).
+    """
+    if not data:
+        return check_image(None)
+    return check_image(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR))
+
+
+def record_stage(timings, name, start):
+    """
+    Record a stage run outside the pipeline (decode, cache lookup) in timings, the
+    pipeline's stage totals and metrics.
+    """
+    elapsed = (time.perf_counter() - start) * 1000
+    if timings is not None:
+        timings[name] = elapsed
+    get_pipeline().record({name: elapsed})
+
+
+def compute_descriptors(image_path, cache=None, timings=None):
+    """
+    Compute descriptors for an image file, returning (descriptors, error).
+    Uses the default descriptor cache unless DESCRIPTOR_CACHE=0; pass cache=False to bypass it.
+    A timings dict receives per-stage milliseconds (including 'decode' and 'cache_lookup').
+    """
+    if cache is None:
+        cache = get_default_cache(DESCRIPTOR_VERSION)
+    if not cache:
+        start = time.perf_counter()
+        image, error = load_image(image_path)
+        record_stage(timings, 'decode', start)
+        if error:
+            return None, error
+        return extract_descriptors(image, timings=timings), None
+
+    # Read the file once: its bytes are both the cache key and the decoder input
+    try:
+        with open(image_path, 'rb') as handle:
+            data = handle.read()
+    except OSError:
+        return None, "Invalid image format or corrupted image."
+    return compute_descriptors_from_bytes(data, cache=cache, timings=timings)
+
+
+def compute_descriptors_from_bytes(data, features=None, cache=None, timings=None):
+    """
+    Compute descriptors for encoded image bytes held in memory, returning (descriptors, error).
+    With a list of features only those are computed. The cache only stores complete
+    descriptor sets, but any cached set can answer a request for a subset.
+    """
+    if cache is None:
+        cache = get_default_cache(DESCRIPTOR_VERSION)
+
+    key = None
+    if cache:
+        start = time.perf_counter()
+        key = cache.key(data)
+        descriptors = cache.get(key)
+        record_stage(timings, 'cache_lookup', start)
+        if descriptors is not None:
+            if features is not None:
+                descriptors = {feature: descriptors[feature] for feature in features if feature in descriptors}
+            return descriptors, None
+
+    start = time.perf_counter()
+    image, error = decode_image(data)
+    record_stage(timings, 'decode', start)
+    if error:
+        return None, error
+    descriptors = extract_descriptors(image, features, timings)
+    if key is not None and features is None:
+        cache.put(key, descriptors)
+    return descriptors, None
+
+
+def compute_descriptors_task(image_path):
+    """
+    Process-pool entry point: returns (image_path, descriptors, error, timings). Unpack
+    it with task_result in the submitting process.
+    """
+    timings = {}
+    try:
+        descriptors, error = compute_descriptors(image_path, timings=timings)
+    except Exception as e:
+        descriptors, error = None, str(e)
+    return image_path, descriptors, error, timings
+
+
+def task_result(result):
+    """
+    Unpack a compute_descriptors_task result as (image_path, descriptors, error). The
+    stage timings measured in the worker process are added to this process's pipeline,
+    so that its stats and metrics also cover pooled work.
+    """
+    image_path, descriptors, error, timings = result
+    get_pipeline().record(timings)
+    return image_path, descriptors, error
@@ -0,0 +1,130 @@
+import threading
+from collections import Counter, deque
+from datetime import datetime
+import numpy as np
+from descriptor_codec import decode_descriptor
+
+LABELS = ('relevant', 'non-relevant')
+
+
+class FeedbackModel:
+    """
+    Incrementally maintained relevance-feedback model: exponentially time-decayed
+    relevant / non-relevant centroids per feature, plus the per-image labels of the
+    most recent feedback window used for priors and boosts.
+    """
+
+    def __init__(self, features, window=50, half_life=300.0):
+        self.features = list(features)
+        self.window = deque(maxlen=window)
+        self.half_life = half_life
+        self.sums = {label: {} for label in LABELS}
+        self.updated_at = {label: None for label in LABELS}
+        self.label_counts = Counter()
+        self.image_labels = {}
+        self.last_timestamp = None
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+    def _decay(self, label, timestamp):
+        last = self.updated_at[label]
+        if last is not None and timestamp > last:
+            factor = 0.5 ** ((timestamp - last).total_seconds() / self.half_life)
+            for feature in self.sums[label]:
+                self.sums[label][feature] *= factor
+        if last is None or timestamp > last:
+            self.updated_at[label] = timestamp
+
+    def observe(self, image_id, label, query_descriptors, timestamp=None):
+        """
+        Fold one feedback entry into the model. Entries with an unknown label are
+        skipped, but still count as seen so that sync does not read them again.
+        """
+        timestamp = timestamp or datetime.utcnow()
+        with self.lock:
+            if self.last_timestamp is None or timestamp > self.last_timestamp:
+                self.last_timestamp = timestamp
+            if label not in LABELS:
+                return
+            self._decay(label, timestamp)
+            for feature in self.features:
+                if feature not in query_descriptors:
+                    continue
+                vector = decode_descriptor(query_descriptors[feature]).astype(float).ravel()
+                current = self.sums[label].get(feature)
+                if current is None:
+                    self.sums[label][feature] = vector.copy()
+                    continue
+                if len(vector) > len(current):
+                    current = np.pad(current, (0, len(vector) - len(current)))
+                current[:len(vector)] += vector
+                self.sums[label][feature] = current
+
+            # Sliding window of the latest entries, for priors and per-image boosts
+            if len(self.window) == self.window.maxlen:
+                self._forget(*self.window[0])
+            self.window.append((str(image_id), label))
+            self.label_counts[label] += 1
+            self.image_labels.setdefault(str(image_id), Counter())[label] += 1
+
+    def _forget(self, image_id, label):
+        self.label_counts[label] -= 1
+        labels = self.image_labels[image_id]
+        labels[label] -= 1
+        if not +labels:
+            del self.image_labels[image_id]
+
+    def sync(self, feedback_collection):
+        """
+        Fold in feedback stored since the last observed entry, e.g. by other workers.
+        On first call this loads the latest window of feedback. Both queries are served
+        by the index on feedback.timestamp.
+        """
+        projection = {'image_id': 1, 'feedback': 1, 'timestamp': 1}
+        projection.update({f'query_descriptors.{feature}': 1 for feature in self.features})
+        with self.sync_lock:
+            if self.last_timestamp is None:
+                entries = list(feedback_collection.find({}, projection).sort('timestamp', -1).limit(self.window.maxlen))
+                entries.reverse()
+            else:
+                entries = feedback_collection.find({'timestamp': {'$gt': self.last_timestamp}}, projection).sort('timestamp', 1)
+            for entry in entries:
+                self.observe(entry['image_id'], entry['feedback'], entry.get('query_descriptors', {}), entry['timestamp'])
+
+    def feature_weights(self, query_descriptors, features):
+        """
+        Per-feature vector w such that an image's score is sum over features of x . w:
+        0.6 * query + 1.4 * (prior_relevant * P_relevant - prior_non_relevant * P_non_relevant).
+        """
+        with self.lock:
+            total = self.label_counts['relevant'] + self.label_counts['non-relevant']
+            prior_relevant = self.label_counts['relevant'] / total if total > 0 else 0.5
+            prior_non_relevant = self.label_counts['non-relevant'] / total if total > 0 else 0.5
+
+            weights = {}
+            for feature in features:
+                if feature not in query_descriptors:
+                    continue
+                weight = 0.6 * decode_descriptor(query_descriptors[feature]).astype(float).ravel()
+                for label, prior, sign in (('relevant', prior_relevant, 1.4), ('non-relevant', prior_non_relevant, -1.4)):
+                    centroid = self.sums[label].get(feature)
+                    if centroid is None:
+                        continue
+                    centroid = centroid / (np.linalg.norm(centroid) + 1e-8)
+                    if len(centroid) > len(weight):
+                        weight = np.pad(weight, (0, len(centroid) - len(weight)))
+                    weight[:len(centroid)] += sign * prior * centroid
+                weights[feature] = weight
+            return weights
+
+    def boosts(self):
+        """
+        Score multipliers for the images that received feedback in the current window.
+        """
+        with self.lock:
+            relevant_boost = min(1.5, 1.0 + 0.1 * self.label_counts['relevant'])
+            non_relevant_boost = max(0.5, 1.0 - 0.1 * self.label_counts['non-relevant'])
+            return {
+                image_id: relevant_boost if labels['relevant'] > 0 else non_relevant_boost
+                for image_id, labels in self.image_labels.items()
+            }
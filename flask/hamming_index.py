@@ -0,0 +1,172 @@
+import itertools
+import threading
+import numpy as np
+from descriptor_codec import decode_descriptor
+
+# Descriptor family holding each image's 64-bit perceptual hash
+HASH_FEATURE = 'perceptual_hash'
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def hash_to_int(value):
+    """
+    Pack a perceptual hash descriptor (a list or blob of 0/1 values) into an int.
+    """
+    bits = decode_descriptor(value).ravel() > 0.5
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes. Each hash is split into `chunks` substrings
+    with one exact-match table per substring. Two hashes within distance r share at
+    least one substring within distance r // chunks (pigeonhole), so a query only
+    probes the buckets of its substrings and their few bit flips, then verifies the
+    candidates with a popcount instead of comparing against every hash.
+    """
+
+    def __init__(self, bits=64, chunks=4):
+        if bits % chunks:
+            raise ValueError("bits must be a multiple of chunks")
+        self.bits = bits
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.mask = (1 << self.chunk_bits) - 1
+        self.hashes = {}
+        self.tables = [{} for _ in range(chunks)]
+        self.masks = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, image_id):
+        return str(image_id) in self.hashes
+
+    def substrings(self, value):
+        return [(value >> (i * self.chunk_bits)) & self.mask for i in range(self.chunks)]
+
+    def add(self, image_id, value):
+        image_id = str(image_id)
+        with self.lock:
+            self._remove(image_id)
+            self.hashes[image_id] = value
+            for table, key in zip(self.tables, self.substrings(value)):
+                table.setdefault(key, set()).add(image_id)
+
+    def remove(self, image_id):
+        with self.lock:
+            return self._remove(str(image_id))
+
+    def _remove(self, image_id):
+        value = self.hashes.pop(image_id, None)
+        if value is None:
+            return False
+        for table, key in zip(self.tables, self.substrings(value)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(image_id)
+                if not bucket:
+                    del table[key]
+        return True
+
+    def flip_masks(self, radius):
+        """
+        XOR masks of every substring within the given Hamming distance, 0 first.
+        """
+        if radius not in self.masks:
+            masks = [0]
+            for distance in range(1, radius + 1):
+                for positions in itertools.combinations(range(self.chunk_bits), distance):
+                    masks.append(sum(1 << position for position in positions))
+            self.masks[radius] = masks
+        return self.masks[radius]
+
+    def query(self, value, radius):
+        """
+        Ids of the hashes within `radius` bits of value, as [(distance, image_id)] sorted
+        nearest first.
+        """
+        masks = self.flip_masks(radius // self.chunks)
+        with self.lock:
+            candidates = set()
+            for table, key in zip(self.tables, self.substrings(value)):
+                for mask in masks:
+                    bucket = table.get(key ^ mask)
+                    if bucket:
+                        candidates.update(bucket)
+            hashes = self.hashes
+            matches = [((value ^ hashes[image_id]).bit_count(), image_id) for image_id in candidates]
+        return sorted(match for match in matches if match[0] <= radius)
+
+    def close_pairs(self, values, radius, block_pairs=1 << 22):
+        """
+        Index pairs (left < right) of values within radius bits of each other. For each
+        substring, every value is joined with the values in its own bucket and in the
+        buckets of its flipped substrings, using per-bucket offsets into the values
+        sorted by that substring, and the candidate pairs are verified with a popcount.
+        """
+        count = len(values)
+        buckets = 1 << self.chunk_bits
+        lefts, rights = [], []
+        for i in range(self.chunks):
+            keys = ((values >> np.uint64(i * self.chunk_bits)) & np.uint64(self.mask)).astype(np.int64)
+            order = np.argsort(keys, kind='stable')
+            sizes = np.bincount(keys, minlength=buckets)
+            offsets = np.cumsum(sizes) - sizes
+            for mask in self.flip_masks(radius // self.chunks):
+                targets = keys ^ mask
+                counts = sizes[targets]
+                # Split the rows so that no block has more than block_pairs candidates,
+                # since hashes crowded into one bucket (e.g. blank images) pair up quadratically
+                ends = np.searchsorted(np.cumsum(counts), np.arange(block_pairs, int(counts.sum()), block_pairs), 'right').tolist()
+                for start, stop in zip([0] + ends, ends + [count]):
+                    rows = np.arange(start, stop)
+                    block = counts[start:stop]
+                    total = int(block.sum())
+                    if total == 0:
+                        continue
+                    within = np.arange(total) - np.repeat(np.cumsum(block) - block, block)
+                    left = np.repeat(rows, block)
+                    right = order[np.repeat(offsets[targets[rows]], block) + within]
+                    keep = left < right
+                    left, right = left[keep], right[keep]
+                    distances = POPCOUNT[(values[left] ^ values[right]).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+                    close = distances <= radius
+                    lefts.append(left[close])
+                    rights.append(right[close])
+        if not lefts:
+            return [], []
+        return np.concatenate(lefts).tolist(), np.concatenate(rights).tolist()
+
+    def groups(self, radius):
+        """
+        Connected groups of hashes within `radius` bits of each other, largest first.
+        Candidates come from the substring buckets as in query(), but are joined for
+        all distinct hashes at once with numpy instead of one query per hash; images
+        with identical hashes are grouped without being paired up.
+        """
+        with self.lock:
+            items = list(self.hashes.items())
+        values, inverse = np.unique(np.array([value for _, value in items], dtype=np.uint64), return_inverse=True)
+        left, right = self.close_pairs(values, radius)
+
+        parents = list(range(len(values)))
+
+        def find(row):
+            root = row
+            while parents[root] != root:
+                root = parents[root]
+            while row != root:
+                parents[row], row = root, parents[row]
+            return root
+
+        for a, b in zip(left, right):
+            parents[find(b)] = find(a)
+
+        members = {}
+        for (image_id, _), row in zip(items, inverse.ravel().tolist()):
+            members.setdefault(find(row), []).append(image_id)
+        return sorted((sorted(group) for group in members.values() if len(group) > 1), key=lambda group: (-len(group), group))
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from descriptor_index import FeatureMatrix, category_key
+from hamming_index import HammingIndex
+
+# Bumped whenever the on-disk layout changes
+STORE_FORMAT = 3
+
+
+class IndexStore:
+    """
+    On-disk snapshots of a DescriptorIndex: one .npy file per feature matrix and norm
+    vector, the image ids, filenames, categories and perceptual hashes as JSON, and a
+    manifest. Snapshots are written to their own directory and published by atomically
+    replacing the CURRENT pointer. Loading memory-maps the matrices copy-on-write, so every worker
+    process shares the same pages through the OS page cache; only rows a process
+    changes afterwards become private to it.
+    """
+
+    def __init__(self, directory, version):
+        self.directory = directory
+        self.version = version
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _current_path(self):
+        return os.path.join(self.directory, 'CURRENT')
+
+    def current(self):
+        """
+        Directory of the published snapshot, or None.
+        """
+        try:
+            with open(self._current_path()) as handle:
+                name = handle.read().strip()
+        except OSError:
+            return None
+        path = os.path.join(self.directory, name)
+        return path if name and os.path.isdir(path) else None
+
+    def manifest(self, path=None):
+        path = path or self.current()
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, 'manifest.json')) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, index):
+        """
+        Write a snapshot of the index and publish it. Matrices get spare rows so that a
+        few images can be added after loading without copying the whole matrix.
+        """
+        name = f"{self.version}-{time.time_ns()}"
+        temporary = os.path.join(self.directory, f".{name}.{os.getpid()}.tmp")
+        os.makedirs(temporary)
+        try:
+            with index.lock:
+                count = len(index.image_ids)
+                capacity = count + max(256, count // 16)
+                dims = {}
+                for feature, matrix in index.matrices.items():
+                    rows = open_memmap(os.path.join(temporary, f"{feature}.rows.npy"), mode='w+', dtype=np.float32, shape=(capacity, matrix.dim))
+                    rows[:count] = matrix.rows[:count]
+                    rows.flush()
+                    norms = open_memmap(os.path.join(temporary, f"{feature}.norms.npy"), mode='w+', dtype=np.float32, shape=(capacity,))
+                    norms[:count] = matrix.norms[:count]
+                    norms.flush()
+                    del rows, norms
+                    dims[feature] = matrix.dim
+                with index.hashes.lock:
+                    hashes = [index.hashes.hashes.get(image_id) for image_id in index.image_ids]
+                with open(os.path.join(temporary, 'images.json'), 'w') as handle:
+                    json.dump({
+                        'ids': index.image_ids, 'filenames': index.filenames, 'categories': index.categories,
+                        # Hex strings, since JSON readers may not keep 64-bit ints exact
+                        'hashes': [None if value is None else f"{value:016x}" for value in hashes],
+                    }, handle)
+                manifest = {
+                    'format': STORE_FORMAT,
+                    'version': self.version,
+                    'features': index.features,
+                    'count': count,
+                    'capacity': capacity,
+                    'dims': dims,
+                    'created': time.time(),
+                    # When the rows were read from MongoDB, for DescriptorIndex.catch_up
+                    'synced_at': index.synced_at.isoformat() if index.synced_at else None,
+                }
+            with open(os.path.join(temporary, 'manifest.json'), 'w') as handle:
+                json.dump(manifest, handle, indent=2)
+            os.replace(temporary, os.path.join(self.directory, name))
+        except Exception:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+
+        with self.lock:
+            pointer = f"{self._current_path()}.{os.getpid()}.tmp"
+            with open(pointer, 'w') as handle:
+                handle.write(name)
+            os.replace(pointer, self._current_path())
+            self._remove_old(keep=name)
+        return manifest
+
+    def _remove_old(self, keep):
+        # Processes that still map an old snapshot keep reading it after the unlink
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name != keep and not entry.name.startswith('.'):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def load(self, index):
+        """
+        Replace the contents of the index with the published snapshot. Returns its
+        manifest, or None (leaving the index untouched) when there is no snapshot or it
+        was written for another format, descriptor version or feature list.
+        """
+        path = self.current()
+        manifest = self.manifest(path)
+        if (
+            manifest is None or manifest.get('format') != STORE_FORMAT
+            or manifest.get('version') != self.version or manifest.get('features') != index.features
+        ):
+            return None
+        try:
+            with open(os.path.join(path, 'images.json')) as handle:
+                images = json.load(handle)
+            matrices = {}
+            for feature, dim in manifest['dims'].items():
+                matrix = FeatureMatrix(dim, capacity=0)
+                matrix.rows = np.load(os.path.join(path, f"{feature}.rows.npy"), mmap_mode='c')
+                matrix.norms = np.load(os.path.join(path, f"{feature}.norms.npy"), mmap_mode='c')
+                matrices[feature] = matrix
+            hashes = HammingIndex()
+            for image_id, value in zip(images['ids'], images['hashes']):
+                if value is not None:
+                    hashes.add(image_id, int(value, 16))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[ERROR] Could not load index snapshot {path}: {e}")
+            return None
+
+        with index.lock:
+            index.matrices = matrices
+            index.image_ids = images['ids']
+            index.filenames = images['filenames']
+            index.categories = [category_key(category) for category in images['categories']]
+            index.positions = {image_id: row for row, image_id in enumerate(index.image_ids)}
+            index.invalidate_partitions()
+            index.ann = {}
+            index.hashes = hashes
+            index.loaded = True
+            index.synced_at = datetime.fromisoformat(manifest['synced_at']) if manifest.get('synced_at') else None
+        return manifest
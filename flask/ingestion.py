@@ -0,0 +1,266 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+# How the ingestor learns about image changes: 'changestream' needs a replica set,
+# 'poll' works on a standalone mongod, 'auto' tries change streams and falls back to polling
+INGESTION_MODES = ('auto', 'changestream', 'poll', 'off')
+
+# Lease document naming the one process that computes descriptors for new images
+LEASE_ID = 'index-ingestor'
+
+
+class IndexIngestor:
+    """
+    Background thread that keeps the descriptor index in step with the images collection
+    without full reloads. Inserted, updated and deleted image documents are picked up from
+    a change stream, or by polling on uploadDate where change streams are unavailable.
+    Documents without descriptors are handed to ingest(documents), which computes and
+    stores them, adds them to the index and returns the ids of the images it could not
+    process; documents that already have descriptors are added to the index directly.
+    With a version, the backfill also recomputes documents whose descriptorVersion
+    differs, i.e. whose descriptors were written by another pipeline configuration
+    (such as catalog images stored before the perceptual hash existed).
+    When polling, deletions are detected from a drop in the collection's estimated count,
+    and a full reconcile, which reads every id, only runs every reconcile_interval seconds.
+
+    Every worker process runs an ingestor to keep its own index current, but with
+    get_leases (a collection of lease documents) only the holder of the lease computes
+    descriptors; the others pick up the results when they are written. Without it each
+    ingestor computes, so it should then run in a single worker process.
+    """
+
+    def __init__(
+        self, get_collection, index, ingest, mode='auto', interval=5.0, batch_size=100, reconcile_interval=300.0,
+        get_leases=None, lease_ttl=30.0, version=None
+    ):
+        if mode not in INGESTION_MODES:
+            raise ValueError(f"Unknown ingestion mode '{mode}'")
+        self.get_collection = get_collection
+        self.index = index
+        self.ingest = ingest
+        self.mode = mode
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reconcile_interval = reconcile_interval
+        self.get_leases = get_leases
+        self.lease_ttl = lease_ttl
+        self.version = version
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.leader = get_leases is None
+        self.lease_checked_at = None
+        self.needs_backfill = False
+        self.document_count = None
+        self.reconciled_at = None
+        self.pending = {}
+        self.failed = set()
+        self.watermark = None
+        self.resume_token = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None and self.mode != 'off':
+                self.thread = threading.Thread(target=self.run, name='index-ingestor', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.get_leases is not None and self.leader:
+            self.get_leases().delete_one({'_id': LEASE_ID, 'owner': self.owner})
+
+    def elect(self):
+        """
+        Take or renew the lease (at most every lease_ttl / 3 seconds) and return whether
+        this process computes descriptors. An expired lease is taken over by the next
+        ingestor that checks.
+        """
+        if self.get_leases is None:
+            return True
+        now = time.monotonic()
+        if self.lease_checked_at is not None and now - self.lease_checked_at < self.lease_ttl / 3:
+            return self.leader
+        self.lease_checked_at = now
+        expires = datetime.utcnow()
+        try:
+            self.get_leases().find_one_and_update(
+                {'_id': LEASE_ID, '$or': [{'owner': self.owner}, {'expires': {'$lt': expires}}]},
+                {'$set': {'owner': self.owner, 'expires': expires + timedelta(seconds=self.lease_ttl)}},
+                upsert=True,
+            )
+            leader = True
+        except DuplicateKeyError:
+            # Held by another live ingestor
+            leader = False
+        if leader and not self.leader:
+            print(f"[INFO] Index ingestor {self.owner} now computes descriptors for new images")
+            self.needs_backfill = True
+        self.leader = leader
+        return leader
+
+    def run(self):
+        mode = self.mode
+        while mode != 'poll' and not self.stopped.is_set():
+            try:
+                self.watch()
+            except Exception as e:
+                if mode == 'auto' and self.resume_token is None:
+                    print(f"[INFO] Change streams unavailable ({e}), polling every {self.interval}s instead")
+                    mode = 'poll'
+                else:
+                    print(f"[ERROR] Change stream failed, reopening: {e}")
+                    self.stopped.wait(self.interval)
+
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[ERROR] Index ingestion poll failed: {e}")
+            self.stopped.wait(self.interval)
+
+    def watch(self):
+        """
+        Follow the change stream until stopped. Events are applied as they arrive and
+        documents needing descriptors are processed whenever the stream goes quiet.
+        """
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        with self.get_collection().watch(
+            pipeline, full_document='updateLookup', resume_after=self.resume_token, max_await_time_ms=1000
+        ) as stream:
+            if self.resume_token is None:
+                # Catch up with changes made before the stream was opened
+                self.elect()
+                self.reconcile()
+                self.backfill()
+            while not self.stopped.is_set():
+                change = stream.try_next()
+                if change is None:
+                    if self.elect() and self.needs_backfill:
+                        self.backfill()
+                    self.flush()
+                    continue
+                self.resume_token = stream.resume_token
+                self.apply_change(change)
+                if len(self.pending) >= self.batch_size:
+                    self.flush()
+
+    def apply_change(self, change):
+        if change['operationType'] == 'delete':
+            self.index.remove(change['documentKey']['_id'])
+            return
+        document = change.get('fullDocument')
+        if document is None:
+            # Deleted again before the event was read
+            self.index.remove(change['documentKey']['_id'])
+            return
+        self.apply_document(document)
+
+    def apply_document(self, document):
+        descriptors = document.get('descriptors') or {}
+        if all(feature in descriptors for feature in self.index.features):
+            self.index.add(document['_id'], document['filename'], descriptors, document.get('category'))
+        elif self.leader and str(document['_id']) not in self.failed:
+            self.pending[str(document['_id'])] = document
+
+    def flush(self):
+        """
+        Ingest the pending documents. Returns False if ingest itself failed.
+        """
+        if not self.pending:
+            return True
+        documents = list(self.pending.values())
+        self.pending = {}
+        if not self.leader:
+            # Lost the lease; the new holder backfills these
+            return True
+        try:
+            self.failed.update(self.ingest(documents))
+        except Exception as e:
+            print(f"[ERROR] Could not ingest {len(documents)} images: {e}")
+            return False
+        return True
+
+    def poll(self):
+        """
+        One polling pass: index images uploaded or given descriptors (indexedAt) since the
+        last pass, compute descriptors for images that lack them and drop deleted images.
+        Unlike change streams, polling does not see other edits to indexed documents
+        unless they set indexedAt, as the Express category update does.
+        The queries rely on the uploadDate, indexedAt and descriptorVersion indexes
+        (created by the app at startup), so a pass reads only the changed documents.
+        """
+        collection = self.get_collection()
+        self.elect()
+        if self.watermark is None:
+            self.watermark = datetime.utcnow()
+        else:
+            # $gte: documents inserted in the same millisecond as the last pass are seen twice,
+            # which only re-adds them, rather than possibly missed
+            since, self.watermark = self.watermark, datetime.utcnow()
+            changed = {'$or': [{'uploadDate': {'$gte': since}}, {'indexedAt': {'$gte': since}}], 'descriptors': {'$exists': True}}
+            for document in collection.find(changed):
+                self.apply_document(document)
+        self.backfill()
+
+        # estimated_document_count reads collection metadata, not the documents. A deletion
+        # offset by an insert in the same pass is caught by the periodic reconcile.
+        count = collection.estimated_document_count()
+        if (
+            self.document_count is not None and count < self.document_count
+            or self.reconciled_at is None or time.monotonic() - self.reconciled_at >= self.reconcile_interval
+        ):
+            self.reconcile()
+        self.document_count = count
+
+    def backfill(self):
+        """
+        Compute descriptors for images that have none, or only older ones, batch_size at
+        a time. Only the lease holder does this.
+        """
+        self.needs_backfill = False
+        if not self.leader:
+            return
+        collection = self.get_collection()
+        if self.version is None:
+            query = {'descriptors': {'$exists': False}}
+        else:
+            # Served by the descriptorVersion index: documents without the field
+            # (never computed, or written before it existed) are indexed as null
+            query = {'descriptorVersion': {'$ne': self.version}}
+        attempted = set()
+        while not self.stopped.is_set():
+            if self.failed:
+                query['_id'] = {'$nin': [ObjectId(image_id) for image_id in self.failed if ObjectId.is_valid(image_id)]}
+            documents = list(collection.find(query, {'filename': 1, 'category': 1}).limit(self.batch_size))
+            if not documents:
+                return
+            # Written documents leave the query; one returned again was not written, and
+            # is skipped like a failure so that the backfill does not loop on it
+            ids = {str(document['_id']) for document in documents}
+            self.failed.update(ids & attempted)
+            attempted = ids
+            for document in documents:
+                self.apply_document(document)
+            if not self.flush():
+                return
+
+    def reconcile(self):
+        """
+        Remove indexed images whose documents no longer exist.
+        """
+        # Images indexed after this snapshot may not be in the query results yet
+        with self.index.lock:
+            indexed = list(self.index.image_ids)
+        existing = {str(document['_id']) for document in self.get_collection().find({}, {'_id': 1})}
+        deleted = [image_id for image_id in indexed if image_id not in existing]
+        for image_id in deleted:
+            self.index.remove(image_id)
+        self.reconciled_at = time.monotonic()
+        return len(deleted)
@@ -0,0 +1,125 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while the queue is at its depth limit.
+    """
+
+
+class Job:
+    def __init__(self, kind, future=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.future = future
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    @property
+    def status(self):
+        if self.done.is_set():
+            return 'failed' if self.error is not None else 'done'
+        if self.future is not None and self.future.running():
+            return 'running'
+        return 'queued'
+
+    def to_dict(self):
+        job = {'job_id': self.id, 'kind': self.kind, 'status': self.status, 'created': self.created}
+        if self.done.is_set():
+            job['finished'] = self.finished
+            if self.error is not None:
+                job['error'] = self.error
+            else:
+                job['result'] = self.result
+        return job
+
+
+class JobQueue:
+    """
+    Bounded queue of CPU-heavy jobs run on a worker pool. At most max_pending jobs may be
+    queued or running; submit raises QueueFull beyond that so callers can push back.
+    Finished jobs are kept for ttl seconds (and at most max_finished of them) for polling.
+    """
+
+    def __init__(self, executor_factory, max_pending=32, ttl=600, max_finished=1000):
+        self.executor_factory = executor_factory
+        self.executor = None
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = self.executor_factory()
+        return self.executor
+
+    def submit(self, kind, fn, *args, on_done=None):
+        """
+        Run fn(*args) on the pool and return its Job. on_done(result) runs in the
+        parent process when it finishes and its return value becomes the job result.
+        """
+        executor = self.get_executor()
+        with self.lock:
+            self._expire()
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"Job queue is full ({self.max_pending} pending jobs)")
+            self.pending += 1
+            job = Job(kind)
+            self.jobs[job.id] = job
+
+        try:
+            job.future = executor.submit(fn, *args)
+        except Exception:
+            with self.lock:
+                self.pending -= 1
+                del self.jobs[job.id]
+            raise
+        job.future.add_done_callback(lambda future: self._finish(job, future, on_done))
+        return job
+
+    def _finish(self, job, future, on_done):
+        try:
+            result = future.result()
+            job.result = on_done(result) if on_done is not None else result
+        except Exception as e:
+            job.error = str(e) or e.__class__.__name__
+        job.finished = time.time()
+        with self.lock:
+            self.pending -= 1
+        job.done.set()
+
+    def get(self, job_id):
+        with self.lock:
+            self._expire()
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        with self.lock:
+            self._expire()
+            running = sum(1 for job in self.jobs.values() if job.status == 'running')
+            return {
+                'pending': self.pending,
+                'running': running,
+                'queued': self.pending - running,
+                'max_pending': self.max_pending,
+                'finished': len(self.jobs) - self.pending,
+            }
+
+    def _expire(self):
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.done.is_set()]
+        excess = len(finished) - self.max_finished
+        for job in finished:
+            if excess > 0 or now - job.finished > self.ttl:
+                del self.jobs[job.id]
+                excess -= 1
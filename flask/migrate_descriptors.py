@@ -0,0 +1,47 @@
+"""
+Convert the descriptors stored in the images collection between storage formats.
+
+Usage: python migrate_descriptors.py --to float16 [--mongo-uri ...] [--db imagesDB]
+       python migrate_descriptors.py --to json      # back to plain float lists
+"""
+import argparse
+
+from pymongo import MongoClient, UpdateOne
+
+from descriptor_codec import STORAGE_FORMATS, encode_descriptors
+
+
+def migrate(images_collection, storage_format, batch_size=500):
+    """
+    Rewrite every image's descriptors in the given format, with one bulk_write per batch.
+    Returns the number of documents modified.
+    """
+    modified = 0
+    operations = []
+    cursor = images_collection.find({'descriptors': {'$exists': True}}, {'descriptors': 1}).batch_size(batch_size)
+    for image in cursor:
+        descriptors = encode_descriptors(image['descriptors'], storage_format)
+        operations.append(UpdateOne({'_id': image['_id']}, {'$set': {'descriptors': descriptors}}))
+        if len(operations) >= batch_size:
+            modified += images_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        modified += images_collection.bulk_write(operations, ordered=False).modified_count
+    return modified
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--to', choices=STORAGE_FORMATS, required=True)
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='imagesDB')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    modified = migrate(client[args.db]['images'], args.to, args.batch_size)
+    print(f"Converted descriptors of {modified} images to '{args.to}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class SearchResultCache:
+    """
+    Short-lived cache of ranked search results, so that paging through them is a dict
+    lookup instead of a new scan. A cursor is "<entry id>.<offset>"; entries expire
+    after ttl seconds and the least recently used ones are dropped beyond max_entries.
+    """
+
+    def __init__(self, ttl=300, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = {'hit': 0, 'miss': 0}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def paginate(self, results, page_size):
+        """
+        Store ranked results and return (first page, cursor of the next page or None).
+        """
+        page_size = max(1, page_size)
+        if len(results) <= page_size:
+            return results, None
+        entry_id = secrets.token_urlsafe(12)
+        with self.lock:
+            self._expire()
+            self.entries[entry_id] = {
+                'results': results,
+                'page_size': page_size,
+                'expires': time.monotonic() + self.ttl,
+            }
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return results[:page_size], f"{entry_id}.{page_size}"
+
+    def page(self, cursor):
+        """
+        Return (page, next cursor or None) for a cursor, or None if it is unknown or expired.
+        """
+        entry_id, _, offset = str(cursor).rpartition('.')
+        if not offset.isdigit():
+            with self.lock:
+                self.hits['miss'] += 1
+            return None
+        offset = int(offset)
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                self.hits['miss'] += 1
+                return None
+            self.hits['hit'] += 1
+            self.entries.move_to_end(entry_id)
+
+        end = offset + entry['page_size']
+        next_cursor = f"{entry_id}.{end}" if end < len(entry['results']) else None
+        return entry['results'][offset:end], next_cursor
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [entry_id for entry_id, entry in self.entries.items() if entry['expires'] <= now]
+        for entry_id in expired:
+            del self.entries[entry_id]
@@ -0,0 +1,111 @@
+import base64
+import json
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+from descriptor_codec import FLOAT32_ONLY
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Response formats for descriptor payloads: 'json' writes each family as a list of
+# float32 values, 'base64' packs it as {'dtype', 'shape', 'data'} with base64 float32
+# bytes inside JSON, and 'msgpack' sends the same structure with raw bytes.
+RESPONSE_FORMATS = ('json', 'base64', 'msgpack')
+MIMETYPES = {'json': 'application/json', 'base64': 'application/json', 'msgpack': 'application/msgpack'}
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def available_formats():
+    return RESPONSE_FORMATS if msgpack is not None else tuple(f for f in RESPONSE_FORMATS if f != 'msgpack')
+
+
+def to_builtin(value):
+    """
+    Fallback for values the JSON encoders do not handle natively.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+def dumps_json(value):
+    """
+    Encode a value as compact JSON bytes, with orjson when it is installed. numpy
+    arrays and scalars are written directly, without converting them to lists first.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=to_builtin, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits or non-contiguous arrays
+    return json.dumps(value, default=to_builtin, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that renders jsonify() responses with dumps_json.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps_json(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_json(obj), mimetype=self.mimetype)
+
+
+def pack_descriptors(descriptors, response_format='json', precision=None):
+    """
+    Convert descriptor families for a response: float32 arrays for JSON, packed
+    {'dtype', 'shape', 'data'} dicts for the binary formats. With precision, values are
+    rounded to that many decimals (except FLOAT32_ONLY families, whose values are tiny).
+    Other entries are left untouched.
+    """
+    packed = {}
+    for name, value in descriptors.items():
+        if isinstance(value, dict):
+            packed[name] = value
+            continue
+        array = np.ascontiguousarray(value, dtype='<f4')
+        if precision is not None and name not in FLOAT32_ONLY:
+            array = np.round(array, precision)
+        if response_format == 'json':
+            packed[name] = array
+        else:
+            data = array.tobytes()
+            packed[name] = {
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'data': base64.b64encode(data).decode('ascii') if response_format == 'base64' else data,
+            }
+    return packed
+
+
+def encode_payload(payload, response_format='json'):
+    """
+    Encode a response body, returning (bytes, mimetype).
+    """
+    if response_format == 'msgpack':
+        if msgpack is None:
+            raise ValueError("The msgpack format needs the msgpack package")
+        return msgpack.packb(payload, use_bin_type=True, default=to_builtin), MIMETYPES['msgpack']
+    return dumps_json(payload), MIMETYPES[response_format]
@@ -0,0 +1,479 @@
+import hashlib
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+# Visualization name -> descriptor it plots (color_histogram is drawn from the image itself)
+VISUALIZATION_KINDS = {
+    "color_histogram": "color_histogram",
+    "dominant_colors": "dominant_colors",
+    "gabor_features": "gabor_features",
+    "hu_moments": "hu_moments",
+    "lbp_histogram": "lbp",
+    "hog_features": "hog",
+    "edge_histogram": "edge_histogram",
+}
+
+# How plots are drawn: 'templates' reuses per-thread matplotlib figures and only updates
+# their data, 'raster' draws them directly with OpenCV, 'pyplot' is the original
+# figure-per-plot code
+VISUALIZATION_BACKENDS = ('templates', 'raster', 'pyplot')
+VISUALIZATION_BACKEND = os.environ.get('VISUALIZATION_BACKEND', 'templates')
+
+# Line and bar plots: kind -> (plot type, title, x label, y label, color)
+PLOT_SPECS = {
+    "color_histogram": ('line', "Color Histogram", "Bins", "Frequency", None),
+    "gabor_features": ('bar', "Gabor Features", "Kernel Index", "Mean Response", 'blue'),
+    "hu_moments": ('bar', "Hu Moments (Log-Scaled)", "Moment Index", "Log Value", 'orange'),
+    "lbp_histogram": ('bar', "LBP Histogram", "Patterns", "Frequency", 'purple'),
+    "hog_features": ('line', "HOG Features", "Feature Index", "Value", 'green'),
+    "edge_histogram": ('bar', "Edge Direction Histogram", "Angle Bins", "Frequency", 'blue'),
+}
+
+
+def pyplot():
+    """
+    matplotlib.pyplot, imported on first use so that processes which never plot (or only
+    use the template and raster backends) don't load it.
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # Use 'Agg' backend for non-interactive plotting
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Visualization functions
+def visualize_dominant_colors(dominant_colors, output_filename):
+    plt = pyplot()
+    colors = [dominant_colors[i:i+3] for i in range(0, len(dominant_colors), 3)]
+    colors = [color[::-1] for color in colors]  # Convert BGR to RGB
+    colors = [np.array(color) / 255.0 for color in colors]  # Normalize
+
+    # Update figure size for a better aspect ratio
+    plt.figure(figsize=(10, 6))  # Larger size with better height
+    for i, color in enumerate(colors):
+        plt.subplot(1, len(colors), i + 1)
+        plt.imshow([[color]])
+        plt.axis('off')
+        plt.title(f"Color {i+1}", fontsize=14)  # Increase font size for better visibility
+
+    plt.tight_layout()
+    plt.savefig(output_filename, dpi=300)  # Higher resolution
+    plt.close()
+
+
+def visualize_color_histogram(image, output_filename):
+    plt = pyplot()
+    color = ('b', 'g', 'r')
+    plt.figure(figsize=(8, 6))
+    for i, col in enumerate(color):
+        histogram = cv2.calcHist([image], [i], None, [256], [0, 256])
+        plt.plot(histogram, color=col)
+    plt.title("Color Histogram")
+    plt.xlabel("Bins")
+    plt.ylabel("Frequency")
+    plt.grid(True)
+    plt.savefig(output_filename)
+    plt.close()
+
+def visualize_gabor_features(gabor_features, output_filename):
+    plt = pyplot()
+    plt.figure(figsize=(8, 6))
+    plt.bar(range(len(gabor_features)), gabor_features, color='blue')
+    plt.title("Gabor Features")
+    plt.xlabel("Kernel Index")
+    plt.ylabel("Mean Response")
+    plt.grid(True)
+    plt.savefig(output_filename)
+    plt.close()
+
+def visualize_hu_moments(hu_moments, output_filename):
+    plt = pyplot()
+    plt.figure(figsize=(8, 6))
+    plt.bar(range(1, len(hu_moments) + 1), -np.log10(np.abs(hu_moments)), color='orange')
+    plt.title("Hu Moments (Log-Scaled)")
+    plt.xlabel("Moment Index")
+    plt.ylabel("Log Value")
+    plt.grid(True)
+    plt.savefig(output_filename)
+    plt.close()
+
+def visualize_lbp_histogram(hist_lbp, output_filename):
+    plt = pyplot()
+    plt.figure(figsize=(8, 6))
+    plt.bar(range(len(hist_lbp)), hist_lbp, color='purple')
+    plt.title("LBP Histogram")
+    plt.xlabel("Patterns")
+    plt.ylabel("Frequency")
+    plt.grid(True)
+    plt.savefig(output_filename)
+    plt.close()
+
+def visualize_hog(hog_features, output_filename):
+    plt = pyplot()
+    plt.figure(figsize=(8, 6))
+    plt.plot(range(len(hog_features)), hog_features, color='green')
+    plt.title("HOG Features")
+    plt.xlabel("Feature Index")
+    plt.ylabel("Value")
+    plt.grid(True)
+    plt.savefig(output_filename)
+    plt.close()
+
+def visualize_edge_histogram(edge_hist, output_filename):
+    plt = pyplot()
+    plt.figure(figsize=(8, 6))
+    plt.bar(range(len(edge_hist)), edge_hist, color='blue')
+    plt.title("Edge Direction Histogram")
+    plt.xlabel("Angle Bins")
+    plt.ylabel("Frequency")
+    plt.grid(True)
+    plt.savefig(output_filename)
+    plt.close()
+
+
+VISUALIZERS = {
+    "dominant_colors": visualize_dominant_colors,
+    "gabor_features": visualize_gabor_features,
+    "hu_moments": visualize_hu_moments,
+    "lbp_histogram": visualize_lbp_histogram,
+    "hog_features": visualize_hog,
+    "edge_histogram": visualize_edge_histogram,
+}
+
+
+def image_fingerprint(image_path):
+    """
+    Short fingerprint of an image file's size and modification time, so visualization
+    names change when the file is replaced without reading its contents.
+    """
+    stat = os.stat(image_path)
+    return hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:10]
+
+
+def visualization_filename(image_filename, kind, fingerprint):
+    """
+    Per-image-version file name for a visualization, e.g. 'photo.jpg.3f2a9c01de_hog_features.png'.
+    """
+    return f"{os.path.basename(image_filename)}.{fingerprint}_{kind}.png"
+
+
+def parse_visualization_filename(filename):
+    """
+    Split a visualization file name back into (image basename, fingerprint, kind),
+    or (None, None, None).
+    """
+    for kind in VISUALIZATION_KINDS:
+        suffix = f"_{kind}.png"
+        if filename.endswith(suffix):
+            image_name, _, fingerprint = filename[:-len(suffix)].rpartition('.')
+            if image_name and fingerprint:
+                return image_name, fingerprint, kind
+    return None, None, None
+
+
+def plot_series(kind, image, descriptors):
+    """
+    x values and [(y values, color)] of a line or bar plot, as the pyplot functions draw them.
+    """
+    if kind == "color_histogram":
+        x = np.arange(256)
+        return x, [
+            (cv2.calcHist([image], [i], None, [256], [0, 256]).ravel(), color)
+            for i, color in enumerate(('b', 'g', 'r'))
+        ]
+    values = np.asarray(descriptors[VISUALIZATION_KINDS[kind]], dtype=np.float64).ravel()
+    if kind == "hu_moments":
+        # Floor zero moments so they don't become infinite bars
+        values = -np.log10(np.maximum(np.abs(values), np.finfo(np.float64).tiny))
+        return np.arange(1, len(values) + 1), [(values, PLOT_SPECS[kind][4])]
+    return np.arange(len(values)), [(values, PLOT_SPECS[kind][4])]
+
+
+def dominant_colors_rgb(dominant_colors):
+    colors = np.asarray(dominant_colors, dtype=np.float64).reshape(-1, 3)
+    return np.clip(colors[:, ::-1] / 255.0, 0, 1)  # BGR to RGB in [0, 1]
+
+
+def new_figure(figsize):
+    """
+    A matplotlib figure on its own Agg canvas, without pyplot.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+class FigureTemplates:
+    """
+    Pre-built matplotlib figures (object-oriented Agg API, no pyplot state), one set per
+    thread. Rendering only updates the artists' data and rescales the axes, so the figure,
+    axes, labels and layout are built once per plot kind and shape.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def render(self, kind, image, descriptors, output_filename):
+        if kind == "dominant_colors":
+            colors = dominant_colors_rgb(descriptors[VISUALIZATION_KINDS[kind]])
+            figure, images = self.template(('dominant_colors', len(colors)), self.build_swatches, len(colors))
+            for artist, color in zip(images, colors):
+                artist.set_data([[color]])
+            figure.savefig(output_filename, dpi=300)
+            return
+
+        x, series = plot_series(kind, image, descriptors)
+        plot_type = PLOT_SPECS[kind][0]
+        key = (kind, len(x)) if plot_type == 'bar' else (kind,)
+        figure, axes, artists = self.template(key, self.build_plot, kind, x, series)
+        if plot_type == 'bar':
+            for rect, height in zip(artists[0], series[0][0]):
+                rect.set_height(height)
+        else:
+            for line, (values, _) in zip(artists, series):
+                line.set_data(x, values)
+        axes.relim()
+        axes.autoscale_view()
+        figure.savefig(output_filename)
+
+    def template(self, key, build, *args):
+        templates = getattr(self.local, 'templates', None)
+        if templates is None:
+            templates = self.local.templates = {}
+        if key not in templates:
+            templates[key] = build(*args)
+        return templates[key]
+
+    def build_plot(self, kind, x, series):
+        plot_type, title, xlabel, ylabel, _ = PLOT_SPECS[kind]
+        figure = new_figure((8, 6))
+        axes = figure.add_subplot()
+        if plot_type == 'bar':
+            artists = [axes.bar(x, np.zeros(len(x)), color=series[0][1])]
+        else:
+            artists = [axes.plot(x, np.zeros(len(x)), color=color)[0] for _, color in series]
+        axes.set_title(title)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        axes.grid(True)
+        return figure, axes, artists
+
+    def build_swatches(self, count):
+        figure = new_figure((10, 6))
+        images = []
+        for i in range(count):
+            axes = figure.add_subplot(1, count, i + 1)
+            images.append(axes.imshow([[np.zeros(3)]]))
+            axes.axis('off')
+            axes.set_title(f"Color {i+1}", fontsize=14)
+        figure.tight_layout()
+        return figure, images
+
+
+figure_templates = FigureTemplates()
+
+
+# Raster renderer: plots drawn straight into a numpy image with OpenCV
+RASTER_COLORS = {
+    'b': (255, 0, 0), 'blue': (255, 0, 0), 'g': (0, 128, 0), 'green': (0, 128, 0),
+    'r': (0, 0, 255), 'orange': (0, 165, 255), 'purple': (128, 0, 128),
+}
+RASTER_SIZE = (800, 600)
+RASTER_MARGINS = (100, 20, 50, 60)  # left, right, top, bottom
+RASTER_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def raster_text(canvas, text, center, scale=0.5, thickness=1, align='center'):
+    (width, height), _ = cv2.getTextSize(text, RASTER_FONT, scale, thickness)
+    x = center[0] - width if align == 'right' else center[0] - width / 2
+    origin = (int(x), int(center[1] + height / 2))
+    cv2.putText(canvas, text, origin, RASTER_FONT, scale, (0, 0, 0), thickness, cv2.LINE_AA)
+
+
+def raster_plot(kind, x, series, output_filename):
+    """
+    Draw a bar or line plot with axes, grid, tick labels and titles using OpenCV.
+    """
+    plot_type, title, xlabel, ylabel, _ = PLOT_SPECS[kind]
+    width, height = RASTER_SIZE
+    left, right, top, bottom = RASTER_MARGINS
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    plot_width, plot_height = width - left - right, height - top - bottom
+
+    values = [np.nan_to_num(np.asarray(y, dtype=np.float64)) for y, _ in series]
+    low = min([v.min() for v in values if len(v)], default=0.0)
+    high = max([v.max() for v in values if len(v)], default=1.0)
+    if plot_type == 'bar':
+        low, high = min(low, 0.0), max(high, 0.0)
+    if high <= low:
+        high = low + 1.0
+    x_low, x_high = (float(x[0]), float(x[-1])) if len(x) else (0.0, 1.0)
+    if plot_type == 'bar':
+        x_low, x_high = x_low - 0.5, x_high + 0.5
+    if x_high <= x_low:
+        x_high = x_low + 1.0
+
+    def to_pixels(xs, ys):
+        px = left + (np.asarray(xs, dtype=np.float64) - x_low) / (x_high - x_low) * plot_width
+        py = top + (high - np.asarray(ys, dtype=np.float64)) / (high - low) * plot_height
+        return px, py
+
+    # Grid and y tick labels
+    for tick in np.linspace(low, high, 6):
+        _, py = to_pixels([x_low], [tick])
+        y = int(round(py[0]))
+        cv2.line(canvas, (left, y), (width - right, y), (225, 225, 225), 1)
+        label = f"{tick:.0f}" if abs(tick) >= 1000 else f"{tick:.3g}"
+        raster_text(canvas, label, (left - 6, y), 0.4, align='right')
+    x_ticks = x if len(x) <= 10 else np.unique(np.round(np.linspace(x[0], x[-1], 6)))
+    for tick in x_ticks:
+        px, _ = to_pixels([tick], [low])
+        cv2.line(canvas, (int(round(px[0])), top), (int(round(px[0])), height - bottom), (225, 225, 225), 1)
+        raster_text(canvas, f"{tick:.3g}", (int(round(px[0])), height - bottom + 15), 0.4)
+
+    for y_values, (_, color) in zip(values, series):
+        bgr = RASTER_COLORS.get(color, (0, 0, 0))
+        if plot_type == 'bar':
+            half = 0.4 * plot_width / max(len(x), 1)
+            px, py = to_pixels(x, y_values)
+            _, zero = to_pixels([x_low], [0.0])
+            for cx, cy in zip(px, py):
+                cv2.rectangle(canvas, (int(cx - half), int(min(cy, zero[0]))), (int(cx + half), int(max(cy, zero[0]))), bgr, -1)
+        elif len(y_values):
+            px, py = to_pixels(x, y_values)
+            points = np.stack([px, py], axis=1).round().astype(np.int32)
+            cv2.polylines(canvas, [points], False, bgr, 1, cv2.LINE_AA)
+
+    cv2.rectangle(canvas, (left, top), (width - right, height - bottom), (0, 0, 0), 1)
+    raster_text(canvas, title, (width // 2, top // 2), 0.7, 2)
+    raster_text(canvas, xlabel, (left + plot_width // 2, height - bottom // 3))
+    # Rotated y label: draw it on a strip and turn the strip sideways
+    strip = np.full((30, plot_height, 3), 255, dtype=np.uint8)
+    raster_text(strip, ylabel, (plot_height // 2, 15))
+    canvas[top:top + plot_height, 5:35] = np.rot90(strip)
+    cv2.imwrite(output_filename, canvas)
+
+
+def raster_swatches(dominant_colors, output_filename):
+    colors = np.asarray(dominant_colors, dtype=np.float64).reshape(-1, 3)
+    width, height = RASTER_SIZE
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    count = max(len(colors), 1)
+    size = min(width // count - 20, height - 100)
+    for i, color in enumerate(colors):
+        center = int((i + 0.5) * width / count)
+        y = (height - size) // 2
+        cv2.rectangle(canvas, (center - size // 2, y), (center + size // 2, y + size), tuple(int(c) for c in np.clip(color, 0, 255)), -1)
+        raster_text(canvas, f"Color {i+1}", (center, y - 20), 0.7, 2)
+    cv2.imwrite(output_filename, canvas)
+
+
+def render_visualization(kind, image, descriptors, output_filename, backend=None):
+    """
+    Render a single visualization from an image and its precomputed descriptors.
+    """
+    backend = backend or VISUALIZATION_BACKEND
+    if backend == 'templates':
+        figure_templates.render(kind, image, descriptors, output_filename)
+    elif backend == 'raster':
+        if kind == "dominant_colors":
+            raster_swatches(descriptors[VISUALIZATION_KINDS[kind]], output_filename)
+        else:
+            raster_plot(kind, *plot_series(kind, image, descriptors), output_filename)
+    elif kind == "color_histogram":
+        visualize_color_histogram(image, output_filename)
+    else:
+        VISUALIZERS[kind](descriptors[VISUALIZATION_KINDS[kind]], output_filename)
+
+
+def render_visualization_task(kind, image_path, descriptors, output_filename):
+    """
+    Render one visualization of an image file, loading the pixels or computing the
+    descriptors it needs. Safe to run in a worker process; returns (image_path, descriptors),
+    with descriptors None when they were not needed.
+    """
+    from descriptors import compute_descriptors, load_image
+
+    image = None
+    if kind == "color_histogram":
+        image, error = load_image(image_path)
+        if error:
+            raise ValueError(error)
+    elif descriptors is None:
+        # A hash lookup when the image was already processed
+        descriptors, error = compute_descriptors(image_path)
+        if error:
+            raise ValueError(error)
+
+    # Render next to the target and rename, so readers never see a half-written file
+    root, extension = os.path.splitext(output_filename)
+    temporary = f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{extension}"
+    render_visualization(kind, image, descriptors, temporary)
+    os.replace(temporary, output_filename)
+    return image_path, descriptors
+
+
+class VisualizationCollector:
+    """
+    Background thread that deletes rendered visualizations not used for ttl seconds and,
+    when the folder is over max_bytes, the least recently used ones down to 90% of it.
+    Served files are touched, so their modification time tracks their last use.
+    """
+
+    def __init__(self, folder, ttl=3600, max_bytes=200 * 1024 * 1024, interval=300):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='visualization-collector', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"[ERROR] Visualization cleanup failed: {e}")
+
+    def collect(self):
+        """
+        Run one collection pass and return the number of files removed.
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9 if total > self.max_bytes else float('inf')
+        removed = 0
+        for path, size, mtime in entries:
+            stale = now - mtime > self.ttl
+            # Files still being rendered are only removed once stale
+            if not stale and (total <= target or '.tmp.' in os.path.basename(path)):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
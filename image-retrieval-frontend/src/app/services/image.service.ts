@@ -94,6 +94,41 @@ export class ImageService {
       }
     );
   }
+  weightedSearch(payload: {
+    query_descriptors: any;
+    weights?: { [feature: string]: number };
+    metrics?: string | { [feature: string]: string };
+    max_results?: number;
+  }): Observable<any> {
+    return this.http.post(
+      `${this.flaskApi}/descriptors/weighted-search`,
+      payload,
+      {
+        headers: { 'Content-Type': 'application/json' },
+      }
+    );
+  }
+  searchByImage(
+    image: File,
+    options: {
+      search?: 'simple' | 'weighted' | 'feedback';
+      max_results?: number;
+      weights?: { [feature: string]: number };
+      metrics?: string | { [feature: string]: string };
+      include_descriptors?: boolean;
+    } = {}
+  ): Observable<any> {
+    const formData = new FormData();
+    formData.append('image', image);
+    Object.entries(options).forEach(([key, value]) => {
+      if (value === undefined) return;
+      formData.append(
+        key,
+        typeof value === 'object' || key === 'metrics' ? JSON.stringify(value) : String(value)
+      );
+    });
+    return this.http.post(`${this.flaskApi}/search/by-image`, formData);
+  }
   submitFeedback(payload: {
     image_id: string;
     feedback: string;